@@ -0,0 +1,240 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Vendor and agency monthly aggregates
+
+vendor_monthly (tenderer_id, month) and agency_monthly (org_id, month) hold the bid, win and award
+amount totals of award notices, by the month of the awarding date (or of the announcement when the
+awarding date is missing). The loader keeps them up to date with --aggregates: before a batch is
+written, the stored rows of its bids are read, merged with the new rows the way the upserts will
+merge them, and only the difference of the two is added to the aggregates, in the same transaction.
+A revised notice thus moves its amounts instead of counting them twice.
+
+`aggregates.py --rebuild` recomputes both tables from the fact tables, `--verify` compares them."""
+
+import logging
+import mysql.connector
+from decimal import Decimal
+from optparse import OptionParser
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 500
+
+_MONTH_SQL = "DATE_FORMAT(COALESCE(a.awarding_date, a.awarding_announce_date), '%Y-%m-01')"
+
+_VENDOR_SQL = ('SELECT t.tenderer_id, ' + _MONTH_SQL + ' AS month, COUNT(*),'
+               " SUM(t.is_awarded = '1'), SUM(IF(t.is_awarded = '1', COALESCE(t.award_price, 0), 0))"
+               ' FROM tender_info t JOIN award_info a'
+               ' ON a.pk_atm_main = t.pk_atm_main AND a.tender_case_no = t.tender_case_no'
+               " WHERE t.tenderer_id IS NOT NULL AND t.tenderer_id <> ''"
+               ' AND COALESCE(a.awarding_date, a.awarding_announce_date) IS NOT NULL'
+               ' GROUP BY t.tenderer_id, month')
+
+_AGENCY_SQL = ('SELECT o.org_id, ' + _MONTH_SQL + ' AS month, COUNT(DISTINCT a.pk_atm_main, a.tender_case_no),'
+               " COUNT(t.tender_sn), COALESCE(SUM(t.is_awarded = '1'), 0),"
+               " COALESCE(SUM(IF(t.is_awarded = '1', COALESCE(t.award_price, 0), 0)), 0)"
+               ' FROM organization_info o JOIN award_info a'
+               ' ON a.pk_atm_main = o.pk_atm_main AND a.tender_case_no = o.tender_case_no'
+               ' LEFT JOIN tender_info t'
+               ' ON t.pk_atm_main = o.pk_atm_main AND t.tender_case_no = o.tender_case_no'
+               " WHERE o.org_id IS NOT NULL AND o.org_id <> ''"
+               ' AND COALESCE(a.awarding_date, a.awarding_announce_date) IS NOT NULL'
+               ' GROUP BY o.org_id, month')
+
+
+def is_awarded(v):
+    return v is True or str(v) in ('1', 'True')
+
+
+def month_of(award):
+    d = award.get('awarding_date') or award.get('awarding_announce_date')
+    return '{:04d}-{:02d}-01'.format(d.year, d.month) if d else None
+
+
+def empty_state():
+    return {'org_id': None, 'award': {}, 'tenders': {}}
+
+
+def read_state(cur, keys):
+    """Stored rows of the given bids: {(pk_atm_main, tender_case_no): state}."""
+    states = {k: empty_state() for k in keys}
+    for i in range(0, len(keys), _CHUNK_SIZE):
+        chunk = keys[i:i + _CHUNK_SIZE]
+        where = ' WHERE (pk_atm_main, tender_case_no) IN (' + ','.join(['(%s,%s)'] * len(chunk)) + ')'
+        params = [v for k in chunk for v in k]
+
+        cur.execute('SELECT pk_atm_main, tender_case_no, org_id FROM organization_info' + where, params)
+        for pk_atm_main, tender_case_no, org_id in cur.fetchall():
+            states[(pk_atm_main, tender_case_no)]['org_id'] = org_id
+        cur.execute('SELECT pk_atm_main, tender_case_no, awarding_date, awarding_announce_date FROM award_info' +
+                    where, params)
+        for pk_atm_main, tender_case_no, awarding_date, awarding_announce_date in cur.fetchall():
+            states[(pk_atm_main, tender_case_no)]['award'] = {'awarding_date': awarding_date,
+                                                              'awarding_announce_date': awarding_announce_date}
+        cur.execute('SELECT pk_atm_main, tender_case_no, tender_sn, tenderer_id, is_awarded, award_price'
+                    ' FROM tender_info' + where, params)
+        for pk_atm_main, tender_case_no, tender_sn, tenderer_id, awarded, award_price in cur.fetchall():
+            states[(pk_atm_main, tender_case_no)]['tenders'][tender_sn] = {'tenderer_id': tenderer_id,
+                                                                          'is_awarded': awarded,
+                                                                          'award_price': award_price}
+    return states
+
+
+def _merge(old, row, columns):
+    merged = dict(old or {})
+    for c in columns:
+        if row.get(c) is not None:
+            merged[c] = row.get(c)
+    return merged
+
+
+def merge_state(states, rows):
+    """The state of the bids once the rows are upserted: non-null columns replace the stored ones."""
+    merged = {k: {'org_id': s['org_id'], 'award': dict(s['award']), 'tenders': dict(s['tenders'])}
+              for k, s in states.items()}
+    for table, row in rows:
+        key = (row.get('pk_atm_main'), row.get('tender_case_no'))
+        if key not in merged:
+            continue
+        state = merged[key]
+        if table == 'organization_info' and row.get('org_id') is not None:
+            state['org_id'] = row.get('org_id')
+        elif table == 'award_info':
+            state['award'] = _merge(state['award'], row, ('awarding_date', 'awarding_announce_date'))
+        elif table == 'tender_info':
+            sn = row.get('tender_sn')
+            state['tenders'][sn] = _merge(state['tenders'].get(sn), row, ('tenderer_id', 'is_awarded', 'award_price'))
+    return merged
+
+
+def contributions(state, totals, sign=1):
+    """Add (or subtract) what one bid counts in the aggregates to totals."""
+    month = month_of(state['award'])
+    if month is None:
+        return
+
+    tenders = state['tenders'].values()
+    if state['org_id']:
+        agency = totals.setdefault(('agency_monthly', state['org_id'], month), [0, 0, 0, Decimal(0)])
+        agency[0] += sign
+    for tender in tenders:
+        won = is_awarded(tender.get('is_awarded'))
+        amount = Decimal(tender.get('award_price') or 0) if won else Decimal(0)
+        if state['org_id']:
+            agency[1] += sign
+            agency[2] += sign if won else 0
+            agency[3] += sign * amount
+        if tender.get('tenderer_id'):
+            vendor = totals.setdefault(('vendor_monthly', tender['tenderer_id'], month), [0, 0, Decimal(0)])
+            vendor[0] += sign
+            vendor[1] += sign if won else 0
+            vendor[2] += sign * amount
+
+
+def apply_deltas(cur, rows):
+    """Update the aggregates for the (table, row) pairs about to be upserted. Returns the groups changed."""
+    keys = sorted({(row.get('pk_atm_main'), row.get('tender_case_no')) for table, row in rows
+                   if table in ('organization_info', 'award_info', 'tender_info')})
+    if not keys:
+        return 0
+
+    old = read_state(cur, keys)
+    new = merge_state(old, rows)
+    totals = {}
+    for key in keys:
+        contributions(old[key], totals, -1)
+        contributions(new[key], totals, 1)
+
+    changed = 0
+    # In key order, so that concurrent writers lock the groups in the same order
+    for (table, group_id, month), values in sorted(totals.items()):
+        if not any(values):
+            continue
+        if table == 'vendor_monthly':
+            cur.execute('INSERT INTO vendor_monthly (tenderer_id, month, bid_count, win_count, award_amount)'
+                        ' VALUES (%s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE'
+                        ' bid_count = bid_count + VALUES(bid_count), win_count = win_count + VALUES(win_count),'
+                        ' award_amount = award_amount + VALUES(award_amount)',
+                        [group_id, month] + values)
+        else:
+            cur.execute('INSERT INTO agency_monthly (org_id, month, tender_count, bid_count, win_count, award_amount)'
+                        ' VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE'
+                        ' tender_count = tender_count + VALUES(tender_count), bid_count = bid_count + VALUES(bid_count),'
+                        ' win_count = win_count + VALUES(win_count), award_amount = award_amount + VALUES(award_amount)',
+                        [group_id, month] + values)
+        changed += 1
+    return changed
+
+
+def rebuild(cnx):
+    cur = cnx.cursor()
+    cur.execute('DELETE FROM vendor_monthly')
+    cur.execute('INSERT INTO vendor_monthly (tenderer_id, month, bid_count, win_count, award_amount) ' + _VENDOR_SQL)
+    cur.execute('DELETE FROM agency_monthly')
+    cur.execute('INSERT INTO agency_monthly (org_id, month, tender_count, bid_count, win_count, award_amount) ' +
+                _AGENCY_SQL)
+    cnx.commit()
+
+
+def verify(cnx):
+    """Compare the aggregate tables with a full recomputation. Returns the number of mismatched groups."""
+    cur = cnx.cursor()
+    mismatches = 0
+    for table, sql, columns in (
+            ('vendor_monthly', _VENDOR_SQL, 'tenderer_id, month, bid_count, win_count, award_amount'),
+            ('agency_monthly', _AGENCY_SQL, 'org_id, month, tender_count, bid_count, win_count, award_amount')):
+        cur.execute(sql)
+        expected = {(r[0], str(r[1])): tuple(int(v) for v in r[2:]) for r in cur.fetchall()}
+        cur.execute('SELECT ' + columns + ' FROM ' + table)
+        stored = {(r[0], str(r[1])): tuple(int(v) for v in r[2:]) for r in cur.fetchall() if any(r[2:])}
+        for key in set(expected) | set(stored):
+            if expected.get(key) != stored.get(key):
+                mismatches += 1
+                logger.warning('{} {}: stored {}, expected {}'.format(table, key, stored.get(key), expected.get(key)))
+    return mismatches
+
+
+def parse_args():
+    p = OptionParser()
+    p.add_option('-u', '--user', action='store',
+                 dest='user', type='string', default='')
+    p.add_option('-p', '--password', action='store',
+                 dest='password', type='string', default='')
+    p.add_option('-i', '--host', action='store',
+                 dest='host', type='string', default='')
+    p.add_option('-b', '--database', action='store',
+                 dest='database', type='string', default='')
+    p.add_option('-o', '--port', action='store',
+                 dest='port', type='string', default='3306')
+    p.add_option('--rebuild', action='store_true',
+                 dest='rebuild')
+    p.add_option('--verify', action='store_true',
+                 dest='verify')
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    options, remainder = parse_args()
+
+    db_config = {'user': options.user.strip(),
+                 'password': options.password.strip(),
+                 'host': options.host.strip(),
+                 'port': options.port.strip(),
+                 'database': options.database.strip()
+                 }
+    if '' in db_config.values():
+        logger.error('Database connection information is incomplete.')
+        quit()
+
+    db_connection = mysql.connector.connect(**db_config)
+    if options.rebuild:
+        logger.info('Rebuilding vendor_monthly and agency_monthly...')
+        rebuild(db_connection)
+    if options.verify or not options.rebuild:
+        n = verify(db_connection)
+        logger.info('{} mismatched group(s).'.format(n) if n else 'Aggregates are consistent.')
+    db_connection.close()
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Micro-benchmark of the field converters
+
+Converts the same synthetic columns (dates, amounts, yes/no fields, counts and telephone numbers,
+drawn from a limited set of distinct values as on real pages) with the converters as they were
+(pattern strings matched on every call), with converters.py value by value, and with
+converters.convert_column, and checks that all three give the same results."""
+
+import re
+import time
+import random
+import logging
+import converters
+from optparse import OptionParser
+from datetime import datetime, date
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# The converters before converters.py, for reference
+def legacy_yesno_conversion(element):
+    m = re.match(r'.*是.*', element.strip())
+    return m is not None
+
+
+def legacy_int_conversion(element):
+    m = re.match(r'-?([\d,\.]+)', ''.join(element.split()))
+    return int(''.join(m.group(0).split(',')))
+
+
+def legacy_date_conversion(element):
+    m = re.match(r'(?P<date>\d+/\d+/\d+)(\s+)*(?P<time>\d+:\d+)?', element.strip())
+    if m is not None:
+        d = [int(n) for n in m.group('date').split('/')]
+        t = [int(n) for n in m.group('time').split(':')] if m.group('time') is not None else None
+        if d[0] != '':
+            if t is not None:
+                return datetime(d[0] + 1911, d[1], d[2], hour=t[0], minute=t[1])
+            else:
+                return date(d[0] + 1911, d[1], d[2])
+    return None
+
+
+def legacy_money_conversion(element):
+    m = re.match(r'\$?-?([\d,\.]+)', ''.join(element.split()))
+    return int(''.join(m.group(0).split(',')))
+
+
+def legacy_tel_conversion(element):
+    m = re.match(r'(\((?P<area>\d+)\))?\s*(?P<number>\**\d*\**)(\s*分機\s*(?P<extension>\**\d*\**))?', element.strip())
+    outstr = ''
+    if m.group('area') is not None:
+        outstr += m.group('area') + '-'
+    if m.group('number') is not None:
+        outstr += m.group('number')
+    if m.group('extension') is not None:
+        outstr += ' ext ' + m.group('extension')
+    return outstr
+
+
+def make_columns(rows, distinct, seed=0):
+    """Columns of raw values as read from the pages, with the given number of distinct values each."""
+    rnd = random.Random(seed)
+    vocabularies = {
+        'date': ['\n\t\t{}/{:02d}/{:02d}{}\n'.format(rnd.randint(100, 108), rnd.randint(1, 12), rnd.randint(1, 28),
+                                                   rnd.choice(['', ' 10:00', ' 14:30'])) for _ in range(distinct)],
+        'money': ['\n\t{:,}元\n'.format(rnd.randint(1000, 10 ** 9)) for _ in range(distinct)],
+        'yesno': ['\n\t是\n', '\n\t否\n', '\n\t否，本案不適用\n'],
+        'int': ['\n\t{}\n'.format(rnd.randint(0, 20)) for _ in range(min(distinct, 21))],
+        'tel': ['({:02d}){:08d} 分機 {}'.format(rnd.randint(2, 8), rnd.randint(0, 10 ** 8), rnd.randint(100, 999))
+                for _ in range(distinct)]}
+    return {name: [rnd.choice(values) for _ in range(rows)] for name, values in vocabularies.items()}
+
+
+converter_pairs = {
+    'date': (legacy_date_conversion, converters.date_conversion),
+    'money': (legacy_money_conversion, converters.money_conversion),
+    'yesno': (legacy_yesno_conversion, converters.yesno_conversion),
+    'int': (legacy_int_conversion, converters.int_conversion),
+    'tel': (legacy_tel_conversion, converters.tel_conversion)}
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return time.perf_counter() - start, result
+
+
+def run(rows, distinct, rounds):
+    columns = make_columns(rows, distinct)
+    for name, (legacy, converter) in converter_pairs.items():
+        values = columns[name]
+        best = {'legacy': None, 'cached': None, 'column': None}
+        for _ in range(rounds):
+            converters.clear_caches()
+            t_legacy, expected = timed(lambda: [legacy(v) for v in values])
+            t_cached, cached = timed(lambda: [converter(v) for v in values])
+            converters.clear_caches()
+            t_column, column = timed(converters.convert_column, converter, values)
+            if cached != expected or column != expected:
+                raise AssertionError('Results of {} differ'.format(name))
+            for k, t in (('legacy', t_legacy), ('cached', t_cached), ('column', t_column)):
+                best[k] = t if best[k] is None else min(best[k], t)
+        print('{:6s} legacy {:8.1f} ms   cached {:8.1f} ms (x{:.1f})   column {:8.1f} ms (x{:.1f})'.format(
+            name, best['legacy'] * 1000, best['cached'] * 1000, best['legacy'] / best['cached'],
+            best['column'] * 1000, best['legacy'] / best['column']))
+
+
+def parse_args():
+    p = OptionParser()
+    p.add_option('-n', '--rows', action='store',
+                 dest='rows', type='int', default=100000)
+    p.add_option('-d', '--distinct', action='store',
+                 dest='distinct', type='int', default=2000)
+    p.add_option('-r', '--rounds', action='store',
+                 dest='rounds', type='int', default=3)
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    options, remainder = parse_args()
+
+    logger.info('{} value(s) per column, {} distinct, best of {} round(s)'.format(options.rows, options.distinct,
+                                                                                  options.rounds))
+    run(options.rows, options.distinct, options.rounds)
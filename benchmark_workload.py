@@ -0,0 +1,173 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Latency of the workload.sql queries before and after migrate.py
+
+Run against a scratch database: the tables of schema.sql are created if missing and, when
+award_info is empty, filled with a generated dataset (--cases award notices with their
+organization, procurement and tender rows, plus as many declarations). The workload is timed
+with the primary keys only, then again once the secondary indexes of migrate.py are in place.
+The median of --repeat runs is reported."""
+
+import os
+import re
+import time
+import random
+import logging
+import datetime as dt
+import mysql.connector
+import migrate
+from optparse import OptionParser
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCHEMA_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+_CHUNK_SIZE = 1000
+
+
+def create_tables(cur, schema_filename=SCHEMA_FILENAME):
+    with open(schema_filename, 'r', encoding='utf-8') as f:
+        statements = [s.strip() for s in f.read().split(';')]
+    for sql in statements:
+        m = re.match(r'CREATE TABLE `(\w+)`', sql)
+        if m is not None:
+            cur.execute(sql.replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS', 1))
+
+
+def insert_rows(cur, table, columns, rows):
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(columns), ', '.join(['%s'] * len(columns)))
+    for i in range(0, len(rows), _CHUNK_SIZE):
+        cur.executemany(sql, rows[i:i + _CHUNK_SIZE])
+
+
+def generate(cnx, cases, agencies=2000, vendors=50000, years=5, seed=0):
+    """Fill the tables with synthetic award notices and declarations."""
+    rnd = random.Random(seed)
+    cur = cnx.cursor()
+    first_day = dt.date.today() - dt.timedelta(days=365 * years)
+    for start in range(0, cases, _CHUNK_SIZE * 10):
+        org, proc, award, tender, decl = [], [], [], [], []
+        for n in range(start, min(start + _CHUNK_SIZE * 10, cases)):
+            pk, case_no = '{:08d}'.format(n), 'C{:08d}'.format(n)
+            org_id = 'A{:05d}'.format(rnd.randrange(agencies))
+            published = first_day + dt.timedelta(days=rnd.randrange(365 * years))
+            opening = dt.datetime.combine(published + dt.timedelta(days=rnd.randint(7, 30)), dt.time(10))
+            awarded = opening.date() + dt.timedelta(days=rnd.randint(0, 20))
+            announced = awarded + dt.timedelta(days=rnd.randint(1, 10))
+            org.append((pk, case_no, org_id, 'Agency ' + org_id))
+            proc.append((pk, case_no, 'Subject {}'.format(n), opening, rnd.randint(10 ** 5, 10 ** 8)))
+            total = 0
+            for sn in range(1, rnd.randint(1, 5) + 1):
+                price = rnd.randint(10 ** 5, 10 ** 8)
+                is_awarded = '1' if sn == 1 else '0'
+                total += price if sn == 1 else 0
+                tender.append((pk, case_no, sn, 'V{:07d}'.format(rnd.randrange(vendors)), is_awarded, price))
+            award.append((pk, case_no, awarded, announced, total))
+            decl.append(('D{:08d}'.format(n), case_no, org_id, published, rnd.randint(10 ** 5, 10 ** 8)))
+        insert_rows(cur, 'organization_info', ('pk_atm_main', 'tender_case_no', 'org_id', 'org_name'), org)
+        insert_rows(cur, 'procurement_info', ('pk_atm_main', 'tender_case_no', 'subject_of_procurement',
+                                              'opening_date', 'budget_amount'), proc)
+        insert_rows(cur, 'award_info', ('pk_atm_main', 'tender_case_no', 'awarding_date', 'awarding_announce_date',
+                                        'total_award_price'), award)
+        insert_rows(cur, 'tender_info', ('pk_atm_main', 'tender_case_no', 'tender_sn', 'tenderer_id', 'is_awarded',
+                                         'award_price'), tender)
+        insert_rows(cur, 'tender_declaration_info', ('primary_key', 'tender_case_no', 'org_id', 'publication_date',
+                                                     'budget_amount'), decl)
+        cnx.commit()
+        logger.info('{} / {} case(s) generated'.format(min(start + _CHUNK_SIZE * 10, cases), cases))
+    cur.execute('ANALYZE TABLE organization_info, procurement_info, award_info, tender_info, tender_declaration_info')
+    cur.fetchall()
+
+
+def sample_params(cnx, seed=1):
+    """Parameters of the workload queries, taken from the data."""
+    rnd = random.Random(seed)
+    cur = cnx.cursor()
+    cur.execute('SELECT MIN(awarding_date), MAX(awarding_date) FROM award_info')
+    first, last = cur.fetchone()
+    day = first + dt.timedelta(days=rnd.randrange(max((last - first).days - 30, 1)))
+    cur.execute('SELECT org_id FROM organization_info LIMIT 1 OFFSET %s', (rnd.randrange(1000),))
+    org_id = cur.fetchone()[0]
+    cur.execute('SELECT tenderer_id FROM tender_info LIMIT 1 OFFSET %s', (rnd.randrange(1000),))
+    tenderer_id = cur.fetchone()[0]
+    return {'date_start': day, 'date_end': day + dt.timedelta(days=7),
+            'month_start': migrate.month_start(day), 'month_end': migrate.next_month(day),
+            'org_id': org_id, 'tenderer_id': tenderer_id}
+
+
+def time_workload(cnx, params, repeat, workload_filename=migrate.WORKLOAD_FILENAME):
+    """Median latency in ms of every workload query."""
+    cur = cnx.cursor()
+    latencies = {}
+    for name, sql in migrate.read_workload(workload_filename):
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cur.execute(sql, params)
+            cur.fetchall()
+            runs.append((time.perf_counter() - start) * 1000)
+        latencies[name] = sorted(runs)[len(runs) // 2]
+    return latencies
+
+
+def parse_args():
+    p = OptionParser()
+    p.add_option('-u', '--user', action='store',
+                 dest='user', type='string', default='')
+    p.add_option('-p', '--password', action='store',
+                 dest='password', type='string', default='')
+    p.add_option('-i', '--host', action='store',
+                 dest='host', type='string', default='')
+    p.add_option('-b', '--database', action='store',
+                 dest='database', type='string', default='')  # A scratch database
+    p.add_option('-o', '--port', action='store',
+                 dest='port', type='string', default='3306')
+    p.add_option('-n', '--cases', action='store',
+                 dest='cases', type='int', default=200000)
+    p.add_option('-r', '--repeat', action='store',
+                 dest='repeat', type='int', default=5)
+    p.add_option('-w', '--workload', action='store',
+                 dest='workload', type='string', default=migrate.WORKLOAD_FILENAME)
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    options, remainder = parse_args()
+
+    db_config = {'user': options.user.strip(),
+                 'password': options.password.strip(),
+                 'host': options.host.strip(),
+                 'port': options.port.strip(),
+                 'database': options.database.strip()
+                 }
+    if '' in db_config.values():
+        logger.error('Database connection information is incomplete.')
+        quit()
+
+    db_connection = mysql.connector.connect(**db_config)
+    cursor = db_connection.cursor()
+    create_tables(cursor)
+    cursor.execute('SELECT COUNT(*) FROM award_info')
+    if cursor.fetchone()[0] == 0:
+        generate(db_connection, options.cases)
+
+    workload = options.workload.strip()
+    params = sample_params(db_connection)
+    logger.info('Primary keys only...')
+    migrate.run(db_connection, migrate.drop_index_statements(cursor), apply=True)
+    before = time_workload(db_connection, params, options.repeat, workload)
+
+    logger.info('With the secondary indexes...')
+    migrate.run(db_connection, migrate.index_statements(cursor), apply=True)
+    after = time_workload(db_connection, params, options.repeat, workload)
+
+    print('{:32s} {:>12s} {:>12s} {:>8s}'.format('query', 'before (ms)', 'after (ms)', 'speedup'))
+    for name in before:
+        print('{:32s} {:12.2f} {:12.2f} {:>8s}'.format(name, before[name], after[name],
+                                                     'x{:.1f}'.format(before[name] / after[name])
+                                                     if after[name] else '-'))
+    db_connection.close()
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Directory layout of downloaded bid details
+
+flat (shard depth 0):    bid_detail/<pkAtmMain>_<tenderCaseNo>.txt
+sharded (shard depth 2): bid_detail/3f/a2/<pkAtmMain>_<tenderCaseNo>.txt
+
+Shard directories are the leading hex digit pairs of the MD5 of pkAtmMain (or primaryKey), so every
+case number of one pkAtmMain ends up in the same directory. Each level holds at most 256 entries."""
+
+import os
+import hashlib
+import logging
+from optparse import OptionParser
+from concurrent.futures import ThreadPoolExecutor
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+_ERRCODE_DIR = 4
+
+logger = logging.getLogger(__name__)
+
+
+def shard_key(filename):
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return stem.split('_')[0]
+
+
+def shard_dir(directory, filename, depth=0):
+    digest = hashlib.md5(shard_key(filename).encode('utf-8')).hexdigest()
+    return os.path.join(directory, *[digest[i * 2:i * 2 + 2] for i in range(depth)])
+
+
+def bid_path(directory, filename, depth=0):
+    """Path of a bid detail file; filename is given without extension, as built by the downloader."""
+    return os.path.join(shard_dir(directory, filename, depth), filename + '.txt')
+
+
+def _list_tree(path):
+    found = []
+    for root, dirs, files in os.walk(path):
+        found.extend(os.path.join(root, f) for f in files)
+    return found
+
+
+def iter_files(directory, workers=8):
+    """Yield every file under the directory, whatever its layout.
+
+    Top-level shard directories are listed concurrently, which keeps many directory reads in
+    flight on network or spinning storage."""
+    subdirs = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_dir():
+                subdirs.append(entry.path)
+            elif entry.is_file():
+                yield entry.path
+    subdirs.sort()
+
+    if workers <= 1:
+        for d in subdirs:
+            for f in _list_tree(d):
+                yield f
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for files in executor.map(_list_tree, subdirs):
+                for f in files:
+                    yield f
+
+
+def migrate(directory, depth, workers=8):
+    """Move every bid detail file into the layout of the given shard depth. Returns files moved."""
+    moved = 0
+    old_dirs = set()
+    for path in list(iter_files(directory, workers)):
+        name = os.path.basename(path)
+        if name.startswith('.'):
+            continue
+        target = os.path.join(shard_dir(directory, name, depth), name)
+        if os.path.abspath(path) == os.path.abspath(target):
+            continue
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+        old_dirs.add(os.path.dirname(path))
+        moved += 1
+        if moved % 10000 == 0:
+            logger.info('%d file(s) moved', moved)
+
+    # Drop shard directories left empty by a change of depth
+    for d in sorted(old_dirs, key=len, reverse=True):
+        while os.path.abspath(d) != os.path.abspath(directory):
+            try:
+                os.rmdir(d)
+            except OSError:
+                break
+            d = os.path.dirname(d)
+
+    return moved
+
+
+def parse_args():
+    p = OptionParser()
+    p.add_option('-d', '--directory', action='store',
+                 dest='directory', type='string', default='bid_detail')
+    p.add_option('-s', '--shard_depth', action='store',
+                 dest='shard_depth', type='int', default=2)
+    p.add_option('-j', '--workers', action='store',
+                 dest='workers', type='int', default=8)
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+    options, remainder = parse_args()
+
+    directory = options.directory.strip()
+    if not os.path.isdir(directory):
+        logger.error('Directory not found: ' + directory)
+        quit(_ERRCODE_DIR)
+
+    logger.info('Migrating %s to shard depth %d...', directory, options.shard_depth)
+    logger.info('All done. %d file(s) moved.', migrate(directory, options.shard_depth, options.workers))
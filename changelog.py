@@ -0,0 +1,268 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Change log of the rows inserted and updated by the loader
+
+With --change_log <directory>, the loader reads the stored version of the rows of every batch in
+the batch transaction, and once the batch is committed appends one JSON line per row that was
+inserted or actually changed:
+    {"seq":42,"ts":"2017-03-01T10:00:00","op":"update","table":"award_info",
+     "key":{"pk_atm_main":"...","tender_case_no":"..."},"fields":{"total_award_price":1200000}}
+"fields" holds every column of an inserted row, and the columns whose value changed for an update
+(numbers are compared by value, so a parsed 12.0 equals a stored 12 or 12.00, and the rest as
+text). Dates and decimals are tagged as in
+record_store. Rows that did not change are not logged.
+
+seq increases by one per change across all writers of the loader and across runs. The log is
+split in segments, changes-<first seq>.jsonl, a new one starting once the current one outgrows
+--change_log_segment_mb. Consumers remember the last seq they processed and read from there:
+`changelog.py -d <directory> -s <seq> [--follow]`, or read_changes() from Python. Changes are written
+after the commit, so a crash in between loses the changes of that batch (not the rows themselves)."""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+import datetime as dt
+import record_store
+from decimal import Decimal
+from optparse import OptionParser
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+_ERRCODE_DIR = 4
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 500
+
+_SEGMENT = re.compile(r'changes-(\d+)\.jsonl$')
+
+_AWARDED_KEY = ('pk_atm_main', 'tender_case_no')
+
+# Table -> primary key columns
+table_keys = {
+    'organization_info': _AWARDED_KEY,
+    'procurement_info': _AWARDED_KEY,
+    'tender_info': _AWARDED_KEY + ('tender_sn',),
+    'tender_award_item': _AWARDED_KEY + ('item_sn', 'tender_sn'),
+    'evaluation_committee_info': _AWARDED_KEY + ('sn',),
+    'award_info': _AWARDED_KEY,
+    'tender_declaration_info': ('primary_key',),
+    'organization': ('org_id',),
+    'vendor': ('tenderer_id',)}
+
+
+def _text(v):
+    """Comparable text of a parsed or stored value."""
+    if v is None:
+        return None
+    if isinstance(v, bool):
+        return '1' if v else '0'
+    if isinstance(v, (int, float, Decimal)):
+        # 12, 12.0 and Decimal('12.00') are all '12'
+        d = Decimal(repr(v)) if isinstance(v, float) else Decimal(v)
+        return format(d.normalize(), 'f') if d.is_finite() else str(v)
+    return str(v)
+
+
+def read_stored(cur, table, keys, columns):
+    """Stored values of the given columns: {key: {column: value}}."""
+    key_columns = list(table_keys[table])
+    stored = {}
+    keys = sorted(set(keys), key=lambda k: tuple(_text(v) for v in k))
+    for i in range(0, len(keys), _CHUNK_SIZE):
+        chunk = keys[i:i + _CHUNK_SIZE]
+        placeholder = '(' + ','.join(['%s'] * len(key_columns)) + ')'
+        cur.execute('SELECT {} FROM {} WHERE ({}) IN ({})'.format(
+            ','.join(key_columns + columns), table, ','.join(key_columns), ','.join([placeholder] * len(chunk))),
+            [v for k in chunk for v in k])
+        for r in cur.fetchall():
+            stored[tuple(_text(v) for v in r[:len(key_columns)])] = dict(zip(columns, r[len(key_columns):]))
+    return stored
+
+
+def diff(cur, rows, use_row_hash=True):
+    """Changes the upserts of the (table, row) pairs will make: [(op, table, key, fields)] in row order.
+
+    Has to run in the transaction of the upserts, before them."""
+    by_table = {}
+    for table, row in rows:
+        if table in table_keys:
+            by_table.setdefault(table, []).append(row)
+
+    states = {}
+    for table, table_rows in by_table.items():
+        columns = sorted({k for row in table_rows for k, v in row.items() if v is not None and k != 'row_hash'})
+        if use_row_hash:
+            # Databases loaded with --no_row_hash may have no such column
+            columns.append('row_hash')
+        keys = [tuple(row.get(k) for k in table_keys[table]) for row in table_rows]
+        states[table] = read_stored(cur, table, keys, [c for c in columns if c not in table_keys[table]])
+
+    changes = []
+    for table, row in rows:
+        if table not in table_keys:
+            continue
+        key = tuple(_text(row.get(k)) for k in table_keys[table])
+        values = {k: v for k, v in row.items() if v is not None and k != 'row_hash' and k not in table_keys[table]}
+        stored = states[table].get(key)
+        if stored is None:
+            op, fields = 'insert', values
+            stored = {}
+        elif use_row_hash and row.get('row_hash') is not None and stored.get('row_hash') == row.get('row_hash'):
+            continue
+        else:
+            op = 'update'
+            fields = {k: v for k, v in values.items() if _text(v) != _text(stored.get(k))}
+            if not fields:
+                continue
+        # Later rows of the same key in the batch see this one
+        stored.update(values)
+        if use_row_hash:
+            stored['row_hash'] = row.get('row_hash')
+        states[table][key] = stored
+        changes.append((op, table, dict(zip(table_keys[table], (row.get(k) for k in table_keys[table]))), fields))
+    return changes
+
+
+def segment_files(directory):
+    """[(first seq, path)] of the segments, in order."""
+    segments = []
+    for name in os.listdir(directory):
+        m = _SEGMENT.match(name)
+        if m is not None:
+            segments.append((int(m.group(1)), os.path.join(directory, name)))
+    return sorted(segments)
+
+
+class ChangeLog(object):
+    """Appends changes to the segments of a directory. Thread safe, so that a writer pool can share it."""
+
+    def __init__(self, directory, segment_bytes=64 << 20):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.file = None
+        self.seq = 0
+        segments = segment_files(directory)
+        if segments:
+            self.seq = self._recover(segments[-1][1]) or segments[-1][0] - 1
+            self.file = open(segments[-1][1], 'a', encoding='utf-8')
+        self.count = 0
+
+    @staticmethod
+    def _recover(path):
+        """Last seq of a segment; a line left incomplete by a crash is cut off."""
+        last = None
+        good = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                good += len(line)
+                if line.strip():
+                    last = json.loads(line.decode('utf-8'))['seq']
+        if good != os.path.getsize(path):
+            logger.warning('Incomplete change cut off the end of ' + path)
+            with open(path, 'r+b') as f:
+                f.truncate(good)
+        return last
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+        path = os.path.join(self.directory, 'changes-{:020d}.jsonl'.format(self.seq + 1))
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, changes):
+        """Append the changes of a committed batch. Returns the seq of the last one."""
+        if not changes:
+            return self.seq
+        ts = dt.datetime.now().replace(microsecond=0).isoformat()
+        with self.lock:
+            if self.file is None or self.file.tell() >= self.segment_bytes:
+                self._rotate()
+            lines = []
+            for op, table, key, fields in changes:
+                self.seq += 1
+                lines.append(json.dumps({'seq': self.seq, 'ts': ts, 'op': op, 'table': table, 'key': key,
+                                         'fields': fields},
+                                        ensure_ascii=False, separators=(',', ':'), default=record_store._default))
+            self.file.write('\n'.join(lines) + '\n')
+            self.file.flush()
+            self.count += len(changes)
+            return self.seq
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def read_changes(directory, after=0, follow=False, poll_interval=1.0, stop_event=None):
+    """Yield the changes with a seq greater than after, as dicts. With follow, keep waiting for new ones."""
+    path = None
+    position = 0
+    while True:
+        segments = segment_files(directory) if os.path.isdir(directory) else []
+        if path is None:
+            # The last segment starting at or before the first change wanted
+            candidates = [p for first, p in segments if first <= after + 1]
+            path = candidates[-1] if candidates else (segments[0][1] if segments else None)
+            position = 0
+        progressed = False
+        if path is not None:
+            with open(path, 'rb') as f:
+                f.seek(position)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # Being written
+                    position += len(line)
+                    progressed = True
+                    if line.strip():
+                        change = json.loads(line.decode('utf-8'), object_hook=record_store._object_hook)
+                        if change['seq'] > after:
+                            after = change['seq']
+                            yield change
+            later = [p for first, p in segments if p > path]
+            if not progressed and later:
+                path, position = later[0], 0
+                continue
+        if progressed:
+            continue
+        if not follow or (stop_event is not None and stop_event.is_set()):
+            return
+        time.sleep(poll_interval)
+
+
+def parse_args():
+    p = OptionParser()
+    p.add_option('-d', '--directory', action='store',
+                 dest='directory', type='string', default='')
+    p.add_option('-s', '--after', action='store',
+                 dest='after', type='int', default=0)  # Last seq already processed
+    p.add_option('-f', '--follow', action='store_true',
+                 dest='follow')
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+    options, remainder = parse_args()
+
+    d = options.directory.strip()
+    if not os.path.isdir(d):
+        logger.error('Directory not found: ' + d)
+        quit(_ERRCODE_DIR)
+
+    try:
+        for c in read_changes(d, options.after, options.follow):
+            print(json.dumps(c, ensure_ascii=False, separators=(',', ':'), default=record_store._default))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Resumable queryer runs
+
+After every result list page written, the queryers save a cursor (JSON, next to the list file by
+default): the query, the sizes of the list and listing files, and for every date window the number
+of bids the search reported, the last page done and the number of records written. A restarted run
+with the same query truncates the files back to the saved sizes, dropping whatever was written after
+the last cursor, skips the windows done, and resumes the window in progress after its last page.
+When the search now reports another number of bids for that window, the pages have shifted, so the
+window is done again from its first page. A page that fails ends its window where it is, so the
+next run resumes at that page. The cursor is removed once every window is done."""
+
+import os
+import json
+import logging
+import threading
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+logger = logging.getLogger(__name__)
+
+
+def add_checkpoint_options(p):
+    p.add_option('--cursor', action='store',
+                 dest='cursor', type='string', default='')  # <list_filename>.cursor by default
+    p.add_option('--restart', action='store_true',
+                 dest='restart')  # Ignore the cursor of a previous run
+
+
+def file_sizes(*files):
+    """Sizes of the (flushed) output files; None for files not written."""
+    return [f.tell() if f is not None else None for f in files]
+
+
+class Checkpoint(object):
+    def __init__(self, filename, query, restart=False):
+        self.filename = filename
+        self.query = query
+        self.lock = threading.Lock()
+        self.state = None
+        if not restart and os.path.isfile(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('query') == query:
+                self.state = state
+            else:
+                logger.warning('Cursor {} belongs to another query; starting over.'.format(filename))
+        self.resumed = self.state is not None
+        if self.state is None:
+            self.state = {'query': query, 'sizes': None, 'windows': {}}
+
+    def open_files(self, *filenames):
+        """Open the output files: truncated back to the cursor when resuming, emptied otherwise.
+
+        Empty filenames give None. A resumed run falls back to starting over if a file is missing or
+        shorter than the cursor says."""
+        sizes = self.state['sizes'] if self.resumed else None
+        if sizes is not None:
+            for filename, size in zip(filenames, sizes):
+                if filename and size is not None and (not os.path.isfile(filename) or
+                                                      os.path.getsize(filename) < size):
+                    logger.warning('{} is shorter than its cursor; starting over.'.format(filename))
+                    self.resumed = False
+                    self.state = {'query': self.query, 'sizes': None, 'windows': {}}
+                    sizes = None
+                    break
+
+        files = []
+        for i, filename in enumerate(filenames):
+            if not filename:
+                files.append(None)
+            elif sizes is not None:
+                f = open(filename, 'a', encoding='utf-8')
+                f.truncate(sizes[i] or 0)
+                # tell() still gives the old end of the file until the next seek
+                f.seek(0, os.SEEK_END)
+                files.append(f)
+            else:
+                files.append(open(filename, 'w', encoding='utf-8'))
+        if self.resumed:
+            done = sum(1 for w in self.state['windows'].values() if w.get('done'))
+            logger.info('Resuming from {} ({} window(s) done).'.format(self.filename, done))
+        return files
+
+    def is_done(self, key):
+        with self.lock:
+            return self.state['windows'].get(key, {}).get('done', False)
+
+    def start_window(self, key, total, sizes, rewind_files=True):
+        """Register the number of bids the search reported. Returns (first page, sizes to rewind to).
+
+        The sizes are those of the files when the window first started, and are given only when the
+        window is redone because the number of bids changed; None otherwise. Without rewind_files
+        the caller keeps the files as they are (windows written in turns), and so does the cursor."""
+        with self.lock:
+            window = self.state['windows'].get(key)
+            rewind = None
+            if window is not None and window['total'] != total:
+                logger.info('Bids of window {} changed from {} to {}; redoing it.'.format(key, window['total'], total))
+                if rewind_files:
+                    rewind = window['start_sizes']
+                    self.state['sizes'] = rewind
+                window = None
+            if window is None:
+                window = {'total': total, 'page': 0, 'records': 0, 'done': False,
+                          'start_sizes': rewind or sizes}
+                self.state['windows'][key] = window
+                self._save()
+            elif window['page'] > 0:
+                logger.info('Resuming window {} after page {} ({} record(s)).'.format(key, window['page'],
+                                                                                      window['records']))
+            return window['page'] + 1, rewind
+
+    def page_done(self, key, page, records, sizes):
+        """Save the page as done. The saved sizes never go down: with concurrent windows, a page
+        written earlier may be reported after a later one."""
+        with self.lock:
+            window = self.state['windows'][key]
+            window['page'] = page
+            window['records'] += records
+            saved = self.state['sizes']
+            if saved is not None:
+                sizes = [s if old is None else old if s is None else max(s, old) for s, old in zip(sizes, saved)]
+            self.state['sizes'] = sizes
+            self._save()
+
+    def window_done(self, key):
+        with self.lock:
+            self.state['windows'][key]['done'] = True
+            self._save()
+
+    def finish(self, keys):
+        """Remove the cursor if every window of the run is done. Returns True if so."""
+        with self.lock:
+            if all(self.state['windows'].get(k, {}).get('done') for k in keys):
+                if os.path.isfile(self.filename):
+                    os.remove(self.filename)
+                return True
+            return False
+
+    def _save(self):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp, self.filename)
+
+
+def open_checkpoint(options, list_filename, query):
+    return Checkpoint(options.cursor.strip() or list_filename + '.cursor', query, options.restart)
+
+
+def rewind(files, sizes):
+    for f, size in zip(files, sizes):
+        if f is not None and size is not None:
+            f.flush()
+            f.truncate(size)
+            f.seek(0, os.SEEK_END)
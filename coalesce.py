@@ -0,0 +1,134 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Latest revision of every notice among bid detail files
+
+A directory may hold several files of the same notice: a correction republished under the same
+pkAtmMain/tenderCaseNo (or primaryKey), or a re-download. Before loading, the files are grouped by
+key, read with a few regular expressions instead of a parser, and only the latest of each group is
+kept: the highest revision_sn (公告更正序號), then the latest announcement date (決標公告日期, or 公告日
+for declarations), then the highest num_transmit (新增公告傳輸次數), then the latest modification
+time and last the path, so that the choice never depends on the order the files are listed in.
+
+Files whose key cannot be read are kept; the extractors report them as they do now."""
+
+import os
+import re
+import logging
+import bid_storage
+from datetime import date
+from optparse import OptionParser
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+_ERRCODE_DIR = 4
+
+logger = logging.getLogger(__name__)
+
+_KEY_DIV = re.compile(r'<div class="(pkAtmMain|tenderCaseNo|primaryKey)">([^<]*)</div>')
+_TH_TD = re.compile(r'<th[^>]*>(.*?)</th>\s*<td[^>]*>(.*?)</td>', re.DOTALL)
+_TAG = re.compile(r'<[^>]+>')
+_ROC_DATE = re.compile(r'(\d+)/(\d+)/(\d+)')
+
+# Header label -> field
+header_fields = {
+    '公告更正序號': 'revision_sn',
+    '決標公告日期': 'announce_date',
+    '公告日': 'announce_date',
+    '新增公告傳輸次數': 'num_transmit'}
+
+
+def _text(html):
+    return ''.join(_TAG.sub('', html).split())
+
+
+def _int(text):
+    m = re.match(r'\d+', text.replace(',', ''))
+    return int(m.group(0)) if m is not None else -1
+
+
+def _date(text):
+    m = _ROC_DATE.match(text)
+    if m is None:
+        return date.min
+    try:
+        return date(int(m.group(1)) + 1911, int(m.group(2)), int(m.group(3)))
+    except ValueError:
+        return date.min
+
+
+def read_header(filename):
+    """Return (key, revision) of a bid detail file, or (None, None) when the key cannot be read.
+
+    key is (pkAtmMain, tenderCaseNo) or (primaryKey,); revision is the sort key of the notice."""
+    with open(filename, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    divs = dict(_KEY_DIV.findall(text))
+    if divs.get('primaryKey'):
+        key = (divs['primaryKey'],)
+    elif divs.get('pkAtmMain') and divs.get('tenderCaseNo'):
+        key = (divs['pkAtmMain'], divs['tenderCaseNo'])
+    else:
+        return None, None
+
+    fields = {}
+    for th, td in _TH_TD.findall(text):
+        field = header_fields.get(_text(th))
+        if field is not None and field not in fields:
+            fields[field] = _text(td)
+
+    revision = (_int(fields.get('revision_sn', '')),
+                _date(fields.get('announce_date', '')),
+                _int(fields.get('num_transmit', '')),
+                os.path.getmtime(filename),
+                filename)
+    return key, revision
+
+
+def latest_files(files):
+    """Keep the latest file of every key. Returns (files to load, number of files skipped)."""
+    latest = {}
+    unkeyed = []
+    total = 0
+    for filename in files:
+        total += 1
+        try:
+            key, revision = read_header(filename)
+        except (OSError, UnicodeDecodeError) as e:
+            logger.warning('Fail to read header of {}\n\t{}'.format(filename, e))
+            key = None
+        if key is None:
+            unkeyed.append(filename)
+        elif key not in latest or revision > latest[key][0]:
+            if key in latest:
+                logger.debug('{} supersedes {}'.format(filename, latest[key][1]))
+            latest[key] = (revision, filename)
+
+    kept = sorted(filename for revision, filename in latest.values()) + unkeyed
+    return kept, total - len(kept)
+
+
+def parse_args():
+    p = OptionParser()
+    p.add_option('-d', '--directory', action='store',
+                 dest='directory', type='string', default='')
+    p.add_option('-j', '--scan_workers', action='store',
+                 dest='scan_workers', type='int', default=8)
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+    options, remainder = parse_args()
+
+    d = options.directory.strip()
+    if not os.path.isdir(d):
+        logger.error('Directory not found: ' + d)
+        quit(_ERRCODE_DIR)
+
+    kept, skipped = latest_files(bid_storage.iter_files(d, options.scan_workers))
+    for filename in kept:
+        print(filename)
+    logger.info('{} file(s) to load, {} superseded.'.format(len(kept), skipped))
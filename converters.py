@@ -0,0 +1,112 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Field converters shared by the extractors
+
+The patterns are compiled once, and the converters matching them remember the results of the last
+CACHE_SIZE raw values each: dates, amounts, yes/no fields and telephone numbers repeat a lot across
+pages. Every result is immutable (str, int, float, bool, date, datetime), so it can be shared.
+Converters raise on malformed values exactly as before, and failures are not cached.
+
+convert_column converts a whole column of raw values at once, converting each distinct value once."""
+
+import re
+from functools import lru_cache
+from datetime import datetime, date
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+CACHE_SIZE = 4096
+
+_YES = re.compile(r'.*是.*')
+_NUMBER = re.compile(r'-?([\d,\.]+)')
+_MONEY = re.compile(r'\$?-?([\d,\.]+)')
+_DATE = re.compile(r'(?P<date>\d+/\d+/\d+)(\s+)*(?P<time>\d+:\d+)?')
+_TEL = re.compile(r'(\((?P<area>\d+)\))?\s*(?P<number>\**\d*\**)(\s*分機\s*(?P<extension>\**\d*\**))?')
+
+
+def strip(element):
+    return element.strip()
+
+
+def remove_space(element):
+    return ''.join(element.split())
+
+
+def unescape_conversion(element):
+    return remove_space(element).replace('&lt;', '<').replace('&gt;', '>')
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def yesno_conversion(element):
+    m = _YES.match(element.strip())
+    return m is not None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def int_conversion(element):
+    m = _NUMBER.match(''.join(element.split()))
+    return int(''.join(m.group(0).split(',')))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def float_conversion(element):
+    m = _NUMBER.match(''.join(element.split()))
+    return float(''.join(m.group(0).split(',')))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def date_conversion(element):
+    m = _DATE.match(element.strip())
+    if m is not None:
+        d = [int(n) for n in m.group('date').split('/')]
+        t = [int(n) for n in m.group('time').split(':')] if m.group('time') is not None else None
+        if d[0] != '':
+            if t is not None:
+                return datetime(d[0] + 1911, d[1], d[2], hour=t[0], minute=t[1])
+            else:
+                return date(d[0] + 1911, d[1], d[2])
+    return None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def money_conversion(element):
+    m = _MONEY.match(''.join(element.split()))
+    return int(''.join(m.group(0).split(',')))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def tel_conversion(element):
+    m = _TEL.match(element.strip())
+    outstr = ''
+    if m.group('area') is not None:
+        outstr += m.group('area') + '-'
+    if m.group('number') is not None:
+        outstr += m.group('number')
+    if m.group('extension') is not None:
+        outstr += ' ext ' + m.group('extension')
+    return outstr
+
+
+def convert_column(converter, elements):
+    """Convert a column of raw values; each distinct value is converted once."""
+    converted = {}
+    results = []
+    for element in elements:
+        if element not in converted:
+            converted[element] = converter(element)
+        results.append(converted[element])
+    return results
+
+
+cached_converters = (yesno_conversion, int_conversion, float_conversion, date_conversion, money_conversion,
+                     tel_conversion)
+
+
+def cache_info():
+    return {f.__name__: f.cache_info() for f in cached_converters}
+
+
+def clear_caches():
+    for f in cached_converters:
+        f.cache_clear()
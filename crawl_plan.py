@@ -0,0 +1,90 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Crawl plans written by planner.py
+
+A plan (JSON) holds the query it was made for and, for every target and date window, the number
+of bids the search reported:
+    {"v":1,"created":"...","query":{"date_start":"20150101","date_end":"20171231",...},
+     "windows":[{"target":"awarded","key":"20150101-20150330","date_start":"20150101",
+                 "date_end":"20150330","category_main":"","category_cd":"","total":1234},...]}
+A queryer given --plan takes its query from the plan and its windows from the windows of its
+target, leaving out the windows without any bid. total is null for windows whose count failed;
+these are crawled."""
+
+import json
+import logging
+import datetime as dt
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+FORMAT_VERSION = 1
+
+# Target -> queryer crawling it
+targets = {
+    'awarded': 'queryer_awarded.py',
+    'declaration': 'queryer_declaration.py',
+    'category': 'queryer_category.py',
+    'category_declaration': 'queryer_category.py -d'}
+
+logger = logging.getLogger(__name__)
+
+
+def add_plan_options(p):
+    p.add_option('--plan', action='store',
+                 dest='plan', type='string', default='')  # Plan of planner.py; overrides the query options
+
+
+def save_plan(filename, query, windows, estimate=None):
+    plan = {'v': FORMAT_VERSION, 'created': dt.datetime.now().replace(microsecond=0).isoformat(),
+            'query': query, 'windows': windows, 'estimate': estimate}
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, ensure_ascii=False, indent=1)
+
+
+def read_plan(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+    if plan.get('v') != FORMAT_VERSION:
+        raise ValueError('Unsupported plan format: {}'.format(plan.get('v')))
+    return plan
+
+
+def open_plan(options):
+    """Read the plan of --plan, if any, and set the query options from it."""
+    filename = options.plan.strip()
+    if not filename:
+        return None
+    plan = read_plan(filename)
+    for k, v in plan['query'].items():
+        if hasattr(options, k):
+            setattr(options, k, v)
+    logger.info('Plan {} of {}: query {}'.format(filename, plan['created'], plan['query']))
+    return plan
+
+
+def categories(plan, target):
+    """(main category, category code) of the windows of the target, in plan order."""
+    found = []
+    for w in plan['windows']:
+        category = (w['category_main'], w['category_cd'])
+        if w['target'] == target and category not in found:
+            found.append(category)
+    return found
+
+
+def planned_windows(plan, target, category=None):
+    """(start date, end date) of the windows of the target (and category) that have bids to list."""
+    windows = []
+    empty = 0
+    for w in plan['windows']:
+        if w['target'] != target or (category is not None and (w['category_main'], w['category_cd']) != category):
+            continue
+        if w['total'] == 0:
+            empty += 1
+            continue
+        windows.append((dt.datetime.strptime(w['date_start'], '%Y%m%d').date(),
+                        dt.datetime.strptime(w['date_end'], '%Y%m%d').date()))
+    if empty:
+        logger.info('{} window(s) without bids skipped.'.format(empty))
+    return windows
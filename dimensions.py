@@ -0,0 +1,91 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Organization and vendor dimension tables
+
+The identity fields of an organization (org_id, name, address) and of a tenderer (tenderer_id, names,
+type, address, tel) are repeated on every page they appear in. The loader splits them into the
+`organization` and `vendor` tables, and remembers the content hash of the rows already written in
+an LRU cache, so that an unchanged organization or vendor never reaches the database again.
+
+In normalized mode the identity fields are also dropped from the fact rows (organization_info,
+tender_declaration_info, tender_info) whenever the dimension row could be keyed."""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+# Dimension table -> (key column, columns)
+dimension_tables = {
+    'organization': ('org_id', ('org_id', 'org_name', 'org_address')),
+    'vendor': ('tenderer_id', ('tenderer_id', 'tenderer_name', 'tenderer_name_eng', 'organization_type',
+                               'industry_type', 'address', 'address_eng', 'tel'))}
+
+# Fact table -> dimension table it references
+fact_tables = {
+    'organization_info': 'organization',
+    'tender_declaration_info': 'organization',
+    'tender_info': 'vendor'}
+
+
+def content_hash(values):
+    """MD5 of the values in the given order; None and '' are told apart."""
+    md5 = hashlib.md5()
+    for v in values:
+        md5.update(b'\x00' if v is None else b'\x01' + str(v).encode('utf-8'))
+        md5.update(b'\x1f')
+    return md5.hexdigest()
+
+
+def split_row(table, row, normalized=False):
+    """Return (dimension table, dimension row) or None, and the fact row to write.
+
+    The fact row is the row itself unless normalized, when it is a copy without the identity fields."""
+    dimension = fact_tables.get(table)
+    if dimension is None:
+        return None, row
+
+    key_column, columns = dimension_tables[dimension]
+    key = row.get(key_column)
+    if not key:
+        return None, row
+
+    dim_row = OrderedDict((c, row.get(c)) for c in columns)
+    dim_row['row_hash'] = content_hash(dim_row.values())
+    if normalized:
+        # Keep the key to join on, plus whatever the dimension does not hold
+        row = OrderedDict((k, v) for k, v in row.items() if k == key_column or k not in columns)
+    return (dimension, dim_row), row
+
+
+class DimensionCache(object):
+    """LRU of (dimension table, key) -> content hash of the row known to be in the database.
+
+    Thread safe, so that the writers of a pool can share it."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def is_current(self, dimension, dim_row):
+        entry = (dimension, dim_row[dimension_tables[dimension][0]])
+        with self.lock:
+            if self.entries.get(entry) == dim_row['row_hash']:
+                self.entries.move_to_end(entry)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def remember(self, dimension, dim_row):
+        entry = (dimension, dim_row[dimension_tables[dimension][0]])
+        with self.lock:
+            self.entries[entry] = dim_row['row_hash']
+            self.entries.move_to_end(entry)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
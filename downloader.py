@@ -6,11 +6,15 @@ Modified from the source code provided by https://github.com/ywchiu/pythonetl"""
 import os
 import requests
 import logging
-import time
-import re
 import random
+import work_queue
+import bid_storage
+import listing
+import scheduler
+from rate_limiter import RateLimiter
+from listing import parse_link
 from optparse import OptionParser
-from bs4 import BeautifulSoup
+from lxml import etree
 
 __author__ = "Yu-chun Huang"
 __version__ = "1.0.0b"
@@ -28,14 +32,140 @@ def parse_args():
                  dest='list_filename', type='string', default='')
     p.add_option('-d', '--directory', action='store',
                  dest='directory', type='string', default='bid_detail')
+    work_queue.add_queue_options(p, 'download')
+    p.add_option('--batch_size', action='store',
+                 dest='batch_size', type='int', default=10)
+    p.add_option('-e', '--encoding', action='store',
+                 dest='encoding', type='string', default='')
+    p.add_option('-s', '--shard_depth', action='store',
+                 dest='shard_depth', type='int', default=0)
+    p.add_option('-l', '--listing_filename', action='store',
+                 dest='listing_filename', type='string', default='')
+    p.add_option('--priority', action='store',
+                 dest='priority', type='string', default='fifo')
+    p.add_option('--preferred_orgs', action='store',
+                 dest='preferred_orgs', type='string', default='')
+    p.add_option('--preferred_categories', action='store',
+                 dest='preferred_categories', type='string', default='')
+    p.add_option('-r', '--rate', action='store',
+                 dest='rate', type='float', default=1.0)
     return p.parse_args()
 
 
+def extract_print_area(response, area_id, encoding=None, chunk_size=16384):
+    """Cut the print area out of a streamed response without building a tree of the whole page.
+
+    Elements finished before the print area starts are dropped right away, and the download stops
+    as soon as the print area is complete."""
+    parser = etree.HTMLPullParser(events=('start', 'end'), encoding=encoding or response.encoding or 'utf-8')
+    print_area = None
+    for chunk in response.iter_content(chunk_size):
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if event == 'start':
+                if print_area is None and element.tag == 'div' and element.get('id') == area_id:
+                    print_area = element
+            elif print_area is None:
+                # Not an ancestor of the print area (those end after it), so it is no longer needed
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+            elif element is print_area:
+                return etree.tostring(print_area, encoding='unicode', method='html', with_tail=False)
+
+    return None
+
+
+def download(page_link, filename, keys, directory, encoding=None, shard_depth=0):
+    with requests.get(page_link, stream=True) as request_get:
+        request_get.raise_for_status()
+        if 'pkAtmMain' in keys:
+            print_area = extract_print_area(request_get, 'printArea', encoding)
+        else:
+            print_area = extract_print_area(request_get, 'print_area', encoding)
+
+    if print_area is None:
+        raise ValueError('Print area not found: ' + page_link)
+
+    path = bid_storage.bid_path(directory, filename, shard_depth)
+    if shard_depth > 0:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as bid_detail:
+        bid_detail.write(print_area + '\n')
+        if 'pkAtmMain' in keys:
+            bid_detail.write('<div class="pkAtmMain">' + keys['pkAtmMain'] + '</div>\n')
+            bid_detail.write('<div class="tenderCaseNo">' + keys['tenderCaseNo'] + '</div>')
+            logger.info(
+                'Writing bid detail (pkAtmMain: {}, tenderCaseNo: {})'.format(keys['pkAtmMain'],
+                                                                              keys['tenderCaseNo']))
+        else:
+            bid_detail.write('<div class="primaryKey">' + keys['primaryKey'] + '</div>\n')
+            logger.info(
+                'Writing bid detail (primaryKey: {})'.format(keys['primaryKey']))
+
+
+def read_links(bid_list):
+    with open(bid_list, 'r', encoding='utf-8') as f:
+        for line in f:
+            page_link = listing.parse_line(line)[0]
+            if page_link:
+                yield page_link
+
+
+def read_records(bid_list, listing_filename):
+    """Listing records of the bids to download; a plain bid list only gives url and markers."""
+    if listing_filename:
+        for record in listing.read_listing(listing_filename):
+            yield record
+    else:
+        with open(bid_list, 'r', encoding='utf-8') as f:
+            for line in f:
+                page_link, record = listing.parse_line(line)
+                if page_link:
+                    record['url'] = page_link
+                    yield record
+
+
+def download_from_list(sched, records, err_filename, directory, encoding=None, shard_depth=0):
+    seen = set()
+    for record in records:
+        if record['url'] in seen or parse_link(record['url'])[0] is None:
+            continue
+        seen.add(record['url'])
+        sched.push(record)
+    logger.info('{} bid(s) to download'.format(len(sched)))
+
+    for record in sched:
+        page_link = record['url']
+        filename, keys = parse_link(page_link)
+        try:
+            download(page_link, filename, keys, directory, encoding, shard_depth)
+        except:
+            with open(err_filename, 'a', encoding='utf-8') as err_file:
+                err_file.write(page_link + '\n')
+            continue
+
+
+def download_from_queue(wq, limiter, directory, batch_size, encoding=None, shard_depth=0):
+    for filename, page_link in wq.items(batch_size):
+        _, keys = parse_link(page_link)
+        limiter.wait()  # Prevent from being treated as a DDOS attack
+        try:
+            download(page_link, filename, keys, directory, encoding, shard_depth)
+            wq.complete(filename)
+        except:
+            logger.warning('Fail to download bid detail: ' + page_link)
+            wq.fail(filename)
+            continue
+
+
 if __name__ == '__main__':
     options, remainder = parse_args()
 
     bid_list = options.list_filename.strip()
-    if not bid_list:
+    listing_filename = options.listing_filename.strip()
+    queue_db = options.queue_db.strip()
+    if not bid_list and not listing_filename and not queue_db:
         logger.error('Invalid bid list filename.')
         quit(_ERRCODE_FILENAME)
 
@@ -48,53 +178,21 @@ if __name__ == '__main__':
                 logger.error('Fail to create directory.')
                 quit(_ERRCODE_DIR)
 
-    with open(bid_list, 'r', encoding='utf-8') as f:
-        for line in f.readlines():
-            page_link = line.strip()
-
-            m1 = re.match(r'([^ ]+)pkAtmMain=(?P<pkAtmMain>\w+)&tenderCaseNo=(?P<tenderCaseNo>[\w\-]+)', page_link)
-            if m1 is None:
-                m2 = re.match(r'([^ ]+)primaryKey=(?P<primaryKey>[\w\-]+)', page_link)
-                if m2 is None:
-                    continue
-                else:
-                    primaryKey = m2.group('primaryKey')
-                    if primaryKey is None:
-                        continue
-                    else:
-                        filename = primaryKey
-            else:
-                pkAtmMain = m1.group('pkAtmMain')
-                tenderCaseNo = m1.group('tenderCaseNo')
-                if pkAtmMain is None or tenderCaseNo is None:
-                    continue
-                else:
-                    filename = "%s_%s" % (pkAtmMain, tenderCaseNo)
-
-            try:
-                request_get = requests.get(page_link)
-                response = request_get.text
-
-                soup = BeautifulSoup(''.join(response), 'lxml')
-                if m1 is not None:
-                    print_area = soup.find('div', {"id": "printArea"})
-                else:
-                    print_area = soup.find('div', {"id": "print_area"})
-
-                with open('{}/{}.txt'.format(directory, filename), 'w', encoding='utf-8') as bid_detail:
-                    bid_detail.write(print_area.prettify())
-                    if m1 is not None:
-                        bid_detail.write('<div class="pkAtmMain">' + pkAtmMain + '</div>\n')
-                        bid_detail.write('<div class="tenderCaseNo">' + tenderCaseNo + '</div>')
-                        logger.info(
-                            'Writing bid detail (pkAtmMain: {}, tenderCaseNo: {})'.format(pkAtmMain, tenderCaseNo))
-                    else:
-                        bid_detail.write('<div class="primaryKey">' + primaryKey + '</div>\n')
-                        logger.info(
-                            'Writing bid detail (primaryKey: {})'.format(primaryKey))
-            except:
-                with open(options.list_filename.strip() + '.download.err', 'a', encoding='utf-8') as err_file:
-                    err_file.write(page_link + '\n')
-                continue
-
-            time.sleep(1)  # Prevent from being treated as a DDOS attack
+    limiter = RateLimiter(options.rate)
+    if queue_db:
+        # Every node may seed the queue with its list; keys already queued are ignored
+        wq = work_queue.open_queue(options)
+        if bid_list:
+            links = ((parse_link(page_link)[0], page_link) for page_link in read_links(bid_list))
+            wq.enqueue((filename, page_link) for filename, page_link in links if filename is not None)
+        download_from_queue(wq, limiter, directory, options.batch_size, options.encoding.strip() or None,
+                            options.shard_depth)
+        wq.close()
+    else:
+        sched = scheduler.PriorityScheduler(
+            options.priority, limiter,
+            preferred_orgs=[o.strip() for o in options.preferred_orgs.split(',') if o.strip()],
+            preferred_categories=[c.strip() for c in options.preferred_categories.split(',') if c.strip()])
+        download_from_list(sched, read_records(bid_list, listing_filename),
+                           (bid_list or listing_filename) + '.download.err',
+                           directory, options.encoding.strip() or None, options.shard_depth)
@@ -6,89 +6,54 @@ Modified from the source code provided by https://github.com/ywchiu/pythonetl"""
 import os
 import re
 import logging
+import bid_storage
+import record_store
 from optparse import OptionParser
-from bs4 import BeautifulSoup
-from datetime import datetime, date
+from bs4 import BeautifulSoup, SoupStrainer
+from converters import strip, remove_space, unescape_conversion, yesno_conversion, int_conversion, \
+    float_conversion, date_conversion, money_conversion, tel_conversion
 
 __author__ = "Yu-chun Huang"
 __version__ = "1.0.0b"
 
 _ERRCODE_FILENAME = 3
+_ERRCODE_TABLES = 5
 
 logger = logging.getLogger(__name__)
 
+# Table -> class of the rows of its section of the page, in loading order
+table_sections = (('organization_info', 'award_table_tr_1'),
+                  ('procurement_info', 'award_table_tr_2'),
+                  ('tender_info', 'award_table_tr_3'),
+                  ('tender_award_item', 'award_table_tr_4'),
+                  ('evaluation_committee_info', 'award_table_tr_4_1'),
+                  ('award_info', 'award_table_tr_6'))
+TABLES = tuple(table for table, section_class in table_sections)
 
-def init(filename):
+
+def init(filename, tables=None):
+    """Parse a page. When tables are given, only the keys and the sections of those tables are
+    built, and the root returned is the partial document; sections missing from the page give no
+    rows, as with a full parse. The root is None when the page has no result table."""
     f = open(filename, 'r', encoding='utf-8')
     response_text = f.read()
     f.close()
-    soup = BeautifulSoup(''.join(response_text), 'lxml')
+    if tables is None:
+        soup = BeautifulSoup(''.join(response_text), 'lxml')
+        root = soup.find('table', {'class': 'table_block tender_table'})
+    else:
+        classes = [section_class for table, section_class in table_sections if table in tables]
+        soup = BeautifulSoup(''.join(response_text), 'lxml',
+                             parse_only=SoupStrainer(attrs={'class': ['pkAtmMain', 'tenderCaseNo'] + classes}))
+        root = soup if 'table_block tender_table' in response_text else None
     pk = soup.find('div', {'class': 'pkAtmMain'}).text
     case_no = soup.find('div', {'class': 'tenderCaseNo'}).text
-    root = soup.find('table', {'class': 'table_block tender_table'})
-    logger.debug('pkAtmMain: ' + pk_atm_main)
-    logger.debug('tenderCaseNo: ' + tender_case_no)
+    logger.debug('pkAtmMain: ' + pk)
+    logger.debug('tenderCaseNo: ' + case_no)
 
     return pk, case_no, root
 
 
-def strip(element):
-    return element.strip()
-
-
-def remove_space(element):
-    return ''.join(element.split())
-
-
-def unescape_conversion(element):
-    return remove_space(element).replace('&lt;', '<').replace('&gt;', '>')
-
-
-def yesno_conversion(element):
-    m = re.match(r'.*是.*', element.strip())
-    return m is not None
-
-
-def int_conversion(element):
-    m = re.match(r'-?([\d,\.]+)', ''.join(element.split()))
-    return int(''.join(m.group(0).split(',')))
-
-
-def float_conversion(element):
-    m = re.match(r'-?([\d,\.]+)', ''.join(element.split()))
-    return float(''.join(m.group(0).split(',')))
-
-
-def date_conversion(element):
-    m = re.match(r'(?P<date>\d+/\d+/\d+)(\s+)*(?P<time>\d+:\d+)?', element.strip())
-    if m is not None:
-        d = [int(n) for n in m.group('date').split('/')]
-        t = [int(n) for n in m.group('time').split(':')] if m.group('time') is not None else None
-        if d[0] != '':
-            if t is not None:
-                return datetime(d[0] + 1911, d[1], d[2], hour=t[0], minute=t[1])
-            else:
-                return date(d[0] + 1911, d[1], d[2])
-    return None
-
-
-def money_conversion(element):
-    m = re.match(r'\$?-?([\d,\.]+)', ''.join(element.split()))
-    return int(''.join(m.group(0).split(',')))
-
-
-def tel_conversion(element):
-    m = re.match(r'(\((?P<area>\d+)\))?\s*(?P<number>\**\d*\**)(\s*分機\s*(?P<extension>\**\d*\**))?', element.strip())
-    outstr = ''
-    if m.group('area') is not None:
-        outstr += m.group('area') + '-'
-    if m.group('number') is not None:
-        outstr += m.group('number')
-    if m.group('extension') is not None:
-        outstr += ' ext ' + m.group('extension')
-    return outstr
-
-
 organization_info_map = {
     # <tr class="award_table_tr_1">
     '機關代碼': ('org_id', remove_space),
@@ -260,16 +225,16 @@ def get_procurement_info_dic(root_element):
     return returned_dic
 
 
-def get_tender_info_dic(root_element):
+def iter_tender_info(root_element):
+    """Yield the row of every tender as soon as its group is parsed."""
     if root_element is None:
-        return None
+        return
 
-    returned_dic = {}
     mapper = tender_map
     award_table_tr = root_element.findAll('tr', {'class': 'award_table_tr_3'})
     for tr in award_table_tr:
         tb = tr.find('table')
-        grp_num = 0
+        row = None
         if tb is not None:
             for r in tb.findAll('tr'):
                 th_find = r.find('th')
@@ -278,23 +243,35 @@ def get_tender_info_dic(root_element):
                 th_name = remove_space(th_find.text)
                 m = re.match(r'投標廠商(\d+)', th_name)
                 if m is not None:
-                    grp_num = int(m.group(1))
-                    returned_dic[grp_num] = {'tender_sn': grp_num}
-                else:
+                    if row is not None:
+                        yield row
+                    row = {'tender_sn': int(m.group(1))}
+                elif row is not None:
                     if th_name in mapper:
                         key = mapper[th_name][0]
                         content = r.find('td').text
                         if len(mapper[th_name]) == 2:
-                            returned_dic[grp_num][key] = mapper[th_name][1](content)
+                            row[key] = mapper[th_name][1](content)
                         else:
-                            returned_dic[grp_num][key] = content
+                            row[key] = content
 
                     # Special case
                     if th_name == '履約起迄日期':
                         content = remove_space(r.find('td').text)
                         date_range = content.split('－')
-                        returned_dic[grp_num]['fulfill_date_start'] = date_conversion(date_range[0])
-                        returned_dic[grp_num]['fulfill_date_end'] = date_conversion(date_range[1])
+                        row['fulfill_date_start'] = date_conversion(date_range[0])
+                        row['fulfill_date_end'] = date_conversion(date_range[1])
+        if row is not None:
+            yield row
+
+
+def get_tender_info_dic(root_element):
+    if root_element is None:
+        return None
+
+    returned_dic = {}
+    for row in iter_tender_info(root_element):
+        returned_dic[row['tender_sn']] = row
 
     # Print returned_dic
     if logging.getLogger().isEnabledFor(logging.DEBUG):
@@ -305,11 +282,11 @@ def get_tender_info_dic(root_element):
     return returned_dic
 
 
-def get_tender_award_item_dic(root_element):
+def iter_tender_award_item(root_element):
+    """Yield the row of every (item, awarded tender) pair as soon as it is parsed."""
     if root_element is None:
-        return None
+        return
 
-    returned_dic = {}
     mapper = tender_award_item_map
     award_table_tr = root_element.findAll('tr', {'class': 'award_table_tr_4'})
     for tr in award_table_tr:
@@ -319,15 +296,17 @@ def get_tender_award_item_dic(root_element):
             item_name = None
             unit = None
             is_upxql = None
-            grp_num = 0
+            row = None
             for r in tb.findAll('tr'):
                 if r.find('th') is not None:
                     th_name = remove_space(r.find('th').text)
                     m = re.match(r'第(\d+)品項', th_name)
                     m2 = re.match(r'得標廠商(\d+)', th_name)
                     if m is not None:
+                        if row is not None:
+                            yield row
+                            row = None
                         item_num = int(m.group(1))
-                        returned_dic[item_num] = {}
                     elif th_name == '品項名稱':
                         content = r.find('td').text
                         item_name = mapper[th_name][1](content) if len(mapper[th_name]) == 2 else content
@@ -346,37 +325,49 @@ def get_tender_award_item_dic(root_element):
                     elif m2 is not None and item_num > 0:
                         grp_num = int(m2.group(1))
                         if grp_num > 0:
-                            returned_dic[item_num][grp_num] = {
-                                'item_sn': item_num,
-                                'tender_sn': grp_num,
-                                'item_name': item_name}
+                            if row is not None:
+                                yield row
+                            row = {'item_sn': item_num,
+                                   'tender_sn': grp_num,
+                                   'item_name': item_name}
                             if unit is not None:
-                                returned_dic[item_num][grp_num]['unit'] = unit
+                                row['unit'] = unit
                             if is_upxql is not None:
-                                returned_dic[item_num][grp_num]['is_unit_price_x_qty_lowest'] = is_upxql
-                    elif item_num > 0 and grp_num > 0:
+                                row['is_unit_price_x_qty_lowest'] = is_upxql
+                    elif row is not None:
                         if th_name in mapper and th_name != '原產地國別':
                             key = mapper[th_name][0]
                             content = r.find('td').text
                             if len(mapper[th_name]) == 2:
-                                returned_dic[item_num][grp_num][key] = mapper[th_name][1](content)
+                                row[key] = mapper[th_name][1](content)
                             else:
-                                returned_dic[item_num][grp_num][key] = content
+                                row[key] = content
 
                         # Special case
                         if th_name == '原產地國別':
                             ctable = r.find('table')
                             if ctable is not None:
-                                for row in ctable.findAll('tr'):
-                                    tds = row.findAll('td')
+                                for crow in ctable.findAll('tr'):
+                                    tds = crow.findAll('td')
                                     header = remove_space(tds[0].text)
                                     if header in mapper:
                                         key = mapper[header][0]
                                         content = tds[1].text
                                         if len(mapper[header]) == 2:
-                                            returned_dic[item_num][grp_num][key] = mapper[header][1](content)
+                                            row[key] = mapper[header][1](content)
                                         else:
-                                            returned_dic[item_num][grp_num][key] = content
+                                            row[key] = content
+            if row is not None:
+                yield row
+
+
+def get_tender_award_item_dic(root_element):
+    if root_element is None:
+        return None
+
+    returned_dic = {}
+    for row in iter_tender_award_item(root_element):
+        returned_dic.setdefault(row['item_sn'], {})[row['tender_sn']] = row
 
     # Print returned_dic
     if logging.getLogger().isEnabledFor(logging.DEBUG):
@@ -449,10 +440,65 @@ def get_award_info_dic(root_element):
     return returned_dic
 
 
+def iter_rows(root_element, pk, tables=None):
+    """Yield (table, row) for every row of an award page, in loading order, as rows are parsed.
+
+    When tables are given, the sections of the other tables are not read at all."""
+    if tables is None or 'organization_info' in tables:
+        data = get_organization_info_dic(root_element)
+        data.update(pk)
+        yield 'organization_info', data
+
+    if tables is None or 'procurement_info' in tables:
+        data = get_procurement_info_dic(root_element)
+        data.update(pk)
+        yield 'procurement_info', data
+
+    if tables is None or 'tender_info' in tables:
+        for tender in iter_tender_info(root_element):
+            tender.update(pk)
+            yield 'tender_info', tender
+
+    if tables is None or 'tender_award_item' in tables:
+        for item in iter_tender_award_item(root_element):
+            item.update(pk)
+            yield 'tender_award_item', item
+
+    if tables is None or 'evaluation_committee_info' in tables:
+        for committee in get_evaluation_committee_info_list(root_element):
+            committee.update(pk)
+            yield 'evaluation_committee_info', committee
+
+    if tables is None or 'award_info' in tables:
+        data = get_award_info_dic(root_element)
+        data.update(pk)
+        yield 'award_info', data
+
+
+def get_tables(root_element, pk, tables=None):
+    """Rows of every table (or of the given tables) extracted from an award page, in loading order."""
+    returned_tables = {table: [] for table in TABLES if tables is None or table in tables}
+    for table, row in iter_rows(root_element, pk, tables):
+        returned_tables[table].append(row)
+    return returned_tables
+
+
+def parse_tables(option):
+    """Set of the tables given as 'table,table,...', or None for all."""
+    tables = {t.strip() for t in option.split(',') if t.strip()}
+    return tables or None
+
+
 def parse_args():
     p = OptionParser()
     p.add_option('-f', '--filename', action='store',
                  dest='filename', type='string', default='')
+    p.add_option('-d', '--directory', action='store',
+                 dest='directory', type='string', default='')
+    p.add_option('-o', '--output', action='store',
+                 dest='output', type='string', default='')
+    p.add_option('-t', '--tables', action='store',
+                 dest='tables', type='string', default='')  # Comma separated, all tables by default
     return p.parse_args()
 
 
@@ -462,15 +508,34 @@ if __name__ == '__main__':
     options, remainder = parse_args()
 
     file_name = options.filename.strip()
-    if not os.path.isfile(file_name):
+    directory = options.directory.strip()
+    if directory == '' and not os.path.isfile(file_name):
         logger.error('File not found: ' + file_name)
         quit(_ERRCODE_FILENAME)
 
-    pk_atm_main, tender_case_no, root_element = init(file_name)
-
-    get_organization_info_dic(root_element)
-    get_procurement_info_dic(root_element)
-    get_tender_info_dic(root_element)
-    get_tender_award_item_dic(root_element)
-    get_evaluation_committee_info_list(root_element)
-    get_award_info_dic(root_element)
+    tables = parse_tables(options.tables)
+    if tables is not None and not tables <= set(TABLES):
+        logger.error('Unknown table(s): ' + ', '.join(sorted(tables - set(TABLES))))
+        quit(_ERRCODE_TABLES)
+
+    files = [file_name] if file_name != '' else []
+    if directory != '':
+        files = bid_storage.iter_files(directory)
+
+    # Persist the extracted rows, so that the loader can reload them without parsing HTML again
+    writer = record_store.RecordWriter(options.output.strip()) if options.output.strip() else None
+    for file_name in files:
+        try:
+            pk_atm_main, tender_case_no, root_element = init(file_name, tables)
+            pk = {'pk_atm_main': pk_atm_main, 'tender_case_no': tender_case_no}
+            extracted = get_tables(root_element, pk, tables)
+        except AttributeError as e:
+            logger.warning('Corrupted content. Extraction skipped ({})\n\t{}'.format(file_name, e))
+            continue
+
+        if writer is not None:
+            writer.write('awarded', pk, extracted, file_name)
+
+    if writer is not None:
+        writer.close()
+        logger.info('{} page(s) written to {}'.format(writer.count, options.output.strip()))
@@ -6,87 +6,52 @@ Modified from the source code provided by https://github.com/ywchiu/pythonetl"""
 import os
 import re
 import logging
+import bid_storage
+import record_store
 from optparse import OptionParser
-from bs4 import BeautifulSoup
-from datetime import datetime, date
+from bs4 import BeautifulSoup, SoupStrainer
+from converters import strip, remove_space, unescape_conversion, yesno_conversion, int_conversion, \
+    date_conversion, money_conversion, tel_conversion
 
 __author__ = "Yu-chun Huang"
 __version__ = "1.0.0b"
 
 _ERRCODE_FILENAME = 3
+_ERRCODE_TABLES = 5
 
 logger = logging.getLogger(__name__)
 
 
-def init(filename):
+# Section -> class of its rows on the page, in loading order
+section_classes = (('organization_info', 'tender_table_tr_1'),
+                   ('procurement_info', 'tender_table_tr_2'),
+                   ('declaration_info', 'tender_table_tr_3'),
+                   ('attend_info', 'tender_table_tr_4'),
+                   ('other_info', 'tender_table_tr_5'))
+SECTIONS = tuple(section for section, section_class in section_classes)
+
+
+def init(filename, sections=None):
+    """Parse a page. When sections are given, only the key and those sections are built, and the
+    root returned is the partial document; missing sections leave their columns out, as with a full
+    parse. The root is None when the page has no result table."""
     f = open(filename, 'r', encoding='utf-8')
     response_text = f.read()
     f.close()
-    soup = BeautifulSoup(''.join(response_text), 'lxml')
+    if sections is None:
+        soup = BeautifulSoup(''.join(response_text), 'lxml')
+        root = soup.find('table', {'class': 'table_block tender_table'})
+    else:
+        classes = [section_class for section, section_class in section_classes if section in sections]
+        soup = BeautifulSoup(''.join(response_text), 'lxml',
+                             parse_only=SoupStrainer(attrs={'class': ['primaryKey'] + classes}))
+        root = soup if 'table_block tender_table' in response_text else None
     pk = soup.find('div', {'class': 'primaryKey'}).text
-    root = soup.find('table', {'class': 'table_block tender_table'})
     logger.debug('primaryKey: ' + pk)
 
     return pk, root
 
 
-def strip(element):
-    return element.strip()
-
-
-def remove_space(element):
-    return ''.join(element.split())
-
-
-def unescape_conversion(element):
-    return remove_space(element).replace('&lt;', '<').replace('&gt;', '>')
-
-
-def yesno_conversion(element):
-    m = re.match(r'.*是.*', element.strip())
-    return m is not None
-
-
-def int_conversion(element):
-    m = re.match(r'-?([\d,\.]+)', ''.join(element.split()))
-    return int(''.join(m.group(0).split(',')))
-
-
-def float_conversion(element):
-    m = re.match(r'-?([\d,\.]+)', ''.join(element.split()))
-    return float(''.join(m.group(0).split(',')))
-
-
-def date_conversion(element):
-    m = re.match(r'(?P<date>\d+/\d+/\d+)(\s+)*(?P<time>\d+:\d+)?', element.strip())
-    if m is not None:
-        d = [int(n) for n in m.group('date').split('/')]
-        t = [int(n) for n in m.group('time').split(':')] if m.group('time') is not None else None
-        if d[0] != '':
-            if t is not None:
-                return datetime(d[0] + 1911, d[1], d[2], hour=t[0], minute=t[1])
-            else:
-                return date(d[0] + 1911, d[1], d[2])
-    return None
-
-
-def money_conversion(element):
-    m = re.match(r'\$?-?([\d,\.]+)', ''.join(element.split()))
-    return int(''.join(m.group(0).split(',')))
-
-
-def tel_conversion(element):
-    m = re.match(r'(\((?P<area>\d+)\))?\s*(?P<number>\**\d*\**)(\s*分機\s*(?P<extension>\**\d*\**))?', element.strip())
-    outstr = ''
-    if m.group('area') is not None:
-        outstr += m.group('area') + '-'
-    if m.group('number') is not None:
-        outstr += m.group('number')
-    if m.group('extension') is not None:
-        outstr += ' ext ' + m.group('extension')
-    return outstr
-
-
 organization_info_map = {
     # <tr class="tender_table_tr_1">
     '機關代碼': ('org_id', remove_space),
@@ -297,10 +262,62 @@ def get_other_info_dic(root_element):
     return returned_dic
 
 
+# Section -> (map, reader)
+section_readers = {
+    'organization_info': (organization_info_map, get_organization_info_dic),
+    'procurement_info': (procurement_info_map, get_procurement_info_dic),
+    'declaration_info': (declaration_info_map, get_declaration_info_dic),
+    'attend_info': (attend_info_map, get_attend_info_dic),
+    'other_info': (other_info_map, get_other_info_dic)}
+
+
+def section_columns(sections):
+    """Columns of tender_declaration_info filled in by the given sections."""
+    return {spec[0] for section in sections for spec in section_readers[section][0].values()}
+
+
+def iter_rows(root_element, primary_key, sections=None):
+    """Yield (table, row) for every row of a declaration page. A declaration is a single row.
+
+    When sections are given, the row only holds their columns and the other sections are not read."""
+    if root_element is None:
+        # Reported as corrupted content, as the readers would
+        raise AttributeError('No section found')
+
+    data = {}
+    for section in SECTIONS:
+        if sections is None or section in sections:
+            data.update(section_readers[section][1](root_element))
+    data['primary_key'] = primary_key
+    yield 'tender_declaration_info', data
+
+
+def get_tables(root_element, primary_key, sections=None):
+    """Rows of every table extracted from a declaration page, in loading order."""
+    tables = {'tender_declaration_info': []}
+    for table, row in iter_rows(root_element, primary_key, sections):
+        tables[table].append(row)
+    return tables
+
+
+def parse_sections(option):
+    """Set of the sections given as 'section,section,...', or None for all (or 'tender_declaration_info')."""
+    sections = {s.strip() for s in option.split(',') if s.strip()}
+    if not sections or 'tender_declaration_info' in sections:
+        return None
+    return sections
+
+
 def parse_args():
     p = OptionParser()
     p.add_option('-f', '--filename', action='store',
                  dest='filename', type='string', default='')
+    p.add_option('-d', '--directory', action='store',
+                 dest='directory', type='string', default='')
+    p.add_option('-o', '--output', action='store',
+                 dest='output', type='string', default='')
+    p.add_option('-t', '--tables', action='store',
+                 dest='tables', type='string', default='')  # Comma separated sections, all by default
     return p.parse_args()
 
 
@@ -310,14 +327,33 @@ if __name__ == '__main__':
     options, remainder = parse_args()
 
     file_name = options.filename.strip()
-    if not os.path.isfile(file_name):
+    directory = options.directory.strip()
+    if directory == '' and not os.path.isfile(file_name):
         logger.error('File not found: ' + file_name)
         quit(_ERRCODE_FILENAME)
 
-    primary_key, root_element = init(file_name)
-
-    get_organization_info_dic(root_element)
-    get_procurement_info_dic(root_element)
-    get_declaration_info_dic(root_element)
-    get_attend_info_dic(root_element)
-    get_other_info_dic(root_element)
+    sections = parse_sections(options.tables)
+    if sections is not None and not sections <= set(SECTIONS):
+        logger.error('Unknown section(s): ' + ', '.join(sorted(sections - set(SECTIONS))))
+        quit(_ERRCODE_TABLES)
+
+    files = [file_name] if file_name != '' else []
+    if directory != '':
+        files = bid_storage.iter_files(directory)
+
+    # Persist the extracted rows, so that the loader can reload them without parsing HTML again
+    writer = record_store.RecordWriter(options.output.strip()) if options.output.strip() else None
+    for file_name in files:
+        try:
+            primary_key, root_element = init(file_name, sections)
+            tables = get_tables(root_element, primary_key, sections)
+        except AttributeError as e:
+            logger.warning('Corrupted content. Extraction skipped ({})\n\t{}'.format(file_name, e))
+            continue
+
+        if writer is not None:
+            writer.write('declaration', {'primary_key': primary_key}, tables, file_name)
+
+    if writer is not None:
+        writer.close()
+        logger.info('{} page(s) written to {}'.format(writer.count, options.output.strip()))
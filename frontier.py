@@ -0,0 +1,160 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Frontier for Taiwan government e-procurement website
+
+Compares the revision markers captured by the queryers with the values already loaded into the
+database, and writes a bid list holding only new or revised notices. A notice is revised when
+the result list shows more transmissions (num_transmit), another correction serial number
+(revision_sn) or a later announcement date than the stored row."""
+
+import os
+import logging
+import mysql.connector
+import listing
+from listing import parse_link
+from optparse import OptionParser
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+_ERRCODE_FILENAME = 3
+
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 500
+
+
+def to_int(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def load_stored_awarded(cnx, keys):
+    stored = {}
+    cur = cnx.cursor()
+    for i in range(0, len(keys), _CHUNK_SIZE):
+        chunk = keys[i:i + _CHUNK_SIZE]
+        cur.execute('SELECT p.pk_atm_main, p.tender_case_no, p.num_transmit, a.revision_sn, a.awarding_announce_date'
+                    ' FROM procurement_info p LEFT JOIN award_info a'
+                    ' ON a.pk_atm_main = p.pk_atm_main AND a.tender_case_no = p.tender_case_no'
+                    ' WHERE (p.pk_atm_main, p.tender_case_no) IN (' + ','.join(['(%s,%s)'] * len(chunk)) + ')',
+                    [v for k in chunk for v in k])
+        for pk_atm_main, tender_case_no, num_transmit, revision_sn, announce_date in cur:
+            stored[(pk_atm_main, tender_case_no)] = {'num_transmit': to_int(num_transmit),
+                                                     'revision_sn': revision_sn,
+                                                     'announce_date': str(announce_date) if announce_date else None}
+    return stored
+
+
+def load_stored_declaration(cnx, keys):
+    stored = {}
+    cur = cnx.cursor()
+    for i in range(0, len(keys), _CHUNK_SIZE):
+        chunk = keys[i:i + _CHUNK_SIZE]
+        cur.execute('SELECT primary_key, num_transmit, publication_date FROM tender_declaration_info'
+                    ' WHERE primary_key IN (' + ','.join(['%s'] * len(chunk)) + ')',
+                    chunk)
+        for primary_key, num_transmit, publication_date in cur:
+            stored[primary_key] = {'num_transmit': to_int(num_transmit),
+                                   'revision_sn': None,
+                                   'announce_date': str(publication_date) if publication_date else None}
+    return stored
+
+
+def change_reason(markers, stored):
+    """Return 'new', 'revised' or None when the stored row is current."""
+    if stored is None:
+        return 'new'
+
+    num_transmit = markers.get('num_transmit')
+    if num_transmit is not None and stored['num_transmit'] is not None and num_transmit > stored['num_transmit']:
+        return 'revised'
+
+    revision_sn = markers.get('revision_sn')
+    if revision_sn and stored['revision_sn'] is not None and revision_sn != stored['revision_sn']:
+        return 'revised'
+
+    announce_date = markers.get('announce_date')
+    if announce_date and stored['announce_date'] is not None and announce_date > stored['announce_date']:
+        return 'revised'
+
+    return None
+
+
+def plan_fetches(cnx, lines):
+    """Yield (line, reason) for every bid list line that has to be downloaded."""
+    entries = []
+    for line in lines:
+        url, markers = listing.parse_line(line)
+        filename, keys = parse_link(url)
+        if filename is None:
+            continue
+        if 'pkAtmMain' in keys:
+            entries.append((line, markers, (keys['pkAtmMain'], keys['tenderCaseNo']), True))
+        else:
+            entries.append((line, markers, keys['primaryKey'], False))
+
+    stored = load_stored_awarded(cnx, list({e[2] for e in entries if e[3]}))
+    stored.update(load_stored_declaration(cnx, list({e[2] for e in entries if not e[3]})))
+
+    for line, markers, key, is_awarded in entries:
+        reason = change_reason(markers, stored.get(key))
+        if reason is not None:
+            yield line, reason
+
+
+def parse_args():
+    p = OptionParser()
+    p.add_option('-f', '--list_filename', action='store',
+                 dest='list_filename', type='string', default='bid_list.txt')
+    p.add_option('-t', '--todo_filename', action='store',
+                 dest='todo_filename', type='string', default='')
+    p.add_option('-u', '--user', action='store',
+                 dest='user', type='string', default='')
+    p.add_option('-p', '--password', action='store',
+                 dest='password', type='string', default='')
+    p.add_option('-i', '--host', action='store',
+                 dest='host', type='string', default='')
+    p.add_option('-b', '--database', action='store',
+                 dest='database', type='string', default='')
+    p.add_option('-o', '--port', action='store',
+                 dest='port', type='string', default='3306')
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    options, remainder = parse_args()
+
+    list_filename = options.list_filename.strip()
+    if not os.path.isfile(list_filename):
+        logger.error('File not found: ' + list_filename)
+        quit(_ERRCODE_FILENAME)
+    todo_filename = options.todo_filename.strip() or list_filename + '.todo'
+
+    db_config = {'user': options.user.strip(),
+                 'password': options.password.strip(),
+                 'host': options.host.strip(),
+                 'port': options.port.strip(),
+                 'database': options.database.strip()
+                 }
+    if '' in db_config.values():
+        logger.error('Database connection information is incomplete.')
+        quit()
+
+    db_connection = mysql.connector.connect(**db_config)
+    with open(list_filename, 'r', encoding='utf-8') as f:
+        lines = [line.rstrip('\r\n') for line in f if line.strip()]
+
+    counts = {'new': 0, 'revised': 0}
+    with open(todo_filename, 'w', encoding='utf-8') as todo_file:
+        for line, reason in plan_fetches(db_connection, lines):
+            counts[reason] += 1
+            todo_file.write(line + '\n')
+    db_connection.close()
+
+    logger.info('%d listed, %d new, %d revised, %d unchanged. Bid list to download: %s',
+                len(lines), counts['new'], counts['revised'],
+                len(lines) - counts['new'] - counts['revised'], todo_filename)
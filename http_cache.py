@@ -0,0 +1,231 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" On-disk response cache for the search and result list requests of the queryers
+
+Responses are keyed by method, URL and normalized payload, stored zlib-compressed in a directory
+and indexed in a SQLite file. Every entry gets the TTL of its endpoint type ('search' for the search
+POST, 'page' for the pageIndex GETs); responses of windows closed for a while never expire. The
+least recently used entries are evicted once the cache outgrows its size limit.
+
+The result list pages live in the server-side session of the preceding search, so a page is keyed
+by its search as well. When the search itself was served from the cache and a page is not, the
+search is replayed against the portal before the page is fetched."""
+
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+import datetime as dt
+from urllib import parse
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(method, url, data=None, context=''):
+    payload = parse.urlencode(sorted((data or {}).items()))
+    return hashlib.sha1('\n'.join([method.upper(), url, payload, context]).encode('utf-8')).hexdigest()
+
+
+class ResponseCache(object):
+    def __init__(self, directory, max_bytes=1 << 30, ttls=None, closed_days=30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = {'search': 86400, 'page': 86400}
+        self.ttls.update(ttls or {})
+        self.closed_days = closed_days
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS response ('
+                        ' cache_key char(40) PRIMARY KEY, kind varchar(10), size int,'
+                        ' encoding varchar(20), expires real, accessed real)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS response_accessed_idx ON response (accessed)')
+        self.db.commit()
+        self.total_bytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM response').fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.z')
+
+    def ttl(self, kind, window_end=None):
+        """TTL in seconds, None for responses that never expire."""
+        if window_end is not None and window_end < dt.date.today() - dt.timedelta(days=self.closed_days):
+            return None
+        return self.ttls.get(kind)
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT encoding, expires FROM response WHERE cache_key = ?', (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] < time.time():
+                self._delete(key)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+
+            try:
+                with open(self._path(key), 'rb') as f:
+                    content = zlib.decompress(f.read())
+            except (OSError, zlib.error):
+                self._delete(key)
+                self.misses += 1
+                return None
+
+            self.db.execute('UPDATE response SET accessed = ? WHERE cache_key = ?', (time.time(), key))
+            self.db.commit()
+            self.hits += 1
+            return content, row[0]
+
+    def put(self, key, kind, content, encoding, ttl):
+        data = zlib.compress(content, 6)
+        path = self._path(key)
+        with self.lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+            old = self.db.execute('SELECT size FROM response WHERE cache_key = ?', (key,)).fetchone()
+            self.total_bytes += len(data) - (old[0] if old else 0)
+            self.db.execute('INSERT OR REPLACE INTO response (cache_key, kind, size, encoding, expires, accessed)'
+                            ' VALUES (?, ?, ?, ?, ?, ?)',
+                            (key, kind, len(data), encoding, time.time() + ttl if ttl is not None else None,
+                             time.time()))
+            self._evict()
+            self.db.commit()
+
+    def discard(self, key):
+        with self.lock:
+            self._delete(key)
+            self.db.commit()
+
+    def _delete(self, key):
+        row = self.db.execute('SELECT size FROM response WHERE cache_key = ?', (key,)).fetchone()
+        if row is not None:
+            self.total_bytes -= row[0]
+            self.db.execute('DELETE FROM response WHERE cache_key = ?', (key,))
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self.db.execute('SELECT cache_key FROM response ORDER BY accessed LIMIT 100').fetchall()
+            if not rows:
+                break
+            for (key,) in rows:
+                self._delete(key)
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def close(self):
+        logger.info('Response cache: %d hit(s), %d miss(es)', self.hits, self.misses)
+        self.db.close()
+
+
+class CachedResponse(object):
+    def __init__(self, content, encoding):
+        self.content = content
+        self.encoding = encoding
+        self.status_code = 200
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+
+class CachedSession(object):
+    """Wraps a requests session. Without a cache every request goes straight to the portal.
+
+    With a rate limiter, only requests actually sent to the portal wait for it."""
+
+    def __init__(self, session, cache=None, window_end=None, rate_limiter=None):
+        self.session = session
+        self.cache = cache
+        self.window_end = window_end
+        self.rate_limiter = rate_limiter
+        self.context = ''
+        self.search = None
+        self.search_sent = False
+        self.last_key = None
+
+    def _store(self, key, kind, response):
+        if response.status_code == 200:
+            self.cache.put(key, kind, response.content, response.encoding, self.cache.ttl(kind, self.window_end))
+
+    def _send(self, method, url, data=None):
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait()
+        if method == 'POST':
+            return self.session.post(url, data=data)
+        return self.session.get(url)
+
+    def post(self, url, data=None):
+        if self.cache is None:
+            return self._send('POST', url, data)
+
+        key = make_key('POST', url, data)
+        self.context = key
+        self.search = (url, data)
+        self.last_key = key
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.search_sent = False
+            return CachedResponse(*cached)
+
+        response = self._send('POST', url, data)
+        self.search_sent = True
+        self._store(key, 'search', response)
+        return response
+
+    def get(self, url):
+        if self.cache is None:
+            return self._send('GET', url)
+
+        key = make_key('GET', url, context=self.context)
+        self.last_key = key
+        cached = self.cache.get(key)
+        if cached is not None:
+            return CachedResponse(*cached)
+
+        if self.search is not None and not self.search_sent:
+            # The portal must hold the search in its session before it serves a result page
+            self._send('POST', self.search[0], self.search[1])
+            self.search_sent = True
+        response = self._send('GET', url)
+        self._store(key, 'page', response)
+        return response
+
+    def discard_last(self):
+        """Drop the last response from the cache, e.g. when it turned out to be an error page."""
+        if self.cache is not None and self.last_key is not None:
+            self.cache.discard(self.last_key)
+
+
+def add_cache_options(p):
+    p.add_option('--cache_dir', action='store',
+                 dest='cache_dir', type='string', default='')
+    p.add_option('--cache_size', action='store',
+                 dest='cache_size', type='int', default=1024)  # MB
+    p.add_option('--cache_search_ttl', action='store',
+                 dest='cache_search_ttl', type='int', default=24)  # Hours
+    p.add_option('--cache_page_ttl', action='store',
+                 dest='cache_page_ttl', type='int', default=24)  # Hours
+    p.add_option('--cache_closed_days', action='store',
+                 dest='cache_closed_days', type='int', default=30)
+
+
+def open_cache(options):
+    if not options.cache_dir.strip():
+        return None
+    return ResponseCache(options.cache_dir.strip(),
+                         max_bytes=options.cache_size * 1024 * 1024,
+                         ttls={'search': options.cache_search_ttl * 3600, 'page': options.cache_page_ttl * 3600},
+                         closed_days=options.cache_closed_days)
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Links between tender declarations and award notices
+
+declaration_award_link maps every award notice (pk_atm_main, tender_case_no) to the declaration
+(primary_key) it was awarded from. Match rule:
+
+1. The declaration and the award have the same tender_case_no and the same org_id
+   (tender_declaration_info.org_id, organization_info.org_id).
+2. The declaration was published on or before the award date (awarding_date, or the announcement
+   date when missing).
+3. A case tendered again has several declarations; the award is linked to the latest one published
+   on or before the award date. Declarations published the same day are all linked.
+
+Links found with both dates are marked 'case_org_date'. When either date is missing, every
+declaration of the case and organization is linked and marked 'case_org', as the match is ambiguous.
+days_to_award is the number of days from publication to award.
+
+The loader keeps the links up to date with --links, relinking the awards of a batch, and the awards
+matching the declarations of a batch or linked to them before, in the same transaction, so that a
+declaration revised with another case number or organization leaves no stale link.
+`linkage.py --rebuild` relinks all."""
+
+import logging
+import mysql.connector
+from optparse import OptionParser
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 500
+
+_AWARD_DATE = 'COALESCE(a.awarding_date, a.awarding_announce_date)'
+
+_LINK_SQL = ('INSERT INTO declaration_award_link'
+             ' (primary_key, pk_atm_main, tender_case_no, org_id, match_rule, days_to_award)'
+             ' SELECT d.primary_key, o.pk_atm_main, o.tender_case_no, o.org_id,'
+             " IF(d.publication_date IS NOT NULL AND " + _AWARD_DATE + " IS NOT NULL, 'case_org_date', 'case_org'),"
+             ' DATEDIFF(' + _AWARD_DATE + ', d.publication_date)'
+             ' FROM organization_info o'
+             ' LEFT JOIN award_info a ON a.pk_atm_main = o.pk_atm_main AND a.tender_case_no = o.tender_case_no'
+             ' JOIN tender_declaration_info d ON d.tender_case_no = o.tender_case_no AND d.org_id = o.org_id'
+             ' WHERE (d.publication_date IS NULL OR ' + _AWARD_DATE + ' IS NULL'
+             ' OR (d.publication_date <= ' + _AWARD_DATE +
+             ' AND NOT EXISTS (SELECT 1 FROM tender_declaration_info d2'
+             ' WHERE d2.tender_case_no = d.tender_case_no AND d2.org_id = d.org_id'
+             ' AND d2.publication_date > d.publication_date AND d2.publication_date <= ' + _AWARD_DATE + ')))')
+
+
+def relink(cur, award_keys):
+    """Recompute the links of the given awards. Returns the number of links written."""
+    linked = 0
+    award_keys = sorted(set(award_keys))
+    for i in range(0, len(award_keys), _CHUNK_SIZE):
+        chunk = award_keys[i:i + _CHUNK_SIZE]
+        in_list = ' IN (' + ','.join(['(%s,%s)'] * len(chunk)) + ')'
+        params = [v for k in chunk for v in k]
+        cur.execute('DELETE FROM declaration_award_link WHERE (pk_atm_main, tender_case_no)' + in_list, params)
+        cur.execute(_LINK_SQL + ' AND (o.pk_atm_main, o.tender_case_no)' + in_list, params)
+        linked += cur.rowcount
+    return linked
+
+
+def awards_of_declarations(cur, primary_keys):
+    """Awards matching the case number and organization of the given declarations."""
+    keys = []
+    primary_keys = sorted(set(primary_keys))
+    for i in range(0, len(primary_keys), _CHUNK_SIZE):
+        chunk = primary_keys[i:i + _CHUNK_SIZE]
+        cur.execute('SELECT o.pk_atm_main, o.tender_case_no FROM tender_declaration_info d'
+                    ' JOIN organization_info o ON o.tender_case_no = d.tender_case_no AND o.org_id = d.org_id'
+                    ' WHERE d.primary_key IN (' + ','.join(['%s'] * len(chunk)) + ')', chunk)
+        keys.extend(tuple(r) for r in cur.fetchall())
+    return keys
+
+
+def linked_awards(cur, rows):
+    """Awards linked to the declarations of the (table, row) pairs. Has to run before their upserts."""
+    keys = []
+    primary_keys = sorted({row.get('primary_key') for table, row in rows if table == 'tender_declaration_info'})
+    for i in range(0, len(primary_keys), _CHUNK_SIZE):
+        chunk = primary_keys[i:i + _CHUNK_SIZE]
+        cur.execute('SELECT pk_atm_main, tender_case_no FROM declaration_award_link'
+                    ' WHERE primary_key IN (' + ','.join(['%s'] * len(chunk)) + ')', chunk)
+        keys.extend(tuple(r) for r in cur.fetchall())
+    return keys
+
+
+def update_links(cur, rows, linked=()):
+    """Relink the awards touched by the (table, row) pairs just upserted, and the awards linked to
+    them before (see linked_awards). Returns the number of links written."""
+    award_keys = {(row.get('pk_atm_main'), row.get('tender_case_no')) for table, row in rows
+                  if table in ('organization_info', 'award_info')}
+    award_keys.update(linked)
+    primary_keys = {row.get('primary_key') for table, row in rows if table == 'tender_declaration_info'}
+    if primary_keys:
+        award_keys.update(awards_of_declarations(cur, list(primary_keys)))
+    if not award_keys:
+        return 0
+    return relink(cur, award_keys)
+
+
+def rebuild(cnx):
+    cur = cnx.cursor()
+    cur.execute('DELETE FROM declaration_award_link')
+    cur.execute(_LINK_SQL)
+    cnx.commit()
+    return cur.rowcount
+
+
+def parse_args():
+    p = OptionParser()
+    p.add_option('-u', '--user', action='store',
+                 dest='user', type='string', default='')
+    p.add_option('-p', '--password', action='store',
+                 dest='password', type='string', default='')
+    p.add_option('-i', '--host', action='store',
+                 dest='host', type='string', default='')
+    p.add_option('-b', '--database', action='store',
+                 dest='database', type='string', default='')
+    p.add_option('-o', '--port', action='store',
+                 dest='port', type='string', default='3306')
+    p.add_option('--rebuild', action='store_true',
+                 dest='rebuild')
+    p.add_option('-k', '--primary_key', action='store',
+                 dest='primary_key', type='string', default='')
+    p.add_option('-a', '--award', action='store',
+                 dest='award', type='string', default='')  # <pkAtmMain>/<tenderCaseNo>
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    options, remainder = parse_args()
+
+    db_config = {'user': options.user.strip(),
+                 'password': options.password.strip(),
+                 'host': options.host.strip(),
+                 'port': options.port.strip(),
+                 'database': options.database.strip()
+                 }
+    if '' in db_config.values():
+        logger.error('Database connection information is incomplete.')
+        quit()
+
+    db_connection = mysql.connector.connect(**db_config)
+    if options.rebuild:
+        logger.info('Relinking all awards...')
+        logger.info('{} link(s) written.'.format(rebuild(db_connection)))
+
+    cursor = db_connection.cursor()
+    columns = 'primary_key, pk_atm_main, tender_case_no, org_id, match_rule, days_to_award'
+    if options.primary_key.strip():
+        cursor.execute('SELECT ' + columns + ' FROM declaration_award_link WHERE primary_key = %s',
+                       (options.primary_key.strip(),))
+        for row in cursor.fetchall():
+            print('\t'.join(str(v) for v in row))
+    if options.award.strip():
+        pk_atm_main, _, tender_case_no = options.award.strip().partition('/')
+        cursor.execute('SELECT ' + columns + ' FROM declaration_award_link'
+                       ' WHERE pk_atm_main = %s AND tender_case_no = %s', (pk_atm_main, tender_case_no))
+        for row in cursor.fetchall():
+            print('\t'.join(str(v) for v in row))
+    db_connection.close()
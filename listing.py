@@ -0,0 +1,160 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Result list parser shared by the queryers
+
+Every row of a result list page becomes a record holding the link, the bid key and the columns
+shown in the list (case number, organization, subject, announcement date, amount, ...). Records
+are written one per line to a compact JSONL listing file, so that later stages can dedupe, filter
+and prioritize bids before any detail page is fetched.
+
+The revision markers are also appended to the bid list line as tab separated key=value pairs:
+    <url>\tnum_transmit=2\trevision_sn=1\tannounce_date=2017-03-01\tupdated=1
+The downloader only reads the url, the frontier compares the markers with the database."""
+
+import re
+import json
+from urllib import parse
+from lxml import etree
+from converters import remove_space
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+MARKERS = ('num_transmit', 'revision_sn', 'announce_date', 'updated')
+
+
+def roc_to_iso(element):
+    m = re.search(r'(\d+)/(\d+)/(\d+)', element)
+    if m is None:
+        return None
+    return '{:04d}-{:02d}-{:02d}'.format(int(m.group(1)) + 1911, int(m.group(2)), int(m.group(3)))
+
+
+def int_or_none(element):
+    m = re.search(r'\d+', element)
+    return int(m.group(0)) if m is not None else None
+
+
+def money_or_none(element):
+    m = re.search(r'-?[\d,]+', remove_space(element))
+    return int(m.group(0).replace(',', '')) if m is not None else None
+
+
+# Result list column (matched as a substring of the header, first match wins) -> (field, conversion)
+listing_map = (
+    ('機關名稱', ('org_name', remove_space)),
+    ('標案案號', ('tender_case_no', remove_space)),
+    ('標案名稱', ('subject_of_procurement', remove_space)),
+    ('傳輸次數', ('num_transmit', int_or_none)),
+    ('更正序號', ('revision_sn', remove_space)),
+    ('招標方式', ('procurement_type', remove_space)),
+    ('採購性質', ('attr_of_procurement', remove_space)),
+    ('公告日期', ('announce_date', roc_to_iso)),
+    ('截止投標', ('submit_deadline', roc_to_iso)),
+    ('金額', ('amount', money_or_none)))
+
+
+def parse_link(page_link):
+    """Return the output filename and the key fields of a bid link, or (None, None)."""
+    m1 = re.match(r'([^ ]+)pkAtmMain=(?P<pkAtmMain>\w+)&tenderCaseNo=(?P<tenderCaseNo>[\w\-]+)', page_link)
+    if m1 is None:
+        m2 = re.match(r'([^ ]+)primaryKey=(?P<primaryKey>[\w\-]+)', page_link)
+        if m2 is None or m2.group('primaryKey') is None:
+            return None, None
+        return m2.group('primaryKey'), {'primaryKey': m2.group('primaryKey')}
+
+    pkAtmMain = m1.group('pkAtmMain')
+    tenderCaseNo = m1.group('tenderCaseNo')
+    if pkAtmMain is None or tenderCaseNo is None:
+        return None, None
+    return "%s_%s" % (pkAtmMain, tenderCaseNo), {'pkAtmMain': pkAtmMain, 'tenderCaseNo': tenderCaseNo}
+
+
+def cell_text(cell):
+    return ''.join(cell.itertext())
+
+
+def parse_row(headers, row, base_url):
+    links = row.xpath('.//a[@href]/@href')
+    if not links:
+        return None
+
+    url = parse.urljoin(base_url, links[0])
+    key, _ = parse_link(url)
+    record = {'url': url, 'key': key}
+    for name, cell in zip(headers, row.xpath('./td')):
+        if '案號' in name and '名稱' in name:
+            # Case number and subject share a cell, one per line
+            texts = [t.strip() for t in cell.itertext() if t.strip()]
+            if texts:
+                record['tender_case_no'] = remove_space(texts[0])
+                record['subject_of_procurement'] = remove_space(''.join(texts[1:]))
+            continue
+
+        for column, (field, conversion) in listing_map:
+            if column in name:
+                if field not in record:
+                    value = conversion(cell_text(cell))
+                    if value is not None and value != '':
+                        record[field] = value
+                break
+
+    # Corrected notices are flagged in the list
+    if '更正' in cell_text(row):
+        record['updated'] = 1
+    return record
+
+
+def parse_total(content, encoding='utf-8'):
+    """Parse the raw bytes of a search response. Returns the total number of bids found."""
+    root = etree.fromstring(content, etree.HTMLParser(encoding=encoding))
+    total = root.xpath('//span[@class="T11b"]')
+    if not total:
+        raise ValueError('Total number of bids not found')
+    return int(cell_text(total[0]).strip())
+
+
+def parse_list_page(content, base_url, encoding='utf-8'):
+    """Parse the raw bytes of a result list page. Returns one record per bid row."""
+    root = etree.fromstring(content, etree.HTMLParser(encoding=encoding))
+    tables = root.xpath('//div[@id="print_area"]')
+    if not tables:
+        raise ValueError('Result list not found')
+
+    # The first row is the header and the last one the page navigator
+    rows = tables[0].xpath('.//tr')
+    headers = [remove_space(cell_text(cell)) for cell in rows[0].xpath('./th|./td')]
+    records = []
+    for row in rows[1:-1]:
+        record = parse_row(headers, row, base_url)
+        if record is not None:
+            records.append(record)
+    return records
+
+
+def markers(record):
+    return {k: record[k] for k in MARKERS if k in record}
+
+
+def format_line(url, markers):
+    return '\t'.join([url] + ['{}={}'.format(k, v) for k, v in sorted(markers.items())])
+
+
+def parse_line(line):
+    fields = line.rstrip('\r\n').split('\t')
+    markers = {}
+    for field in fields[1:]:
+        k, _, v = field.partition('=')
+        markers[k] = int(v) if v.isdigit() and k in ('num_transmit', 'updated') else v
+    return fields[0].strip(), markers
+
+
+def dump_record(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+
+
+def read_listing(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
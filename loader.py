@@ -3,12 +3,32 @@
 """ Loader for Taiwan government e-procurement website"""
 
 import os
+import re
+import zlib
+import time
+import random
+import queue
+import signal
 import logging
+import threading
 import mysql.connector
+import watcher
+import bid_storage
+import record_store
+import row_types
+import dimensions
+import text_index
+import aggregates
+import linkage
+import coalesce
+import migrate
+import changelog
 import extractor_awarded as eta
 import extractor_declaration as etd
 from datetime import datetime, date
+from collections import OrderedDict
 from mysql.connector import errorcode
+from mysql.connector.constants import ClientFlag
 from optparse import OptionParser
 
 __author__ = "Yu-chun Huang"
@@ -17,6 +37,9 @@ __version__ = "1.0.0b"
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Deadlock and lock wait timeout: the transaction can simply be run again
+_RETRY_ERRNOS = (errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT)
+
 trantab = str.maketrans(
     {'\'': '\\\'',
      '\"': '\\\"',
@@ -27,6 +50,26 @@ trantab = str.maketrans(
      '\\': '\\\\',})
 
 
+def sql_value(v):
+    if isinstance(v, str):
+        return '\'' + v.translate(trantab) + '\''
+    elif isinstance(v, bool):
+        return '1' if v else '0'
+    elif isinstance(v, datetime) or isinstance(v, date):
+        return '\'' + str(v) + '\''
+    else:
+        return str(v)
+
+
+def gen_dup_update(columns):
+    """Update clause of the upserts. With a row_hash column, a row is only rewritten when its hash
+    changed; row_hash has to be assigned last, as the assignments are evaluated in order."""
+    if 'row_hash' not in columns:
+        return ','.join('{0}=VALUES({0})'.format(k) for k in columns)
+    return ','.join(['{0}=IF(row_hash <=> VALUES(row_hash),{0},VALUES({0}))'.format(k)
+                     for k in columns if k != 'row_hash'] + ['row_hash=VALUES(row_hash)'])
+
+
 def gen_insert_sql(table, data_dict):
     sql_template = u'INSERT INTO {} ({}) VALUES ({}) ON DUPLICATE KEY UPDATE {}'
     columns = ''
@@ -41,115 +84,496 @@ def gen_insert_sql(table, data_dict):
                 dup_update += ','
 
             columns += k
-
-            if isinstance(v, str):
-                vstr = '\'' + v.translate(trantab) + '\''
-            elif isinstance(v, bool):
-                vstr = '1' if v else '0'
-            elif isinstance(v, datetime) or isinstance(v, date):
-                vstr = '\'' + str(v) + '\''
-            else:
-                vstr = str(v)
-
+            vstr = sql_value(v)
             values += vstr
             dup_update += k + '=' + vstr
 
+    if data_dict.get('row_hash') is not None:
+        dup_update = gen_dup_update([k for k, v in data_dict.items() if v is not None])
     sql_str = sql_template.format(table, columns, values, dup_update)
     logger.debug(sql_str)
     return sql_str
 
 
-def load_declaration(cnx, file_name):
-    primary_key, root_element = etd.init(file_name)
-    if root_element is None or primary_key is None or primary_key == '':
-        logger.error('Fail to extract data from file: ' + file_name)
-        return
+def gen_batch_insert_sql(table, columns, rows):
+    """One multi-row upsert for rows sharing the same (non-null) columns."""
+    sql_str = u'INSERT INTO {} ({}) VALUES {} ON DUPLICATE KEY UPDATE {}'.format(
+        table,
+        ','.join(columns),
+        ','.join('(' + ','.join(sql_value(row[k]) for k in columns) + ')' for row in rows),
+        gen_dup_update(columns))
+    logger.debug(sql_str)
+    return sql_str
 
-    logger.info('Updating database (primaryKey: {})'.format(primary_key))
 
-    try:
-        cur = cnx.cursor(buffered=True)
-
-        data = etd.get_organization_info_dic(root_element)
-        data.update(etd.get_procurement_info_dic(root_element))
-        data.update(etd.get_declaration_info_dic(root_element))
-        data.update(etd.get_attend_info_dic(root_element))
-        data.update(etd.get_other_info_dic(root_element))
-        data['primary_key'] = primary_key
-
-        cur.execute('SET NAMES utf8mb4')
-        cur.execute(gen_insert_sql('tender_declaration_info', data))
-        cnx.commit()
-    except mysql.connector.Error as e:
-        outstr = 'Fail to update database (primary_key: {})\n\t{}'.format(primary_key, e)
-        logger.warn(outstr)
-        with open('load.err', 'a', encoding='utf-8') as err_file:
-            err_file.write(outstr)
-    except AttributeError as e:
-        outstr = 'Corrupted content. Update skipped (primary_key: {})\n\t{}'.format(primary_key, e)
-        logger.warn(outstr)
-        with open('load.err', 'a', encoding='utf-8') as err_file:
-            err_file.write(outstr)
-
-
-def load_awarded(cnx, file_name):
-    pk_atm_main, tender_case_no, root_element = eta.init(file_name)
-    if root_element is None \
-            or pk_atm_main is None or tender_case_no is None \
-            or pk_atm_main == '' or tender_case_no == '':
-        logger.error('Fail to extract data from file: ' + file_name)
-        return
-
-    pk = {'pk_atm_main': pk_atm_main, 'tender_case_no': tender_case_no}
-    logger.info('Updating database (pkAtmMain: {}, tenderCaseNo: {})'.format(pk_atm_main, tender_case_no))
+def row_hash(row):
+    return dimensions.content_hash('{}={}'.format(k, v) for k, v in row.items() if k != 'row_hash')
+
+
+def log_error(outstr):
+    logger.warning(outstr)
+    with open('load.err', 'a', encoding='utf-8') as err_file:
+        err_file.write(outstr)
+
+
+class RowBatcher(object):
+    """Buffers rows across pages and writes them as multi-row upserts, one transaction per batch.
+
+    Rows of a page are only flushed together with the page, so a page found corrupted halfway is
+    dropped as a whole (abort_page).
+
+    With a dimension cache, organization and vendor rows are split off the pages and only written
+    when the cache does not know them with the same content."""
+
+    def __init__(self, cnx, batch_rows=1000, dimension_cache=None, normalized=False, use_row_hash=True,
+                 max_retries=5, update_aggregates=False, update_links=False, change_log=None):
+        self.cnx = cnx
+        self.change_log = change_log
+        self.update_aggregates = update_aggregates
+        self.update_links = update_links
+        self.batch_rows = batch_rows
+        self.max_retries = max_retries
+        self.dimension_cache = dimension_cache
+        self.normalized = normalized
+        self.use_row_hash = use_row_hash
+        self.pending = []
+        self.page_start = 0
+        self.rows_written = 0
+        self.batches = 0
+        self.dimension_rows_skipped = 0
+        # Outcome of the upserts, from the affected rows: 1 per insert, 2 per update, 0 per unchanged row
+        self.rows_inserted = 0
+        self.rows_updated = 0
+        self.rows_unchanged = 0
+        self.rows_uncounted = 0
+        self.retries = 0
+
+    def stats(self):
+        return {'rows_written': self.rows_written, 'batches': self.batches, 'retries': self.retries,
+                'rows_inserted': self.rows_inserted, 'rows_updated': self.rows_updated,
+                'rows_unchanged': self.rows_unchanged, 'rows_uncounted': self.rows_uncounted,
+                'dimension_rows_skipped': self.dimension_rows_skipped}
+
+    def begin_page(self, key):
+        pass
+
+    def reset(self):
+        self.pending = []
+        self.page_start = 0
+
+    def add(self, table, row):
+        if self.dimension_cache is not None:
+            dimension, row = dimensions.split_row(table, row, self.normalized)
+            if dimension is not None:
+                self.pending.append(dimension)
+        # Slotted records take a fraction of the memory of the row dicts
+        row = row_types.to_record(table, row)
+        if self.use_row_hash:
+            row['row_hash'] = row_hash(row)
+        self.pending.append((table, row))
+
+    def _count(self, n, affected, duplicates=None):
+        if n == 1 or duplicates is not None:
+            inserted = n - duplicates if duplicates is not None else (1 if affected == 1 else 0)
+            updated = (affected - inserted) // 2
+            self.rows_inserted += inserted
+            self.rows_updated += updated
+            self.rows_unchanged += n - inserted - updated
+        else:
+            self.rows_uncounted += n
+
+    def _upsert(self, table, columns, rows):
+        result = self.cnx.cmd_query(gen_batch_insert_sql(table, columns, rows))
+        # The pure Python connector passes the "Records: n  Duplicates: n  Warnings: n" info of multi-row inserts
+        m = re.search(r'Duplicates:\s*(\d+)', (result or {}).get('info_msg') or '')
+        self._count(len(rows), (result or {}).get('affected_rows', 0), int(m.group(1)) if m is not None else None)
+
+    def _skip_current_dimensions(self):
+        """Drop dimension rows already in the database. Returns the dimension rows left to write."""
+        rows = []
+        written = []
+        hashes = {}
+        for table, row in self.pending:
+            if table in dimensions.dimension_tables:
+                key = (table, row[dimensions.dimension_tables[table][0]])
+                if hashes.get(key) == row['row_hash'] or self.dimension_cache.is_current(table, row):
+                    self.dimension_rows_skipped += 1
+                    continue
+                hashes[key] = row['row_hash']
+                written.append((table, row))
+            rows.append((table, row))
+        self.pending = rows
+        return written
+
+    def abort_page(self):
+        del self.pending[self.page_start:]
+
+    def end_page(self):
+        self.page_start = len(self.pending)
+        if len(self.pending) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        self.abort_page()
+        dimension_rows = self._skip_current_dimensions() if self.dimension_cache is not None else []
+        self.page_start = len(self.pending)
+        if not self.pending:
+            return
+
+        # Group by table and column set, keeping the table order of the pages
+        groups = OrderedDict()
+        for table, row in self.pending:
+            columns = tuple(k for k, v in row.items() if v is not None and (self.use_row_hash or k != 'row_hash'))
+            groups.setdefault((table, columns), []).append(row)
+        # Organizations and vendors are shared between writers; locking them in key order avoids deadlocks
+        for (table, columns), rows in groups.items():
+            if table in dimensions.dimension_tables:
+                rows.sort(key=lambda r: r[dimensions.dimension_tables[table][0]])
+
+        if not self.cnx.is_connected():
+            logger.warning('Database connection lost, reconnecting...')
+            self.cnx.reconnect(attempts=5, delay=5)
+            self.cnx.autocommit = False
+
+        cur = self.cnx.cursor(buffered=True)
+        counts = (self.rows_inserted, self.rows_updated, self.rows_unchanged, self.rows_uncounted)
+        attempt = 0
+        changes = []
+        while True:
+            try:
+                cur.execute('SET NAMES utf8mb4')
+                if self.change_log is not None:
+                    # Reads the stored rows too, before the upserts
+                    changes = changelog.diff(cur, self.pending, self.use_row_hash)
+                if self.update_aggregates:
+                    # Reads the stored rows, so it has to run before the upserts, in the same transaction
+                    aggregates.apply_deltas(cur, self.pending)
+                # Awards the declarations of the batch may no longer match once upserted
+                linked = linkage.linked_awards(cur, self.pending) if self.update_links else []
+                for (table, columns), rows in groups.items():
+                    self._upsert(table, columns, rows)
+                if self.update_links:
+                    # Matches on the rows just written
+                    linkage.update_links(cur, self.pending, linked)
+                self.cnx.commit()
+                break
+            except mysql.connector.Error as e:
+                self.cnx.rollback()
+                self.rows_inserted, self.rows_updated, self.rows_unchanged, self.rows_uncounted = counts
+                if e.errno in _RETRY_ERRNOS and attempt < self.max_retries:
+                    # The whole transaction was rolled back by the server; run it again after a while
+                    delay = min(0.1 * 2 ** attempt, 10.0) * (1 + random.random())
+                    logger.warning('{}, retrying batch in {:.2f} s'.format(e, delay))
+                    attempt += 1
+                    self.retries += 1
+                    time.sleep(delay)
+                    continue
+
+                # Write the batch row by row, so that a single bad row does not cost the whole batch
+                logger.warning('Fail to write batch of {} row(s), retrying row by row\n\t{}'.format(
+                    len(self.pending), e))
+                changes = []
+                for table, row in self.pending:
+                    try:
+                        # A failed row takes its aggregate deltas and links back with it
+                        cur.execute('SAVEPOINT batch_row')
+                        row_changes = changelog.diff(cur, [(table, row)], self.use_row_hash) \
+                            if self.change_log is not None else []
+                        if self.update_aggregates:
+                            aggregates.apply_deltas(cur, [(table, row)])
+                        linked = linkage.linked_awards(cur, [(table, row)]) if self.update_links else []
+                        cur.execute(gen_insert_sql(table, OrderedDict(
+                            (k, v) for k, v in row.items() if self.use_row_hash or k != 'row_hash')))
+                        self._count(1, cur.rowcount)
+                        if self.update_links:
+                            linkage.update_links(cur, [(table, row)], linked)
+                        changes.extend(row_changes)
+                    except mysql.connector.Error as e:
+                        try:
+                            cur.execute('ROLLBACK TO SAVEPOINT batch_row')
+                        except mysql.connector.Error:
+                            pass
+                        if table in dimensions.dimension_tables:
+                            dimension_rows = [d for d in dimension_rows if d[1] is not row]
+                        log_error('Fail to update database ({}: {})\n\t{}\n'.format(table, {k: row.get(k) for k in (
+                            'pk_atm_main', 'tender_case_no', 'primary_key') if k in row}, e))
+                self.cnx.commit()
+                break
+
+        if changes:
+            # After the commit: a crash in between loses these changes, never logs uncommitted ones
+            self.change_log.write(changes)
+        for table, row in dimension_rows:
+            self.dimension_cache.remember(table, row)
+        self.rows_written += len(self.pending)
+        self.batches += 1
+        self.pending = []
+        self.page_start = 0
+
+
+class WriterPool(object):
+    """RowBatchers on several connections, each in its own thread.
+
+    Pages are sharded by their key, so the rows of one bid always go through the same connection
+    and the writers never contend for the same fact rows."""
+
+    def __init__(self, connections, batch_rows=1000, dimension_cache=None, normalized=False, use_row_hash=True,
+                 max_retries=5, update_aggregates=False, update_links=False, queue_size=100, change_log=None):
+        # The change log is shared, so that its sequence numbers follow the commits of all writers
+        self.batchers = [RowBatcher(cnx, batch_rows, dimension_cache, normalized, use_row_hash, max_retries,
+                                    update_aggregates, update_links, change_log)
+                         for cnx in connections]
+        self.queues = [queue.Queue(queue_size) for _ in connections]
+        self.threads = [threading.Thread(target=self._run, args=(b, q), daemon=True)
+                        for b, q in zip(self.batchers, self.queues)]
+        self.shard = 0
+        self.page = []
+        for t in self.threads:
+            t.start()
+
+    def _run(self, batcher, q):
+        while True:
+            task = q.get()
+            try:
+                if task is None:
+                    batcher.flush()
+                    return
+                if task == 'flush':
+                    batcher.flush()
+                else:
+                    for table, row in task:
+                        batcher.add(table, row)
+                    batcher.end_page()
+            except Exception as e:
+                batcher.reset()
+                logger.error('Fail to write batch\n\t{}'.format(e))
+            finally:
+                q.task_done()
+
+    def stats(self):
+        total = {}
+        for b in self.batchers:
+            for k, v in b.stats().items():
+                total[k] = total.get(k, 0) + v
+        return total
+
+    def begin_page(self, key):
+        self.shard = zlib.crc32('\t'.join(str(key[k]) for k in sorted(key)).encode('utf-8')) % len(self.batchers)
+        self.page = []
+
+    def add(self, table, row):
+        self.page.append((table, row))
+
+    def abort_page(self):
+        self.page = []
+
+    def end_page(self):
+        self.queues[self.shard].put(self.page)
+        self.page = []
+
+    def reset(self):
+        self.page = []
+
+    def flush(self):
+        for q in self.queues:
+            q.put('flush')
+        for q in self.queues:
+            q.join()
+
+    def close(self):
+        for q in self.queues:
+            q.put(None)
+        for t in self.threads:
+            t.join()
+
+
+def describe(kind, key):
+    if kind == 'declaration':
+        return 'primaryKey: {}'.format(key['primary_key'])
+    return 'pkAtmMain: {}, tenderCaseNo: {}'.format(key['pk_atm_main'], key['tender_case_no'])
+
+
+def iter_events(files, is_declaration, tables=None):
+    """Parse bid detail pages. Yields ('page', file, kind, key), then ('row', table, row) as rows are
+    extracted, then ('end',), or ('abort', message) when the content turned out to be corrupted.
+
+    tables limits the parsing to the sections of those tables (of those sections for declarations)."""
+    for file_name in files:
+        try:
+            if is_declaration:
+                kind = 'declaration'
+                primary_key, root_element = etd.init(file_name, tables)
+                key = {'primary_key': primary_key}
+                valid = root_element is not None and primary_key
+            else:
+                kind = 'awarded'
+                pk_atm_main, tender_case_no, root_element = eta.init(file_name, tables)
+                key = {'pk_atm_main': pk_atm_main, 'tender_case_no': tender_case_no}
+                valid = root_element is not None and pk_atm_main and tender_case_no
+        except AttributeError:
+            valid = False
+        if not valid:
+            logger.error('Fail to extract data from file: ' + file_name)
+            continue
+
+        yield 'page', file_name, kind, key
+        if is_declaration:
+            rows = etd.iter_rows(root_element, primary_key, tables)
+        else:
+            rows = eta.iter_rows(root_element, key, tables)
+        try:
+            for table, row in rows:
+                yield 'row', table, row
+        except AttributeError as e:
+            yield 'abort', 'Corrupted content. Update skipped ({})\n\t{}'.format(describe(kind, key), e)
+            continue
+        yield 'end',
+
+
+def iter_record_events(record_file, tables=None):
+    """The same events for pages persisted by the extractors (or --save_records), for the given tables only."""
+    for kind, key, page_tables in record_store.read_records(record_file):
+        yield 'page', None, kind, key
+        for table, rows in page_tables.items():
+            if tables is not None and table not in tables:
+                continue
+            for row in rows:
+                yield 'row', table, row
+        yield 'end',
+
+
+def pipelined(events, maxsize=10000):
+    """Run the event generator in a background thread, so that pages are parsed while rows are written."""
+    q = queue.Queue(maxsize)
+    errors = []
+    done = object()
+
+    def produce():
+        try:
+            for event in events:
+                q.put(event)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            q.put(done)
+
+    t = threading.Thread(target=produce, daemon=True)
+    t.start()
+    while True:
+        event = q.get()
+        if event is done:
+            break
+        yield event
+    t.join()
+    if errors:
+        raise errors[0]
+
+
+def load_events(batcher, events, recorder=None, index=None):
+    """Feed parsed rows to the batcher, and to the text index if any. Returns the number of pages loaded."""
+    sinks = [batcher] if index is None else [index, batcher]
+    pages = 0
+    current = None
+    tables = None
+    for event in events:
+        if event[0] == 'page':
+            current = event
+            for sink in sinks:
+                sink.begin_page(event[3])
+            logger.info('Updating database ({})'.format(describe(event[2], event[3])))
+            tables = OrderedDict() if recorder is not None and event[1] is not None else None
+        elif event[0] == 'row':
+            for sink in sinks:
+                sink.add(event[1], event[2])
+            if tables is not None:
+                tables.setdefault(event[1], []).append(event[2])
+        elif event[0] == 'abort':
+            for sink in sinks:
+                sink.abort_page()
+            log_error(event[1])
+        elif event[0] == 'end':
+            for sink in sinks:
+                sink.end_page()
+            if tables is not None:
+                recorder.write(current[2], current[3], tables, current[1])
+            pages += 1
+    return pages
+
+
+def load_files(batcher, files, is_declaration, recorder=None, pipeline=False, index=None, tables=None):
+    events = iter_events(files, is_declaration, tables)
+    if pipeline:
+        events = pipelined(events)
+    pages = load_events(batcher, events, recorder, index)
+    batcher.flush()
+    if index is not None:
+        index.flush()
+    return pages
+
+
+def load_records(batcher, record_file, pipeline=False, index=None, tables=None):
+    """Load pages persisted by the extractors (or --save_records) without parsing any HTML."""
+    events = iter_record_events(record_file, tables)
+    if pipeline:
+        events = pipelined(events)
+    pages = load_events(batcher, events, index=index)
+    batcher.flush()
+    if index is not None:
+        index.flush()
+    return pages
+
+
+def watch_directory(batcher, w, is_declaration, batch_size, batch_interval, recorder=None, pipeline=False,
+                    index=None, latest_only=False, tables=None):
+    """Keep loading files reported by the watcher until SIGINT/SIGTERM is received.
+
+    The connection and the parsers stay warm between batches. Every batch is committed at once."""
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info('Shutting down after the current batch...')
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
 
     try:
-        cur = cnx.cursor(buffered=True)
-
-        data = eta.get_organization_info_dic(root_element)
-        data.update(pk)
-        cur.execute(gen_insert_sql('organization_info', data))
-
-        data = eta.get_procurement_info_dic(root_element)
-        data.update(pk)
-        cur.execute(gen_insert_sql('procurement_info', data))
-
-        data = eta.get_tender_info_dic(root_element)
-        for tender in data.values():
-            tender.update(pk)
-            cur.execute(gen_insert_sql('tender_info', tender))
-
-        data = eta.get_tender_award_item_dic(root_element)
-        for item in data.values():
-            for tender in item.values():
-                tender.update(pk)
-                cur.execute(gen_insert_sql('tender_award_item', tender))
-
-        data = eta.get_evaluation_committee_info_list(root_element)
-        for committee in data:
-            committee.update(pk)
-            cur.execute(gen_insert_sql('evaluation_committee_info', committee))
-
-        data = eta.get_award_info_dic(root_element)
-        data.update(pk)
-
-        cur.execute('SET NAMES utf8mb4')
-        cur.execute(gen_insert_sql('award_info', data))
-        cnx.commit()
-    except mysql.connector.Error as e:
-        outstr = 'Fail to update database (pkAtmMain: {}, tenderCaseNo: {})\n\t{}'.format(pk_atm_main,
-                                                                                          tender_case_no,
-                                                                                          e)
-        logger.warn(outstr)
-        with open('load.err', 'a', encoding='utf-8') as err_file:
-            err_file.write(outstr)
-    except AttributeError as e:
-        outstr = 'Corrupted content. Update skipped (pkAtmMain: {}, tenderCaseNo: {})\n\t{}'.format(pk_atm_main,
-                                                                                                    tender_case_no,
-                                                                                                    e)
-        logger.warn(outstr)
-        with open('load.err', 'a', encoding='utf-8') as err_file:
-            err_file.write(outstr)
+        for batch in watcher.watch_batches(w, stop_event, batch_size, batch_interval):
+            start = time.time()
+            try:
+                files = [f for f in batch if os.path.isfile(f)]
+                if latest_only:
+                    files, skipped = coalesce.latest_files(files)
+                load_files(batcher, files, is_declaration, recorder, pipeline, index, tables)
+            except Exception as e:
+                batcher.reset()
+                logger.error('Fail to load batch\n\t{}'.format(e))
+            logger.info('Loaded {} file(s) in {:.2f} s'.format(len(batch), time.time() - start))
+    finally:
+        w.close()
+
+
+def selected_tables(option, is_declaration):
+    """Tables (sections of tender_declaration_info for declarations) given with --tables; None for all."""
+    if is_declaration:
+        sections = etd.parse_sections(option)
+        if sections is not None and not sections <= set(etd.SECTIONS):
+            raise ValueError('Unknown section(s): ' + ', '.join(sorted(sections - set(etd.SECTIONS))))
+        return sections
+    tables = eta.parse_tables(option)
+    if tables is not None and not tables <= set(eta.TABLES):
+        raise ValueError('Unknown table(s): ' + ', '.join(sorted(tables - set(eta.TABLES))))
+    return tables
+
+
+def index_fields(tables, is_declaration):
+    """Fields of the text index the selected tables (or sections) hold; None for all."""
+    if tables is None:
+        return None
+    if is_declaration:
+        columns = etd.section_columns(tables)
+        return {field for column, field in text_index.indexed_columns['tender_declaration_info'] if column in columns}
+    return {field for table in tables for column, field in text_index.indexed_columns.get(table, ())}
 
 
 def parse_args():
@@ -170,6 +594,48 @@ def parse_args():
                  dest='port', type='string', default='3306')
     p.add_option("-a", '--declaration', action="store_true",
                  dest='is_declaration')
+    p.add_option('-r', '--records', action='store',
+                 dest='records', type='string', default='')
+    p.add_option('-s', '--save_records', action='store',
+                 dest='save_records', type='string', default='')
+    p.add_option('-j', '--scan_workers', action='store',
+                 dest='scan_workers', type='int', default=8)
+    p.add_option('-w', '--watch', action='store_true',
+                 dest='watch')
+    p.add_option('--batch_size', action='store',
+                 dest='batch_size', type='int', default=100)
+    p.add_option('--batch_interval', action='store',
+                 dest='batch_interval', type='float', default=2.0)
+    p.add_option('--batch_rows', action='store',
+                 dest='batch_rows', type='int', default=1000)
+    p.add_option('--pipeline', action='store_true',
+                 dest='pipeline')
+    p.add_option('--dimensions', action='store_true',
+                 dest='dimensions')
+    p.add_option('--dimension_cache_size', action='store',
+                 dest='dimension_cache_size', type='int', default=100000)
+    p.add_option('--normalized', action='store_true',
+                 dest='normalized')
+    p.add_option('--no_row_hash', action='store_false',
+                 dest='row_hash', default=True)
+    p.add_option('--aggregates', action='store_true',
+                 dest='aggregates')
+    p.add_option('--links', action='store_true',
+                 dest='links')
+    p.add_option('--text_index', action='store',
+                 dest='text_index', type='string', default='')
+    p.add_option('--writers', action='store',
+                 dest='writers', type='int', default=1)
+    p.add_option('--max_retries', action='store',
+                 dest='max_retries', type='int', default=5)
+    p.add_option('--coalesce', action='store_true',
+                 dest='coalesce')  # Load only the latest revision of every notice
+    p.add_option('--tables', action='store',
+                 dest='tables', type='string', default='')  # Comma separated tables (sections with -a)
+    p.add_option('--change_log', action='store',
+                 dest='change_log', type='string', default='')  # Directory of the change log segments
+    p.add_option('--change_log_segment_mb', action='store',
+                 dest='change_log_segment_mb', type='int', default=64)
 
     return p.parse_args()
 
@@ -187,38 +653,94 @@ if __name__ == '__main__':
         logger.error('Database connection information is incomplete.')
         quit()
 
+    try:
+        tables = selected_tables(options.tables, is_declaration)
+    except ValueError as e:
+        logger.error(e)
+        quit()
+    if tables is not None:
+        logger.info('Loading {} only.'.format(', '.join(sorted(tables))))
+
     db_config = {'user': user,
                  'password': password,
                  'host': host,
                  'port': port,
-                 'database': database
+                 'database': database,
+                 # Affected rows instead of found rows, so that unchanged rows count 0 in the upserts
+                 'client_flags': [-ClientFlag.FOUND_ROWS]
                  }
 
+    recorder = None
+    if options.save_records.strip():
+        recorder = record_store.RecordWriter(options.save_records.strip(), append=True)
+    index = None
+    if options.text_index.strip():
+        index = text_index.TextIndex(options.text_index.strip(), fields=index_fields(tables, is_declaration))
+    change_log = None
+    if options.change_log.strip():
+        change_log = changelog.ChangeLog(options.change_log.strip(), options.change_log_segment_mb << 20)
+
     try:
-        db_connection = mysql.connector.connect(**db_config)
-        db_connection.autocommit = False
+        connections = []
+        for _ in range(max(options.writers, 1)):
+            db_connection = mysql.connector.connect(**db_config)
+            db_connection.autocommit = False
+            connections.append(db_connection)
+        if options.row_hash:
+            missing = migrate.missing_row_hash(connections[0].cursor(buffered=True))
+            if missing:
+                # The upserts of a database older than row_hash would all fail
+                logger.warning('No row_hash column in {}; rows are not hashed. Add it with migrate.py --row_hash '
+                               '--apply.'.format(', '.join(missing)))
+                options.row_hash = False
+        dimension_cache = None
+        if options.dimensions or options.normalized:
+            dimension_cache = dimensions.DimensionCache(options.dimension_cache_size)
+        if len(connections) > 1:
+            batcher = WriterPool(connections, options.batch_rows, dimension_cache, options.normalized,
+                                 options.row_hash, options.max_retries, options.aggregates, options.links,
+                                 change_log=change_log)
+        else:
+            batcher = RowBatcher(connections[0], options.batch_rows, dimension_cache, options.normalized,
+                                 options.row_hash, options.max_retries, options.aggregates, options.links,
+                                 change_log)
+
+        r = options.records.strip()
+        if r != '':
+            if not os.path.isfile(r):
+                logger.error('File not found: ' + r)
+            else:
+                # Records hold whole rows; only the tables are selected, not declaration sections
+                load_records(batcher, r, options.pipeline, index, None if is_declaration else tables)
 
         f = options.filename.strip()
         if f != '':
             if not os.path.isfile(f):
                 logger.error('File not found: ' + f)
             else:
-                if is_declaration:
-                    load_declaration(db_connection, f)
-                else:
-                    load_awarded(db_connection, f)
+                load_files(batcher, [f], is_declaration, recorder, index=index, tables=tables)
 
         d = options.directory.strip()
         if d != '':
             if not os.path.isdir(d):
                 logger.error('Directory not found: ' + d)
             else:
-                for root, dirs, files in os.walk(d):
-                    for f in files:
-                        if is_declaration:
-                            load_declaration(db_connection, os.path.join(root, f))
-                        else:
-                            load_awarded(db_connection, os.path.join(root, f))
+                # Watch before walking so that files written during the walk are not missed
+                w = None
+                if options.watch:
+                    w = watcher.open_watcher(d)
+                    logger.info('Watching directory: ' + d)
+
+                # Flat and sharded layouts alike; shard directories are listed in parallel
+                files = bid_storage.iter_files(d, options.scan_workers)
+                if options.coalesce:
+                    files, skipped = coalesce.latest_files(files)
+                    logger.info('{} superseded revision(s) skipped.'.format(skipped))
+                load_files(batcher, files, is_declaration, recorder, options.pipeline, index, tables)
+
+                if w is not None:
+                    watch_directory(batcher, w, is_declaration, options.batch_size, options.batch_interval,
+                                    recorder, options.pipeline, index, options.coalesce, tables)
     except mysql.connector.Error as err:
         if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
             logger.error("Something is wrong with your user name or password.")
@@ -227,4 +749,23 @@ if __name__ == '__main__':
         else:
             logger.error(err)
     else:
-        db_connection.close()
+        if isinstance(batcher, WriterPool):
+            batcher.close()
+        stats = batcher.stats()
+        logger.info('{} row(s) written in {} batch(es), {} retried.'.format(
+            stats['rows_written'], stats['batches'], stats['retries']))
+        logger.info('{} inserted, {} updated, {} unchanged, {} not counted.'.format(
+            stats['rows_inserted'], stats['rows_updated'], stats['rows_unchanged'], stats['rows_uncounted']))
+        if dimension_cache is not None:
+            logger.info('{} unchanged organization/vendor row(s) skipped.'.format(stats['dimension_rows_skipped']))
+        if change_log is not None:
+            logger.info('{} change(s) logged, up to seq {}.'.format(change_log.count, change_log.seq))
+        for db_connection in connections:
+            db_connection.close()
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if index is not None:
+            index.close()
+        if change_log is not None:
+            change_log.close()
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Secondary indexes and row hashes
+
+--row_hash adds the row_hash column the loader compares in its upserts to the tables of databases
+created before it (schema.sql has it for new ones). --indexes adds the secondary indexes of the
+queries in workload.sql and of the declaration links of linkage.py (see secondary_indexes; new
+databases get them from schema.sql). Without
+--apply, the statements are only printed. --explain shows the plan of every workload query.
+
+award_info and tender_declaration_info are not partitioned: MySQL would need their date in the
+primary key, and a notice would no longer be a single row, which the upserts, the aggregates, the
+links and the change log all rely on. The date indexes serve the queries by month instead."""
+
+import os
+import re
+import logging
+import datetime as dt
+import mysql.connector
+from optparse import OptionParser
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WORKLOAD_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workload.sql')
+
+# Index -> (table, columns, workload queries using it; 'linkage' for the joins of linkage.py)
+secondary_indexes = {
+    'award_info_awarding_date_idx': ('award_info', ('awarding_date',), ('awards_by_awarding_date',)),
+    'award_info_announce_date_idx': ('award_info', ('awarding_announce_date',), ('awards_announced_in_month',)),
+    'organization_info_org_idx': ('organization_info', ('org_id',), ('awards_of_agency',)),
+    'organization_info_case_org_idx': ('organization_info', ('tender_case_no', 'org_id'), ('linkage',)),
+    'tender_info_tenderer_idx': ('tender_info', ('tenderer_id', 'is_awarded'), ('bids_of_vendor', 'wins_of_vendor')),
+    'procurement_info_opening_date_idx': ('procurement_info', ('opening_date',), ('openings_between',)),
+    'tender_declaration_case_org_idx': ('tender_declaration_info', ('tender_case_no', 'org_id', 'publication_date'),
+                                        ('linkage',)),
+    'tender_declaration_org_date_idx': ('tender_declaration_info', ('org_id', 'publication_date'),
+                                        ('declarations_of_agency',)),
+    'tender_declaration_publication_idx': ('tender_declaration_info', ('publication_date',),
+                                           ('declarations_published_in_month',))}
+
+# Tables whose upserts compare a row_hash column (see loader.py)
+row_hash_tables = ('organization_info', 'procurement_info', 'tender_info', 'tender_award_item',
+                   'evaluation_committee_info', 'award_info', 'tender_declaration_info', 'organization', 'vendor')
+
+
+def read_workload(filename=WORKLOAD_FILENAME):
+    """Return [(name, sql)] of the queries in the workload file."""
+    queries = []
+    name = None
+    lines = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            m = re.match(r'--\s*name:\s*(\w+)', line)
+            if m is not None:
+                if name is not None:
+                    queries.append((name, ' '.join(lines).rstrip(';')))
+                name = m.group(1)
+                lines = []
+            elif name is not None and line.strip() and not line.startswith('--'):
+                lines.append(line.strip())
+    if name is not None:
+        queries.append((name, ' '.join(lines).rstrip(';')))
+    return queries
+
+
+def existing_indexes(cur):
+    cur.execute('SELECT DISTINCT index_name FROM information_schema.statistics WHERE table_schema = DATABASE()')
+    return {r[0] for r in cur.fetchall()}
+
+
+def index_statements(cur):
+    existing = existing_indexes(cur)
+    return ['ALTER TABLE `{}` ADD INDEX `{}` ({})'.format(table, name, ', '.join('`' + c + '`' for c in columns))
+            for name, (table, columns, queries) in sorted(secondary_indexes.items()) if name not in existing]
+
+
+def drop_index_statements(cur):
+    existing = existing_indexes(cur)
+    return ['ALTER TABLE `{}` DROP INDEX `{}`'.format(table, name)
+            for name, (table, columns, queries) in sorted(secondary_indexes.items()) if name in existing]
+
+
+def missing_row_hash(cur):
+    """Tables of the database that have no row_hash column yet."""
+    cur.execute("SELECT t.table_name, SUM(c.column_name = 'row_hash') FROM information_schema.tables t"
+                " LEFT JOIN information_schema.columns c"
+                " ON c.table_schema = t.table_schema AND c.table_name = t.table_name"
+                " WHERE t.table_schema = DATABASE() GROUP BY t.table_name")
+    existing = {r[0]: r[1] for r in cur.fetchall()}
+    return [t for t in row_hash_tables if t in existing and not existing[t]]
+
+
+def row_hash_statements(cur):
+    return ['ALTER TABLE `{}` ADD COLUMN `row_hash` char(32) DEFAULT NULL'.format(t) for t in missing_row_hash(cur)]
+
+
+def month_start(d):
+    return dt.date(d.year, d.month, 1)
+
+
+def next_month(d):
+    return dt.date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+
+def run(cnx, statements, apply=False):
+    cur = cnx.cursor()
+    for sql in statements:
+        if apply:
+            logger.info(sql[:200])
+            cur.execute(sql)
+        else:
+            print(sql + ';')
+
+
+def explain(cnx, params, workload_filename=WORKLOAD_FILENAME):
+    """Print the plan of every workload query: the tables read, the key chosen and the rows examined."""
+    cur = cnx.cursor(dictionary=True)
+    for name, sql in read_workload(workload_filename):
+        cur.execute('EXPLAIN ' + sql, params)
+        for row in cur.fetchall():
+            print('{:32s} {:24s} {:10s} {:40s} {}'.format(name, str(row.get('table')), str(row.get('type')),
+                                                          str(row.get('key')), row.get('rows')))
+
+
+def parse_args():
+    p = OptionParser()
+    p.add_option('-u', '--user', action='store',
+                 dest='user', type='string', default='')
+    p.add_option('-p', '--password', action='store',
+                 dest='password', type='string', default='')
+    p.add_option('-i', '--host', action='store',
+                 dest='host', type='string', default='')
+    p.add_option('-b', '--database', action='store',
+                 dest='database', type='string', default='')
+    p.add_option('-o', '--port', action='store',
+                 dest='port', type='string', default='3306')
+    p.add_option('--row_hash', action='store_true',
+                 dest='row_hash')
+    p.add_option('--indexes', action='store_true',
+                 dest='indexes')
+    p.add_option('--drop_indexes', action='store_true',
+                 dest='drop_indexes')
+    p.add_option('--apply', action='store_true',
+                 dest='apply')
+    p.add_option('--explain', action='store_true',
+                 dest='explain')
+    p.add_option('-w', '--workload', action='store',
+                 dest='workload', type='string', default=WORKLOAD_FILENAME)
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    options, remainder = parse_args()
+
+    db_config = {'user': options.user.strip(),
+                 'password': options.password.strip(),
+                 'host': options.host.strip(),
+                 'port': options.port.strip(),
+                 'database': options.database.strip()
+                 }
+    if '' in db_config.values():
+        logger.error('Database connection information is incomplete.')
+        quit()
+
+    db_connection = mysql.connector.connect(**db_config)
+    cursor = db_connection.cursor()
+    if options.row_hash:
+        run(db_connection, row_hash_statements(cursor), options.apply)
+    if options.drop_indexes:
+        run(db_connection, drop_index_statements(cursor), options.apply)
+    if options.indexes:
+        run(db_connection, index_statements(cursor), options.apply)
+    if options.explain:
+        today = dt.date.today()
+        explain(db_connection, {'date_start': month_start(today).isoformat(), 'date_end': today.isoformat(),
+                                'month_start': month_start(today).isoformat(),
+                                'month_end': next_month(today).isoformat(),
+                                'org_id': '', 'tenderer_id': ''}, options.workload.strip())
+    db_connection.close()
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Count-only crawl planner
+
+Posts only the searches of every date window of the targets (awarded and declaration queries,
+and with -g category the categories of -m/-c, --taxonomy or --all_categories), reads the number of bids each
+one reports and estimates what the crawl will cost: one search and one result list page per 100
+bids for every window with bids, one detail page per bid. Times are for --rate requests per second
+for the queryers and --download_rate for downloader.py. The counts are saved as a plan (see
+crawl_plan.py), which the queryers run with --plan without searching the empty windows again.
+
+Bids found in several categories are listed once by queryer_category.py, so the detail pages of
+overlapping categories are an upper bound."""
+
+import requests
+import logging
+import datetime as dt
+import http_cache
+import crawl_plan
+import queryer_awarded
+import queryer_declaration
+import queryer_category
+from optparse import OptionParser
+from math import ceil
+from rate_limiter import RateLimiter
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+_ERRCODE_DATE = 2
+_ERRCODE_FILENAME = 3
+_ERRCODE_TARGET = 4
+
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def plan_windows(date_range, targets, categories):
+    """Windows of the targets, without their counts."""
+    windows = []
+    for s_date, e_date in queryer_awarded.date_windows(date_range):
+        dates = {'date_start': s_date.strftime('%Y%m%d'), 'date_end': e_date.strftime('%Y%m%d')}
+        for target in targets:
+            if target in ('awarded', 'declaration'):
+                windows.append(dict(target=target, key=queryer_awarded.window_key(s_date, e_date),
+                                    category_main='', category_cd='', total=None, **dates))
+            else:
+                for category_main, category_cd in categories:
+                    windows.append(dict(target=target, category_main=category_main, category_cd=category_cd,
+                                        key=queryer_category.window_key(s_date, e_date, category_main, category_cd),
+                                        total=None, **dates))
+    return windows
+
+
+def count_window(window, org_name, procurement_subject, cache=None, rate_limiter=None):
+    """Post the search of the window and set its total; None when the search failed."""
+    s_date = dt.datetime.strptime(window['date_start'], '%Y%m%d').date()
+    e_date = dt.datetime.strptime(window['date_end'], '%Y%m%d').date()
+    rs = http_cache.CachedSession(requests.session(), cache, e_date, rate_limiter)
+    try:
+        if window['target'] == 'awarded':
+            total = queryer_awarded.search(rs, s_date, e_date, org_name, procurement_subject)
+        elif window['target'] == 'declaration':
+            total = queryer_declaration.search(rs, s_date, e_date, org_name, procurement_subject)
+        else:
+            total = queryer_category.search(rs, s_date, e_date, window['category_main'], window['category_cd'],
+                                            window['target'] == 'category_declaration')
+    except:
+        rs.discard_last()
+        logger.warning('Fail to count {} {}'.format(window['target'], window['key']))
+        total = None
+    window['total'] = total
+    return total
+
+
+def estimate(windows, rate=1.0, download_rate=1.0):
+    """Requests and hours of the crawl of the windows, per target and in total.
+
+    Windows whose count failed are left out of the pages and bids, but not of the searches."""
+    totals = {}
+    for w in windows:
+        for target in (w['target'], 'all'):
+            t = totals.setdefault(target, {'windows': 0, 'empty_windows': 0, 'failed_windows': 0, 'bids': 0,
+                                           'searches': 0, 'list_pages': 0, 'detail_pages': 0})
+            t['windows'] += 1
+            if w['total'] is None:
+                t['failed_windows'] += 1
+                t['searches'] += 1
+            elif w['total'] == 0:
+                t['empty_windows'] += 1
+            else:
+                t['bids'] += w['total']
+                t['searches'] += 1
+                t['list_pages'] += int(ceil(w['total'] / 100.0))
+                t['detail_pages'] += w['total']
+    for t in totals.values():
+        t['listing_hours'] = (t['searches'] + t['list_pages']) / rate / 3600 if rate > 0 else 0.0
+        t['download_hours'] = t['detail_pages'] / download_rate / 3600 if download_rate > 0 else 0.0
+    return totals
+
+
+def print_estimate(totals):
+    print('{:22s} {:>8s} {:>7s} {:>7s} {:>10s} {:>9s} {:>11s} {:>13s} {:>9s} {:>9s}'.format(
+        'target', 'windows', 'empty', 'failed', 'bids', 'searches', 'list pages', 'detail pages', 'list (h)',
+        'fetch (h)'))
+    for target in sorted(totals, key=lambda k: (k == 'all', k)):
+        t = totals[target]
+        print('{:22s} {:8d} {:7d} {:7d} {:10d} {:9d} {:11d} {:13d} {:9.1f} {:9.1f}'.format(
+            target, t['windows'], t['empty_windows'], t['failed_windows'], t['bids'], t['searches'],
+            t['list_pages'], t['detail_pages'], t['listing_hours'], t['download_hours']))
+
+
+def parse_args():
+    p = OptionParser()
+    p.add_option('-s', '--date_start', action='store',
+                 dest='date_start', type='string', default=dt.date.today().strftime('%Y%m%d'))
+    p.add_option('-e', '--date_end', action='store',
+                 dest='date_end', type='string', default=dt.date.today().strftime('%Y%m%d'))
+    p.add_option('-o', '--org_name', action='store',
+                 dest='org_name', type='string', default='')
+    p.add_option('-p', '--procurement_subject', action='store',
+                 dest='procurement_subject', type='string', default='')
+    p.add_option('-g', '--targets', action='store',
+                 dest='targets', type='string', default='awarded,declaration')  # Comma separated, see crawl_plan
+    p.add_option('-m', '--category_main', action='store',
+                 dest='category_main', type='string', default='3')
+    p.add_option('-c', '--category_cd', action='store',
+                 dest='category_cd', type='string', default='')
+    p.add_option('-t', '--taxonomy', action='store',
+                 dest='taxonomy', type='string', default='')
+    p.add_option('-a', '--all_categories', action='store_true',
+                 dest='all_categories')
+    p.add_option('-r', '--rate', action='store',
+                 dest='rate', type='float', default=1.0)  # Requests per second, of the searches too
+    p.add_option('--download_rate', action='store',
+                 dest='download_rate', type='float', default=1.0)
+    p.add_option('-f', '--plan_filename', action='store',
+                 dest='plan_filename', type='string', default='crawl_plan.json')
+    http_cache.add_cache_options(p)
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    options, remainder = parse_args()
+
+    date_range = ('', '')
+    try:
+        date_range = (dt.datetime.strptime(options.date_start.strip(), '%Y%m%d').date(),
+                      dt.datetime.strptime(options.date_end.strip(), '%Y%m%d').date())
+        if date_range[0] > date_range[1]:
+            logger.error('Start date must be smaller than or equal to end date.')
+            quit(_ERRCODE_DATE)
+    except ValueError:
+        logger.error('Invalid start/end date.')
+        quit(_ERRCODE_DATE)
+
+    targets = [t.strip() for t in options.targets.split(',') if t.strip()]
+    unknown = [t for t in targets if t not in crawl_plan.targets]
+    if not targets or unknown:
+        logger.error('Unknown target(s): {}; use {}.'.format(', '.join(unknown),
+                                                             ', '.join(sorted(crawl_plan.targets))))
+        quit(_ERRCODE_TARGET)
+
+    if options.taxonomy.strip():
+        try:
+            categories = queryer_category.read_taxonomy(options.taxonomy.strip())
+        except IOError:
+            logger.error('File not found: ' + options.taxonomy.strip())
+            quit(_ERRCODE_FILENAME)
+    elif options.all_categories:
+        categories = [(main, '') for main in queryer_category.MAIN_CATEGORIES]
+    else:
+        categories = [(options.category_main.strip(), options.category_cd.strip())]
+
+    org_name = options.org_name.strip()
+    procurement_subject = options.procurement_subject.strip()
+    cache = http_cache.open_cache(options)
+    limiter = RateLimiter(options.rate) if options.rate > 0 else None
+
+    windows = plan_windows(date_range, targets, categories)
+    logger.info('Counting the bids of {} window(s)...'.format(len(windows)))
+    for n, window in enumerate(windows, 1):
+        total = count_window(window, org_name, procurement_subject, cache, limiter)
+        logger.info('\t({} / {}) {} {}: {}'.format(n, len(windows), window['target'], window['key'],
+                                                  'failed' if total is None else total))
+    if cache is not None:
+        cache.close()
+
+    totals = estimate(windows, options.rate, options.download_rate)
+    print_estimate(totals)
+    logger.info('About {:.1f} h of listing at {} request(s)/s and {:.1f} h of downloading at {} request(s)/s.'.format(
+        totals['all']['listing_hours'], options.rate, totals['all']['download_hours'], options.download_rate))
+    crawl_plan.save_plan(options.plan_filename.strip(),
+                         {'date_start': options.date_start.strip(), 'date_end': options.date_end.strip(),
+                          'org_name': org_name, 'procurement_subject': procurement_subject},
+                         windows, {'rate': options.rate, 'download_rate': options.download_rate, 'totals': totals})
+    logger.info('Plan saved to {}; run the queryers with --plan {}.'.format(options.plan_filename.strip(),
+                                                                             options.plan_filename.strip()))
@@ -1,21 +1,40 @@
 #!/usr/bin/python
 #  -*- coding: utf-8 -*-
 """ Queryer for Taiwan government e-procurement website
-Modified from the source code provided by https://github.com/ywchiu/pythonetl"""
+Modified from the source code provided by https://github.com/ywchiu/pythonetl
 
+Besides a single category (-m/-c), a whole taxonomy can be crawled in one job, either from a file
+(--taxonomy, one "<main>\t<code>" per line, '#' starts a comment) or with --all_categories, which
+searches the three main categories as a whole. Categories are queried concurrently under one rate
+limit, and every bid is written once. Once every window is done, each bid is tagged with the first
+of the categories it was found in, in taxonomy order, and its listing record lists them all."""
+
+import os
+import json
 import requests
 import logging
+import threading
 import time
 import datetime as dt
-from urllib import parse
+import listing
+import http_cache
+import work_queue
+import checkpoint
+import crawl_plan
 from optparse import OptionParser
-from bs4 import BeautifulSoup
 from math import ceil
+from rate_limiter import RateLimiter
+from concurrent.futures import ThreadPoolExecutor
 
 __author__ = "Yu-chun Huang"
 __version__ = "1.0.0b"
 
 _ERRCODE_DATE = 2
+_ERRCODE_FILENAME = 3
+_ERRCODE_PLAN = 4
+
+# Main categories: 1 = construction, 2 = property, 3 = service
+MAIN_CATEGORIES = ('1', '2', '3')
 
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -33,8 +52,22 @@ def parse_args():
                  dest='category_cd', type='string', default='')
     p.add_option('-f', '--list_filename', action='store',
                  dest='list_filename', type='string', default='bid_list.txt')
+    p.add_option('-l', '--listing_filename', action='store',
+                 dest='listing_filename', type='string', default='')
     p.add_option("-d", '--declaration', action="store_true",
                  dest='is_declaration')
+    p.add_option('-t', '--taxonomy', action='store',
+                 dest='taxonomy', type='string', default='')
+    p.add_option('-a', '--all_categories', action='store_true',
+                 dest='all_categories')
+    p.add_option('-w', '--workers', action='store',
+                 dest='workers', type='int', default=4)
+    p.add_option('-r', '--rate', action='store',
+                 dest='rate', type='float', default=1.0)  # Requests per second
+    http_cache.add_cache_options(p)
+    checkpoint.add_checkpoint_options(p)
+    crawl_plan.add_plan_options(p)
+    work_queue.add_queue_options(p, 'category_windows')
     return p.parse_args()
 
 
@@ -45,8 +78,262 @@ def ad2roc(date, separator=''):
     return roc
 
 
+def date_windows(date_range):
+    # Limit maximum search date span to be within 3 months (consider Feb. can has only 28 days)
+    max_span = 89
+    totalDays = (date_range[1] - date_range[0]).days
+    for i in range(0, int(totalDays / max_span) + 1):
+        s_date = date_range[0] + dt.timedelta(days=i * (max_span - 1) + i)
+        e_date = min(date_range[1], s_date + dt.timedelta(days=max_span - 1))
+        yield s_date, e_date
+
+
+def read_taxonomy(filename):
+    """Return the (main category, category code) pairs listed in the file."""
+    categories = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            fields = line.split('\t') if '\t' in line else line.split()
+            category = (fields[0].strip(), fields[1].strip() if len(fields) > 1 else '')
+            if category not in categories:
+                categories.append(category)
+    return categories
+
+
+def category_tag(category_main, category_cd):
+    return '{}:{}'.format(category_main, category_cd)
+
+
+class ListWriter(object):
+    """Thread-safe writer of the bid list and listing files, skipping bids already written.
+
+    Every category a bid is found in is remembered, and appended to the hits file ("<url>\t<category>"
+    per line) so that a resumed run knows them too. With concurrent workers the first category a
+    bid is written with depends on timing, so retag() tags the files with the first category of
+    each bid in taxonomy order once the crawl is complete."""
+
+    def __init__(self, bid_file, listing_file, list_filename, seen=None, categories=None, hits_file=None,
+                 found=None):
+        self.bid_file = bid_file
+        self.listing_file = listing_file
+        self.hits_file = hits_file
+        self.list_filename = list_filename
+        # URL -> category written
+        self.seen = dict(seen or {})
+        # URL -> every category found in
+        self.found = {url: {category} for url, category in self.seen.items()}
+        for url, found_in in (found or {}).items():
+            self.found.setdefault(url, set()).update(found_in)
+        self.order = {category_tag(*c): n for n, c in enumerate(categories or ())}
+        self.duplicates = 0
+        self.lock = threading.Lock()
+
+    def write(self, records, category):
+        """Write the new records of a page. Returns the sizes of the files once flushed."""
+        with self.lock:
+            for record in records:
+                if category not in self.found.get(record['url'], ()):
+                    self.found.setdefault(record['url'], set()).add(category)
+                    if self.hits_file is not None:
+                        self.hits_file.write('{}\t{}\n'.format(record['url'], category))
+                if record['url'] in self.seen:
+                    self.duplicates += 1
+                    continue
+                self.seen[record['url']] = category
+                record['category'] = category
+                markers = listing.markers(record)
+                markers['category'] = category
+                self.bid_file.write(listing.format_line(record['url'], markers) + '\n')
+                if self.listing_file is not None:
+                    self.listing_file.write(listing.dump_record(record) + '\n')
+            for f in (self.bid_file, self.listing_file, self.hits_file):
+                if f is not None:
+                    f.flush()
+            return checkpoint.file_sizes(self.bid_file, self.listing_file, self.hits_file)
+
+    def sizes(self):
+        with self.lock:
+            return checkpoint.file_sizes(self.bid_file, self.listing_file, self.hits_file)
+
+    def error(self, suffix, line):
+        with self.lock:
+            with open(self.list_filename + suffix, 'a', encoding='utf-8') as err_file:
+                err_file.write(line + '\n')
+
+    def categories(self, url):
+        """Categories the bid was found in, in taxonomy order."""
+        return sorted(self.found[url], key=lambda c: (self.order.get(c, len(self.order)), c))
+
+    def retag(self, listing_filename=''):
+        """Rewrite the closed files with every bid tagged by its first category in taxonomy order.
+
+        Listing records also get all the categories of their bid. Returns the number of bids retagged."""
+        retagged = sum(1 for url in self.found if self.categories(url)[0] != self.seen[url])
+        if not any(len(categories) > 1 for categories in self.found.values()):
+            return 0
+
+        def rewrite(filename, convert):
+            with open(filename, 'r', encoding='utf-8') as f, \
+                    open(filename + '.tmp', 'w', encoding='utf-8') as out:
+                for line in f:
+                    out.write(convert(line) + '\n' if line.strip() else line)
+            os.replace(filename + '.tmp', filename)
+
+        def convert_line(line):
+            url, markers = listing.parse_line(line)
+            if url in self.found:
+                markers['category'] = self.categories(url)[0]
+            return listing.format_line(url, markers)
+
+        def convert_record(line):
+            record = json.loads(line)
+            if record.get('url') in self.found:
+                record['categories'] = self.categories(record['url'])
+                record['category'] = record['categories'][0]
+            return listing.dump_record(record)
+
+        rewrite(self.list_filename, convert_line)
+        if listing_filename:
+            rewrite(listing_filename, convert_record)
+        for url in self.found:
+            self.seen[url] = self.categories(url)[0]
+        return retagged
+
+
+def listed_urls(list_filename):
+    """URL -> category of the bids already in the list file."""
+    if not os.path.isfile(list_filename):
+        return {}
+    with open(list_filename, 'r', encoding='utf-8') as f:
+        return {url: markers.get('category', '') for url, markers in
+                (listing.parse_line(line) for line in f if line.strip())}
+
+
+def hits_filename(list_filename):
+    return list_filename + '.categories'
+
+
+def category_hits(hits_filename):
+    """URL -> categories of the hits file."""
+    found = {}
+    if not os.path.isfile(hits_filename):
+        return found
+    with open(hits_filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 2:
+                found.setdefault(fields[0], set()).add(fields[1])
+    return found
+
+
+def window_key(s_date, e_date, category_main, category_cd):
+    return '{}:{}-{}'.format(category_tag(category_main, category_cd),
+                             s_date.strftime('%Y%m%d'), e_date.strftime('%Y%m%d'))
+
+
+def search(rs, s_date, e_date, category_main, category_cd, is_declaration):
+    """Post the search of a window of a category. Returns the total number of bids found."""
+    # Search parameters
+    payload = {'searchMethod': 'true',
+               'proctrgCode': category_cd,
+               'isSpdt': 'N',
+               'searchTarget': ('TPAM' if is_declaration else 'ATM'),
+               'tenderStatusType': '4,5,21,29,9,22,23,30,34,10,24',
+               'tenderWay': '12,2,1,4,5,7,3,10,6',
+               'dmsProctrgCode1': category_cd if category_main == '1' else '',
+               'dmsProctrgCode2': category_cd if category_main == '2' else '',
+               'pmsProctrgCate': category_main,
+               'dmsProctrgCode3': category_cd if category_main == '3' else '',
+               'tenderDateRadio': 'on',
+               'tenderStartDate': (ad2roc(s_date, '/') if is_declaration else ''),
+               'tenderEndDate': (ad2roc(e_date, '/') if is_declaration else ''),
+               'startDate': ad2roc(s_date, '/'),
+               'endDate': ad2roc(e_date, '/'),
+               'awardAnnounceStartDate': ('' if is_declaration else ad2roc(s_date, '/')),
+               'awardAnnounceEndDate': ('' if is_declaration else ad2roc(e_date, '/')),
+               'tenderStatus': ('' if is_declaration else '4,5,21,29,9,22,23,30,34,10,24'),
+               'proctrgCate': ''}
+
+    user_post = rs.post('http://web.pcc.gov.tw/tps/pss/tender.do?' +
+                        'searchMode=common&' +
+                        ('searchType=basic&' if is_declaration else 'searchType=advance&') +
+                        'method=search',
+                        data=payload)
+    return listing.parse_total(user_post.content, user_post.encoding or 'utf-8')
+
+
+def query_window(writer, s_date, e_date, category_main, category_cd, is_declaration,
+                 cache=None, rate_limiter=None, cursor=None):
+    category = category_tag(category_main, category_cd)
+    key = window_key(s_date, e_date, category_main, category_cd)
+    if cursor is not None and cursor.is_done(key):
+        return True
+    logger.info('[%s] Searching for bids from %s to %s...',
+                category, s_date.strftime('%Y-%m-%d'), e_date.strftime('%Y-%m-%d'))
+
+    rs = http_cache.CachedSession(requests.session(), cache, e_date, rate_limiter)
+    try:
+        rec_number = search(rs, s_date, e_date, category_main, category_cd, is_declaration)
+        page_number = int(ceil(float(rec_number) / 100))
+
+        logger.info('[%s] \tTotal number of bids: %d', category, rec_number)
+    except:
+        rs.discard_last()
+        writer.error('.query.err', '\t'.join([str(s_date), str(e_date), category_main, category_cd]))
+        return False
+
+    first_page = 1
+    if cursor is not None:
+        # Windows of several categories are written in turns, so a redone window is not rewound;
+        # the bids it listed already are skipped by the writer instead
+        first_page, sizes = cursor.start_window(key, rec_number, writer.sizes(), rewind_files=False)
+
+    page_format = 'http://web.pcc.gov.tw/tps/pss/tender.do?searchMode=common&'
+    page_format += 'searchType=basic&' if is_declaration else 'searchType=advance&searchTarget=ATM&'
+    page_format += 'method=search&isSpdt=&pageIndex=%d'
+
+    base_url = ('http://web.pcc.gov.tw/tps/pss/tender.do?' +
+                'searchMode=common&' +
+                ('searchType=basic' if is_declaration else 'searchType=advance'))
+    for page in range(first_page, page_number + 1):
+        logger.info('[%s] \tRetrieving bid URLs... (%d / %d)', category, min(page * 100, rec_number), rec_number)
+
+        try:
+            bid_list = rs.get(page_format % page)
+            records = listing.parse_list_page(bid_list.content, base_url, bid_list.encoding or 'utf-8')
+            sizes = writer.write(records, category)
+            if cursor is not None:
+                cursor.page_done(key, page, len(records), sizes)
+        except:
+            rs.discard_last()
+            writer.error('.page.err', page_format % page)
+            if cursor is not None:
+                # The cursor stays before this page and the window is not done, so the next run retries it
+                return False
+            continue
+
+    if cursor is not None:
+        cursor.window_done(key)
+    return True
+
+
+def query_category(writer, windows, category_main, category_cd, is_declaration, cache=None, rate_limiter=None,
+                   cursor=None):
+    for s_date, e_date in windows:
+        query_window(writer, s_date, e_date, category_main, category_cd, is_declaration, cache, rate_limiter,
+                     cursor)
+
+
 if __name__ == '__main__':
     options, remainder = parse_args()
+    try:
+        plan = crawl_plan.open_plan(options)
+    except (IOError, ValueError) as e:
+        logger.error('Fail to read plan: {}'.format(e))
+        quit(_ERRCODE_PLAN)
 
     date_range = ('', '')
     try:
@@ -63,90 +350,100 @@ if __name__ == '__main__':
                 date_range[0].strftime('%Y-%m-%d'), date_range[1].strftime('%Y-%m-%d'),
                 options.list_filename.strip())
 
-    category_main = options.category_main.strip()
-    category_cd = options.category_cd.strip()
-    logger.info('Main category: {}, category code: {}'.format(category_main, category_cd))
+    plan_target = 'category_declaration' if options.is_declaration else 'category'
+    if plan is not None:
+        categories = crawl_plan.categories(plan, plan_target)
+    elif options.taxonomy.strip():
+        if not os.path.isfile(options.taxonomy.strip()):
+            logger.error('File not found: ' + options.taxonomy.strip())
+            quit(_ERRCODE_FILENAME)
+        categories = read_taxonomy(options.taxonomy.strip())
+    elif options.all_categories:
+        categories = [(main, '') for main in MAIN_CATEGORIES]
+    else:
+        categories = [(options.category_main.strip(), options.category_cd.strip())]
+    logger.info('Categories: %s', ', '.join(category_tag(*c) for c in categories))
 
     is_declaration = options.is_declaration
 
-    with open(options.list_filename.strip(), 'w', encoding='utf-8') as bid_file:
-        # Limit maximum search date span to be within 3 months (consider Feb. can has only 28 days)
-        max_span = 89
-        totalDays = (date_range[1] - date_range[0]).days
-        for i in range(0, int(totalDays / max_span) + 1):
-            s_date = date_range[0] + dt.timedelta(days=i * (max_span - 1) + i)
-            e_date = min(date_range[1], s_date + dt.timedelta(days=max_span - 1))
-
-            logger.info('Searching for bids from %s to %s...',
-                        s_date.strftime('%Y-%m-%d'), e_date.strftime('%Y-%m-%d'))
-
-            # Search parameters
-            payload = {'searchMethod': 'true',
-                       'proctrgCode': category_cd,
-                       'isSpdt': 'N',
-                       'searchTarget': ('TPAM' if is_declaration else 'ATM'),
-                       'tenderStatusType': '4,5,21,29,9,22,23,30,34,10,24',
-                       'tenderWay': '12,2,1,4,5,7,3,10,6',
-                       'dmsProctrgCode1': category_cd if category_main == '1' else '',
-                       'dmsProctrgCode2': category_cd if category_main == '2' else '',
-                       'pmsProctrgCate': category_main,
-                       'dmsProctrgCode3': category_cd if category_main == '3' else '',
-                       'tenderDateRadio': 'on',
-                       'tenderStartDate': (ad2roc(s_date, '/') if is_declaration else ''),
-                       'tenderEndDate': (ad2roc(e_date, '/') if is_declaration else ''),
-                       'startDate': ad2roc(s_date, '/'),
-                       'endDate': ad2roc(e_date, '/'),
-                       'awardAnnounceStartDate': ('' if is_declaration else ad2roc(s_date, '/')),
-                       'awardAnnounceEndDate': ('' if is_declaration else ad2roc(e_date, '/')),
-                       'tenderStatus': ('' if is_declaration else '4,5,21,29,9,22,23,30,34,10,24'),
-                       'proctrgCate': ''}
-
-            try:
-                rs = requests.session()
-                user_post = rs.post('http://web.pcc.gov.tw/tps/pss/tender.do?' +
-                                    'searchMode=common&' +
-                                    ('searchType=basic&' if is_declaration else 'searchType=advance&') +
-                                    'method=search',
-                                    data=payload)
-                response_text = user_post.text.encode('utf8')
-
-                soup = BeautifulSoup(response_text, 'lxml')
-                rec_number_element = soup.find('span', {'class': 'T11b'})
-                rec_number = int(rec_number_element.text)
-                page_number = int(ceil(float(rec_number) / 100))
-
-                logger.info('\tTotal number of bids: %d', rec_number)
-            except:
-                with open(options.list_filename.strip() + '.query.err', 'a', encoding='utf-8') as err_file:
-                    err_file.write(str(s_date) + '\t' + str(e_date) + '\n')
-                continue
+    list_filename = options.list_filename.strip()
+    listing_filename = options.listing_filename.strip()
+    cache = http_cache.open_cache(options)
+    # Without the default 1 request per second, the portal may treat the crawler as a DDOS attack
+    limiter = RateLimiter(options.rate) if options.rate > 0 else None
+    windows = list(date_windows(date_range))
+    # A plan leaves out the windows it found no bids in
+    category_windows = {c: crawl_plan.planned_windows(plan, plan_target, c) if plan is not None else windows
+                        for c in categories}
 
-            page_format = 'http://web.pcc.gov.tw/tps/pss/tender.do?searchMode=common&'
-            page_format += 'searchType=basic&' if is_declaration else 'searchType=advance&searchTarget=ATM&'
-            page_format += 'method=search&isSpdt=&pageIndex=%d'
-
-            for page in range(1, page_number + 1):
-                logger.info('\tRetrieving bid URLs... (%d / %d)', min(page * 100, rec_number), rec_number)
-
-                try:
-                    bid_list = rs.get(page_format % page)
-                    bid_response = bid_list.text.encode('utf8')
-                    bid_soup = BeautifulSoup(bid_response, 'lxml')
-                    bid_table = bid_soup.find('div', {'id': 'print_area'})
-                    bid_rows = bid_table.findAll('tr')[1:-1]
-                    for bid_row in bid_rows:
-                        link = [tag['href'] for tag in bid_row.findAll('a', {'href': True})][0]
-                        link_href = parse.urljoin('http://web.pcc.gov.tw/tps/pss/tender.do?' +
-                                                  'searchMode=common&' +
-                                                  ('searchType=basic' if is_declaration else 'searchType=advance'),
-                                                  link)
-                        bid_file.write(link_href + '\n')
-                    bid_file.flush()
-                except:
-                    with open(options.list_filename.strip() + '.page.err', 'a', encoding='utf-8') as err_file:
-                        err_file.write(page_format % page + '\n')
-                    continue
+    cursor = None
+    if options.queue_db.strip():
+        append = True
+        bid_file = open(list_filename, 'a', encoding='utf-8')
+        listing_file = open(listing_filename, 'a', encoding='utf-8') if listing_filename else None
+        hits_file = open(hits_filename(list_filename), 'a', encoding='utf-8')
+    else:
+        # Resumes the run the cursor was saved by, if any; the work queue keeps track of windows otherwise
+        cursor = checkpoint.open_checkpoint(options, list_filename,
+                                            {'date_start': options.date_start.strip(),
+                                             'date_end': options.date_end.strip(),
+                                             'declaration': bool(is_declaration),
+                                             'categories': [category_tag(*c) for c in categories],
+                                             'listing_filename': listing_filename})
+        bid_file, listing_file, hits_file = cursor.open_files(list_filename, listing_filename,
+                                                              hits_filename(list_filename))
+        append = cursor.resumed
+    writer = ListWriter(bid_file, listing_file, list_filename, listed_urls(list_filename) if append else None,
+                        categories, hits_file, category_hits(hits_filename(list_filename)) if append else None)
+
+    if options.queue_db.strip():
+        # Windows are shared with other nodes; every node appends to its own list file
+        wq = work_queue.open_queue(options)
+        wq.enqueue(('{}:{}:{}:{}-{}'.format('TPAM' if is_declaration else 'ATM', category_main, category_cd,
+                                             s_date.strftime('%Y%m%d'), e_date.strftime('%Y%m%d')),
+                    {'date_start': s_date.strftime('%Y%m%d'), 'date_end': e_date.strftime('%Y%m%d'),
+                     'category_main': category_main, 'category_cd': category_cd})
+                   for category_main, category_cd in categories
+                   for s_date, e_date in category_windows[(category_main, category_cd)])
+        for key, window in wq.items():
+            s_date = dt.datetime.strptime(window['date_start'], '%Y%m%d').date()
+            e_date = dt.datetime.strptime(window['date_end'], '%Y%m%d').date()
+            if query_window(writer, s_date, e_date, window['category_main'], window['category_cd'],
+                            is_declaration, cache, limiter):
+                wq.complete(key)
+            else:
+                wq.fail(key)
+        wq.close()
+    elif len(categories) == 1 or options.workers <= 1:
+        for category_main, category_cd in categories:
+            query_category(writer, category_windows[(category_main, category_cd)], category_main, category_cd,
+                           is_declaration, cache, limiter, cursor)
+    else:
+        # Every worker crawls the windows of one category in its own session
+        with ThreadPoolExecutor(max_workers=options.workers) as executor:
+            futures = [executor.submit(query_category, writer, category_windows[(category_main, category_cd)],
+                                       category_main, category_cd, is_declaration, cache, limiter, cursor)
+                       for category_main, category_cd in categories]
+            for future in futures:
+                future.result()
+
+    complete = True
+    if cursor is not None and not cursor.finish([window_key(s_date, e_date, category_main, category_cd)
+                                                  for category_main, category_cd in categories
+                                                  for s_date, e_date in
+                                                  category_windows[(category_main, category_cd)]]):
+        logger.info('Some windows failed; run again to resume from %s.', cursor.filename)
+        complete = False
 
-                time.sleep(1)  # Prevent from being treated as a DDOS attack
+    bid_file.close()
+    hits_file.close()
+    if listing_file is not None:
+        listing_file.close()
+    if complete:
+        # Files of an unfinished run are left as the cursor saw them
+        logger.info('%d bid(s) retagged with their first category.', writer.retag(listing_filename))
+    if cache is not None:
+        cache.close()
 
-    logger.info('All done.')
+    logger.info('All done. %d bid(s) listed, %d duplicate(s) across categories skipped.',
+                len(writer.seen), writer.duplicates)
@@ -7,15 +7,19 @@ import requests
 import logging
 import time
 import datetime as dt
-from urllib import parse
+import listing
+import http_cache
+import work_queue
+import checkpoint
+import crawl_plan
 from optparse import OptionParser
-from bs4 import BeautifulSoup
 from math import ceil
 
 __author__ = "Yu-chun Huang"
 __version__ = "1.0.0b"
 
 _ERRCODE_DATE = 2
+_ERRCODE_PLAN = 3
 
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -33,6 +37,12 @@ def parse_args():
                  dest='procurement_subject', type='string', default='')
     p.add_option('-f', '--list_filename', action='store',
                  dest='list_filename', type='string', default='bid_list.txt')
+    p.add_option('-l', '--listing_filename', action='store',
+                 dest='listing_filename', type='string', default='')
+    http_cache.add_cache_options(p)
+    checkpoint.add_checkpoint_options(p)
+    crawl_plan.add_plan_options(p)
+    work_queue.add_queue_options(p, 'declaration_windows')
     return p.parse_args()
 
 
@@ -43,8 +53,135 @@ def ad2roc(date, separator=''):
     return roc
 
 
+def date_windows(date_range):
+    # Limit maximum search date span to be within 3 months (consider Feb. can has only 28 days)
+    max_span = 89
+    totalDays = (date_range[1] - date_range[0]).days
+    for i in range(0, int(totalDays / max_span) + 1):
+        s_date = date_range[0] + dt.timedelta(days=i * (max_span - 1) + i)
+        e_date = min(date_range[1], s_date + dt.timedelta(days=max_span - 1))
+        yield s_date, e_date
+
+
+def window_key(s_date, e_date):
+    return '{}-{}'.format(s_date.strftime('%Y%m%d'), e_date.strftime('%Y%m%d'))
+
+
+def queue_key(s_date, e_date, org_name, procurement_subject):
+    # Queues of searches with other filters must not share their windows
+    key = window_key(s_date, e_date)
+    if org_name or procurement_subject:
+        key = '{}:{}:{}'.format(org_name, procurement_subject, key)
+    return key
+
+
+def search(rs, s_date, e_date, org_name, procurement_subject):
+    """Post the search of a window. Returns the total number of bids found."""
+    # Search parameters
+    payload = {'method': 'search',
+               'searchMethod': 'true',
+               'tenderUpdate': '',
+               'searchTarget': '',
+               'orgName': org_name,
+               'orgId': '',
+               'hid_1': '1',
+               'tenderName': procurement_subject,
+               'tenderId': '',
+               'tenderType': 'tenderDeclaration',
+               'tenderWay': '1,2,3,4,5,6,7,10,12',
+               'tenderDateRadio': 'on',
+               'tenderStartDateStr': ad2roc(s_date, '/'),
+               'tenderEndDateStr': ad2roc(e_date, '/'),
+               'tenderStartDate': ad2roc(s_date, '/'),
+               'tenderEndDate': ad2roc(e_date, '/'),
+               'isSpdt': 'N',
+               'proctrgCate': '',
+               'btnQuery': '查詢',
+               'hadUpdated': ''}
+
+    user_post = rs.post('http://web.pcc.gov.tw/tps/pss/tender.do?'
+                        'searchMode=common&'
+                        'searchType=basic',
+                        data=payload)
+    return listing.parse_total(user_post.content, user_post.encoding or 'utf-8')
+
+
+def query_window(bid_file, listing_file, list_filename, s_date, e_date, org_name, procurement_subject,
+                 cache=None, cursor=None):
+    key = window_key(s_date, e_date)
+    if cursor is not None and cursor.is_done(key):
+        logger.info('Bids from %s to %s already listed.', s_date.strftime('%Y-%m-%d'), e_date.strftime('%Y-%m-%d'))
+        return True
+
+    logger.info('Searching for bids from %s to %s...',
+                s_date.strftime('%Y-%m-%d'), e_date.strftime('%Y-%m-%d'))
+
+    rs = http_cache.CachedSession(requests.session(), cache, e_date)
+    try:
+        rec_number = search(rs, s_date, e_date, org_name, procurement_subject)
+        page_number = int(ceil(float(rec_number) / 100))
+
+        logger.info('\tTotal number of bids: %d', rec_number)
+    except:
+        rs.discard_last()
+        with open(list_filename + '.query.err', 'a', encoding='utf-8') as err_file:
+            err_file.write(str(s_date) + '\t' + str(e_date) + '\n')
+        return False
+
+    first_page = 1
+    if cursor is not None:
+        first_page, sizes = cursor.start_window(key, rec_number, checkpoint.file_sizes(bid_file, listing_file))
+        if sizes is not None:
+            checkpoint.rewind((bid_file, listing_file), sizes)
+
+    page_format = 'http://web.pcc.gov.tw/tps/pss/tender.do?' \
+                  'searchMode=common&' \
+                  'searchType=basic&' \
+                  'method=search&' \
+                  'isSpdt=&' \
+                  'pageIndex=%d'
+    base_url = ('http://web.pcc.gov.tw/tps/pss/tender.do?'
+                'searchMode=common&'
+                'searchType=basic')
+    for page in range(first_page, page_number + 1):
+        logger.info('\tRetrieving bid URLs... (%d / %d)', min(page * 100, rec_number), rec_number)
+
+        try:
+            bid_list = rs.get(page_format % page)
+            records = listing.parse_list_page(bid_list.content, base_url, bid_list.encoding or 'utf-8')
+            for record in records:
+                bid_file.write(listing.format_line(record['url'], listing.markers(record)) + '\n')
+                if listing_file is not None:
+                    listing_file.write(listing.dump_record(record) + '\n')
+            bid_file.flush()
+            if listing_file is not None:
+                listing_file.flush()
+            if cursor is not None:
+                cursor.page_done(key, page, len(records), checkpoint.file_sizes(bid_file, listing_file))
+        except:
+            rs.discard_last()
+            with open(list_filename + '.page.err', 'a', encoding='utf-8') as err_file:
+                err_file.write(page_format % page + '\n')
+            if cursor is not None:
+                # The cursor stays before this page and the window is not done, so the next run retries it
+                return False
+            continue
+
+        if not isinstance(bid_list, http_cache.CachedResponse):
+            time.sleep(1)  # Prevent from being treated as a DDOS attack
+
+    if cursor is not None:
+        cursor.window_done(key)
+    return True
+
+
 if __name__ == '__main__':
     options, remainder = parse_args()
+    try:
+        plan = crawl_plan.open_plan(options)
+    except (IOError, ValueError) as e:
+        logger.error('Fail to read plan: {}'.format(e))
+        quit(_ERRCODE_PLAN)
 
     date_range = ('', '')
     try:
@@ -71,85 +208,50 @@ if __name__ == '__main__':
     if logstr != '':
         logger.info('Organization name: %s', org_name)
 
-    with open(options.list_filename.strip(), 'w', encoding='utf-8') as bid_file:
-        # Limit maximum search date span to be within 3 months (consider Feb. can has only 28 days)
-        max_span = 89
-        totalDays = (date_range[1] - date_range[0]).days
-        for i in range(0, int(totalDays / max_span) + 1):
-            s_date = date_range[0] + dt.timedelta(days=i * (max_span - 1) + i)
-            e_date = min(date_range[1], s_date + dt.timedelta(days=max_span - 1))
-
-            logger.info('Searching for bids from %s to %s...',
-                        s_date.strftime('%Y-%m-%d'), e_date.strftime('%Y-%m-%d'))
-
-            # Search parameters
-            payload = {'method': 'search',
-                       'searchMethod': 'true',
-                       'tenderUpdate': '',
-                       'searchTarget': '',
-                       'orgName': org_name,
-                       'orgId': '',
-                       'hid_1': '1',
-                       'tenderName': procurement_subject,
-                       'tenderId': '',
-                       'tenderType': 'tenderDeclaration',
-                       'tenderWay': '1,2,3,4,5,6,7,10,12',
-                       'tenderDateRadio': 'on',
-                       'tenderStartDateStr': ad2roc(s_date, '/'),
-                       'tenderEndDateStr': ad2roc(e_date, '/'),
-                       'tenderStartDate': ad2roc(s_date, '/'),
-                       'tenderEndDate': ad2roc(e_date, '/'),
-                       'isSpdt': 'N',
-                       'proctrgCate': '',
-                       'btnQuery': '查詢',
-                       'hadUpdated': ''}
-
-            try:
-                rs = requests.session()
-                user_post = rs.post('http://web.pcc.gov.tw/tps/pss/tender.do?'
-                                    'searchMode=common&'
-                                    'searchType=basic',
-                                    data=payload)
-                response_text = user_post.text.encode('utf8')
-
-                soup = BeautifulSoup(response_text, 'lxml')
-                rec_number_element = soup.find('span', {'class': 'T11b'})
-                rec_number = int(rec_number_element.text)
-                page_number = int(ceil(float(rec_number) / 100))
-
-                logger.info('\tTotal number of bids: %d', rec_number)
-            except:
-                with open(options.list_filename.strip() + '.query.err', 'a', encoding='utf-8') as err_file:
-                    err_file.write(str(s_date) + '\t' + str(e_date) + '\n')
-                continue
-            page_format = 'http://web.pcc.gov.tw/tps/pss/tender.do?' \
-                          'searchMode=common&' \
-                          'searchType=basic&' \
-                          'method=search&' \
-                          'isSpdt=&' \
-                          'pageIndex=%d'
-            for page in range(1, page_number + 1):
-                logger.info('\tRetrieving bid URLs... (%d / %d)', min(page * 100, rec_number), rec_number)
-
-                try:
-                    bid_list = rs.get(page_format % page)
-                    bid_response = bid_list.text.encode('utf8')
-                    bid_soup = BeautifulSoup(bid_response, 'lxml')
-                    bid_table = bid_soup.find('div', {'id': 'print_area'})
-                    bid_rows = bid_table.findAll('tr')[1:-1]
-                    for bid_row in bid_rows:
-                        link = [tag['href'] for tag in bid_row.findAll('a', {'href': True})][0]
-                        link_href = parse.urljoin('http://web.pcc.gov.tw/tps/pss/tender.do?'
-                                                  'searchMode=common&'
-                                                  'searchType=basic',
-                                                  link)
-                        bid_file.write(link_href + '\n')
-                    bid_file.flush()
-                except:
-                    with open(options.list_filename.strip() + '.page.err', 'a', encoding='utf-8') as err_file:
-                        err_file.write(page_format % page + '\n')
-                    continue
-
-                time.sleep(1)  # Prevent from being treated as a DDOS attack
+    list_filename = options.list_filename.strip()
+    listing_filename = options.listing_filename.strip()
+    cache = http_cache.open_cache(options)
+    # A plan leaves out the windows it found no bids in
+    windows = crawl_plan.planned_windows(plan, 'declaration') if plan is not None else list(date_windows(date_range))
+
+    if options.queue_db.strip():
+        # Windows are shared with other nodes; every node appends to its own list file
+        wq = work_queue.open_queue(options)
+        listing_file = open(listing_filename, 'a', encoding='utf-8') if listing_filename else None
+        wq.enqueue((queue_key(s_date, e_date, org_name, procurement_subject),
+                    {'date_start': s_date.strftime('%Y%m%d'), 'date_end': e_date.strftime('%Y%m%d'),
+                     'org_name': org_name, 'procurement_subject': procurement_subject})
+                   for s_date, e_date in windows)
+        with open(list_filename, 'a', encoding='utf-8') as bid_file:
+            for key, window in wq.items():
+                s_date = dt.datetime.strptime(window['date_start'], '%Y%m%d').date()
+                e_date = dt.datetime.strptime(window['date_end'], '%Y%m%d').date()
+                # The filters of the node that queued the window
+                if query_window(bid_file, listing_file, list_filename, s_date, e_date,
+                                window.get('org_name', org_name),
+                                window.get('procurement_subject', procurement_subject), cache):
+                    wq.complete(key)
+                else:
+                    wq.fail(key)
+        wq.close()
+    else:
+        # Resumes the run the cursor was saved by, if any; the work queue keeps track of windows otherwise
+        cursor = checkpoint.open_checkpoint(options, list_filename,
+                                            {'date_start': options.date_start.strip(),
+                                             'date_end': options.date_end.strip(),
+                                             'org_name': org_name, 'procurement_subject': procurement_subject,
+                                             'listing_filename': listing_filename})
+        bid_file, listing_file = cursor.open_files(list_filename, listing_filename)
+        with bid_file:
+            for s_date, e_date in windows:
+                query_window(bid_file, listing_file, list_filename, s_date, e_date,
+                             org_name, procurement_subject, cache, cursor)
+        if not cursor.finish([window_key(s_date, e_date) for s_date, e_date in windows]):
+            logger.info('Some windows failed; run again to resume from %s.', cursor.filename)
+
+    if listing_file is not None:
+        listing_file.close()
+    if cache is not None:
+        cache.close()
 
     logger.info('All done.')
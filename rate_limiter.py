@@ -0,0 +1,34 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Request rate limiter shared by the crawler stages
+
+A token bucket: `rate` requests per second on average, with at most `burst` requests in a row.
+It is thread safe, so concurrent workers can share one limiter."""
+
+import time
+import threading
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+
+class RateLimiter(object):
+    def __init__(self, rate=1.0, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until a request may be sent."""
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
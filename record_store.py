@@ -0,0 +1,82 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Persisted extraction results
+
+One JSON line per page holds the rows extracted from it, grouped by table:
+    {"v":1,"kind":"awarded","key":{...},"source":"bid_detail/...txt","tables":{"award_info":[{...}],...}}
+Values JSON cannot carry are tagged: {"$d":"2017-03-01"} for dates, {"$dt":"2017-03-01T10:00:00"} for
+datetimes and {"$n":"12.5"} for decimals. Files ending with .gz are gzip-compressed.
+
+Loading records skips HTML parsing entirely, so a schema or loader change only needs a reload."""
+
+import gzip
+import json
+from decimal import Decimal
+from datetime import datetime, date
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+FORMAT_VERSION = 1
+
+
+def _default(o):
+    if isinstance(o, datetime):
+        return {'$dt': o.isoformat()}
+    if isinstance(o, date):
+        return {'$d': o.isoformat()}
+    if isinstance(o, Decimal):
+        return {'$n': str(o)}
+    raise TypeError('Object of type {} is not serializable'.format(type(o).__name__))
+
+
+def _object_hook(d):
+    if len(d) == 1:
+        if '$d' in d:
+            return date(*[int(n) for n in d['$d'].split('-')])
+        if '$dt' in d:
+            return datetime.strptime(d['$dt'], '%Y-%m-%dT%H:%M:%S')
+        if '$n' in d:
+            return Decimal(d['$n'])
+    return d
+
+
+def open_file(filename, mode='r'):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't', encoding='utf-8')
+    return open(filename, mode, encoding='utf-8')
+
+
+def dumps(kind, key, tables, source=None):
+    record = {'v': FORMAT_VERSION, 'kind': kind, 'key': key, 'tables': tables}
+    if source is not None:
+        record['source'] = source
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=_default)
+
+
+def loads(line):
+    record = json.loads(line, object_hook=_object_hook)
+    if record.get('v') != FORMAT_VERSION:
+        raise ValueError('Unsupported record version: {}'.format(record.get('v')))
+    return record['kind'], record['key'], record['tables']
+
+
+class RecordWriter(object):
+    def __init__(self, filename, append=False):
+        self.file = open_file(filename, 'a' if append else 'w')
+        self.count = 0
+
+    def write(self, kind, key, tables, source=None):
+        self.file.write(dumps(kind, key, tables, source) + '\n')
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_records(filename):
+    """Yield (kind, key, tables) for every page stored in the file."""
+    with open_file(filename, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Compact record types for extracted rows
+
+One class per table, generated from the extractor maps, with __slots__ in the column order of
+schema.sql (fields known to the maps only are appended). A record holds its values in slots
+instead of a per-row dict, pickles as a plain tuple of values, and still reads like a mapping
+(row['org_name'], row.get(...), row.items()), so batch writers can take it as it is.
+
+Rows with a field no record type knows of are kept as dicts by to_record."""
+
+import os
+import re
+import logging
+import extractor_awarded as eta
+import extractor_declaration as etd
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+_AWARDED_KEY = ('pk_atm_main', 'tender_case_no')
+
+# Table -> (key columns, extractor maps)
+table_maps = {
+    'organization_info': (_AWARDED_KEY, (eta.organization_info_map,)),
+    'procurement_info': (_AWARDED_KEY, (eta.procurement_info_map,)),
+    'tender_info': (_AWARDED_KEY, (eta.tender_map,)),
+    'tender_award_item': (_AWARDED_KEY, (eta.tender_award_item_map,)),
+    'evaluation_committee_info': (_AWARDED_KEY, (eta.evaluation_committee_info_map,)),
+    'award_info': (_AWARDED_KEY, (eta.award_info_map,)),
+    'tender_declaration_info': (('primary_key',), (etd.organization_info_map, etd.procurement_info_map,
+                                                   etd.declaration_info_map, etd.attend_info_map,
+                                                   etd.other_info_map))}
+
+
+def read_schema_columns(filename=SCHEMA_FILENAME):
+    """Return {table: [column, ...]} in the order of the CREATE TABLE statements."""
+    columns = {}
+    if not os.path.isfile(filename):
+        return columns
+
+    table = None
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            m = re.match(r'\s*CREATE TABLE `(\w+)`', line)
+            if m is not None:
+                table = m.group(1)
+                columns[table] = []
+                continue
+            m = re.match(r'\s*`(\w+)`\s', line)
+            if table is not None and m is not None:
+                columns[table].append(m.group(1))
+            elif line.lstrip().startswith(')'):
+                table = None
+    return columns
+
+
+def table_columns(table, schema_columns):
+    key, maps = table_maps[table]
+    columns = list(schema_columns.get(table) or key)
+    for mapper in maps:
+        for spec in mapper.values():
+            if spec[0] not in columns:
+                columns.append(spec[0])
+    return tuple(columns)
+
+
+class Record(object):
+    """Base of the generated record types. Unset fields are None, as with absent dict keys."""
+    __slots__ = ()
+    table = None
+    columns = ()
+
+    def __init__(self, *values, **fields):
+        for name, value in zip(self.columns, values):
+            object.__setattr__(self, name, value)
+        for name in self.columns[len(values):]:
+            object.__setattr__(self, name, None)
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def from_dict(cls, row):
+        return cls(**row)
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+    def __contains__(self, name):
+        return name in self.columns and getattr(self, name) is not None
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def keys(self):
+        return [name for name in self.columns if getattr(self, name) is not None]
+
+    def items(self):
+        """Set fields in column order, like the items of the dict the row came from."""
+        return [(name, getattr(self, name)) for name in self.columns if getattr(self, name) is not None]
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self.columns)
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def update(self, fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def __reduce__(self):
+        return self.__class__, self.values()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.values() == other.values()
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__,
+                               ', '.join('{}={!r}'.format(k, v) for k, v in self.items()))
+
+
+def make_record_type(table, columns):
+    name = ''.join(part.capitalize() for part in table.split('_')) + 'Row'
+    return type(name, (Record,), {'__slots__': columns, 'table': table, 'columns': columns})
+
+
+def build_record_types(schema_filename=SCHEMA_FILENAME):
+    schema_columns = read_schema_columns(schema_filename)
+    return {table: make_record_type(table, table_columns(table, schema_columns)) for table in table_maps}
+
+
+record_types = build_record_types()
+
+# Module level names, so that records can be pickled between worker processes
+globals().update({cls.__name__: cls for cls in record_types.values()})
+
+
+def to_record(table, row):
+    """Convert an extracted row to the record type of its table; rows that do not fit stay dicts."""
+    if isinstance(row, Record):
+        return row
+    cls = record_types.get(table)
+    if cls is None:
+        return row
+    try:
+        return cls.from_dict(row)
+    except AttributeError:
+        logger.debug('Row of {} kept as dict: {}'.format(table, sorted(set(row) - set(cls.columns))))
+        return row
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Priority-ordered download scheduler
+
+Pending bids are kept in a heap ordered by a priority function over their listing record (see
+listing.py) and handed out at the pace of a rate limiter. Priority functions return a sort key,
+the smallest key is downloaded first. Several functions can be combined, e.g. 'org,amount,recent'
+orders by preferred organization first, then by budget tier, then by announcement date. A custom
+function is given as 'module:function'. Bids with equal keys keep their listing order.
+
+The preferred organizations and categories of 'org' and 'category' are given to the scheduler, so
+that every scheduler of a process keeps its own."""
+
+import heapq
+import importlib
+from functools import partial
+from datetime import date
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+# Upper bounds of the budget tiers: small purchase, announcement threshold, audit threshold,
+# audit threshold of works, huge procurement of works
+budget_tiers = (100000, 1000000, 10000000, 50000000, 200000000)
+
+
+def recent(record):
+    announce_date = record.get('announce_date')
+    if not announce_date:
+        return 0
+    return -date(*[int(n) for n in announce_date.split('-')]).toordinal()
+
+
+def amount(record):
+    value = record.get('amount')
+    if value is None:
+        return 0
+    tier = len(budget_tiers)
+    for i, bound in enumerate(budget_tiers):
+        if value < bound:
+            tier = i
+            break
+    return -tier
+
+
+def org(record, preferred_orgs=()):
+    name = record.get('org_name') or ''
+    for i, preferred in enumerate(preferred_orgs):
+        if preferred and preferred in name:
+            return i
+    return len(preferred_orgs)
+
+
+def category(record, preferred_categories=()):
+    value = record.get('category') or record.get('attr_of_procurement') or ''
+    for i, preferred in enumerate(preferred_categories):
+        if preferred and preferred in str(value):
+            return i
+    return len(preferred_categories)
+
+
+def fifo(record):
+    return 0
+
+
+priority_functions = {'recent': recent, 'amount': amount, 'org': org, 'category': category, 'fifo': fifo}
+
+
+def load_priority(spec, preferred_orgs=(), preferred_categories=()):
+    """Build a priority function from a comma separated list of names or module:function."""
+    preferences = {org: {'preferred_orgs': tuple(preferred_orgs)},
+                   category: {'preferred_categories': tuple(preferred_categories)}}
+    functions = []
+    for name in [n.strip() for n in (spec or 'fifo').split(',') if n.strip()]:
+        if ':' in name:
+            module_name, _, function_name = name.partition(':')
+            functions.append(getattr(importlib.import_module(module_name), function_name))
+        elif name in priority_functions:
+            f = priority_functions[name]
+            functions.append(partial(f, **preferences[f]) if f in preferences else f)
+        else:
+            raise ValueError('Unknown priority function: ' + name)
+
+    if len(functions) == 1:
+        return functions[0]
+    return lambda record: tuple(f(record) for f in functions)
+
+
+class PriorityScheduler(object):
+    def __init__(self, priority=fifo, rate_limiter=None, preferred_orgs=(), preferred_categories=()):
+        """priority is a priority function, or a spec for load_priority with the given preferences."""
+        if isinstance(priority, str):
+            priority = load_priority(priority, preferred_orgs, preferred_categories)
+        self.priority = priority
+        self.rate_limiter = rate_limiter
+        self.heap = []
+        self.seq = 0
+
+    def push(self, record):
+        heapq.heappush(self.heap, (self.priority(record), self.seq, record))
+        self.seq += 1
+
+    def pop(self):
+        """Return the most urgent record once the rate limiter allows another request."""
+        record = heapq.heappop(self.heap)[2]
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait()
+        return record
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __iter__(self):
+        while self.heap:
+            yield self.pop()
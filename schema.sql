@@ -10,7 +10,10 @@ CREATE TABLE `organization_info` (
   `contact` varchar(45) DEFAULT NULL COMMENT '聯絡人',
   `tel` varchar(45) DEFAULT NULL COMMENT '聯絡電話',
   `fax` varchar(45) DEFAULT NULL COMMENT '傳真號碼',
-  PRIMARY KEY (`pk_atm_main`,`tender_case_no`)
+  `row_hash` char(32) DEFAULT NULL COMMENT '內容雜湊',
+  PRIMARY KEY (`pk_atm_main`,`tender_case_no`),
+  KEY `organization_info_case_org_idx` (`tender_case_no`,`org_id`),
+  KEY `organization_info_org_idx` (`org_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 CREATE TABLE `procurement_info` (
@@ -47,7 +50,9 @@ CREATE TABLE `procurement_info` (
   `is_special_budget` char(1) DEFAULT NULL COMMENT '是否含特別預算',
   `project_type` varchar(45) DEFAULT NULL COMMENT '歸屬計畫類別',
   `is_authorities_template` char(1) DEFAULT NULL COMMENT '本案採購契約是否採用主管機關訂定之範本',
-  PRIMARY KEY (`pk_atm_main`,`tender_case_no`)
+  `row_hash` char(32) DEFAULT NULL COMMENT '內容雜湊',
+  PRIMARY KEY (`pk_atm_main`,`tender_case_no`),
+  KEY `procurement_info_opening_date_idx` (`opening_date`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 CREATE TABLE `tender_info` (
@@ -72,7 +77,9 @@ CREATE TABLE `tender_info` (
   `num_employee` int(11) DEFAULT NULL COMMENT '僱用員工總人數',
   `num_aboriginal` int(11) DEFAULT NULL COMMENT '已僱用原住民人數',
   `num_disability` int(11) DEFAULT NULL COMMENT '已僱用身心障礙者人數',
-  PRIMARY KEY (`pk_atm_main`,`tender_case_no`,`tender_sn`)
+  `row_hash` char(32) DEFAULT NULL COMMENT '內容雜湊',
+  PRIMARY KEY (`pk_atm_main`,`tender_case_no`,`tender_sn`),
+  KEY `tender_info_tenderer_idx` (`tenderer_id`,`is_awarded`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 CREATE TABLE `tender_award_item` (
@@ -89,6 +96,7 @@ CREATE TABLE `tender_award_item` (
   `base_price` decimal(10,0) DEFAULT NULL COMMENT '底價金額',
   `source_country` varchar(100) DEFAULT NULL COMMENT '原產地國別',
   `source_award_price` decimal(10,0) DEFAULT NULL COMMENT '原產地國別得標金額',
+  `row_hash` char(32) DEFAULT NULL COMMENT '內容雜湊',
   PRIMARY KEY (`pk_atm_main`,`tender_case_no`,`item_sn`,`tender_sn`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
@@ -99,6 +107,7 @@ CREATE TABLE `evaluation_committee_info` (
   `is_attend` char(1) DEFAULT NULL COMMENT '出席會議',
   `name` varchar(45) DEFAULT NULL COMMENT '姓名',
   `occupation` varchar(1000) DEFAULT NULL COMMENT '職業',
+  `row_hash` char(32) DEFAULT NULL COMMENT '內容雜湊',
   PRIMARY KEY (`pk_atm_main`,`tender_case_no`,`sn`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
@@ -120,7 +129,10 @@ CREATE TABLE `award_info` (
   `fulfill_execution_org_id` varchar(45) DEFAULT NULL COMMENT '履約執行機關代碼',
   `fulfill_execution_org_name` varchar(100) DEFAULT NULL COMMENT '履約執行機關名稱',
   `additional_info` varchar(2000) DEFAULT NULL COMMENT '附加說明',
-  PRIMARY KEY (`pk_atm_main`,`tender_case_no`)
+  `row_hash` char(32) DEFAULT NULL COMMENT '內容雜湊',
+  PRIMARY KEY (`pk_atm_main`,`tender_case_no`),
+  KEY `award_info_awarding_date_idx` (`awarding_date`),
+  KEY `award_info_announce_date_idx` (`awarding_announce_date`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 CREATE TABLE `tender_declaration_info` (
@@ -190,5 +202,75 @@ CREATE TABLE `tender_declaration_info` (
   `is_disaster_reconstruct` char(1) DEFAULT NULL COMMENT '是否屬災區重建工程',
   `qualify_abstract` varchar(2000) DEFAULT NULL COMMENT '廠商資格摘要',
   `is_qualify_fulfill` char(1) DEFAULT NULL COMMENT '是否訂有與履約能力有關之基本資格',
-  PRIMARY KEY (`primary_key`)
-) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
\ No newline at end of file
+  `row_hash` char(32) DEFAULT NULL COMMENT '內容雜湊',
+  PRIMARY KEY (`primary_key`),
+  KEY `tender_declaration_case_org_idx` (`tender_case_no`,`org_id`,`publication_date`),
+  KEY `tender_declaration_org_date_idx` (`org_id`,`publication_date`),
+  KEY `tender_declaration_publication_idx` (`publication_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE `work_queue` (
+  `queue_name` varchar(45) NOT NULL COMMENT '佇列名稱',
+  `item_key` varchar(191) NOT NULL COMMENT '工作項目鍵值',
+  `payload` text COMMENT '工作內容 (JSON)',
+  `status` varchar(10) NOT NULL DEFAULT 'pending' COMMENT 'pending / leased / done / failed',
+  `lease_owner` varchar(100) DEFAULT NULL COMMENT '租用節點',
+  `lease_token` varchar(32) DEFAULT NULL COMMENT '租用憑證',
+  `lease_expires` bigint(20) DEFAULT NULL COMMENT '租用到期時間 (Unix time)',
+  `attempts` int(11) NOT NULL DEFAULT '0' COMMENT '嘗試次數',
+  `completed_by` varchar(100) DEFAULT NULL COMMENT '完成節點',
+  `completed_at` bigint(20) DEFAULT NULL COMMENT '完成時間 (Unix time)',
+  PRIMARY KEY (`queue_name`,`item_key`),
+  KEY `work_queue_lease_idx` (`queue_name`,`status`,`lease_expires`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE `organization` (
+  `org_id` varchar(45) NOT NULL COMMENT '機關代碼',
+  `org_name` varchar(45) DEFAULT NULL COMMENT '機關名稱',
+  `org_address` varchar(100) DEFAULT NULL COMMENT '機關地址',
+  `row_hash` char(32) DEFAULT NULL COMMENT '內容雜湊',
+  PRIMARY KEY (`org_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE `vendor` (
+  `tenderer_id` varchar(45) NOT NULL COMMENT '廠商代碼',
+  `tenderer_name` varchar(200) DEFAULT NULL COMMENT '廠商名稱',
+  `tenderer_name_eng` varchar(200) DEFAULT NULL COMMENT '廠商名稱(英)',
+  `organization_type` varchar(45) DEFAULT NULL COMMENT '組織型態',
+  `industry_type` varchar(45) DEFAULT NULL COMMENT '廠商業別',
+  `address` varchar(1000) DEFAULT NULL COMMENT '廠商地址',
+  `address_eng` varchar(1000) DEFAULT NULL COMMENT '廠商地址(英)',
+  `tel` varchar(45) DEFAULT NULL COMMENT '廠商電話',
+  `row_hash` char(32) DEFAULT NULL COMMENT '內容雜湊',
+  PRIMARY KEY (`tenderer_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE `vendor_monthly` (
+  `tenderer_id` varchar(45) NOT NULL COMMENT '廠商代碼',
+  `month` date NOT NULL COMMENT '決標月份',
+  `bid_count` int(11) NOT NULL DEFAULT '0' COMMENT '投標次數',
+  `win_count` int(11) NOT NULL DEFAULT '0' COMMENT '得標次數',
+  `award_amount` decimal(15,0) NOT NULL DEFAULT '0' COMMENT '得標金額',
+  PRIMARY KEY (`tenderer_id`,`month`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE `agency_monthly` (
+  `org_id` varchar(45) NOT NULL COMMENT '機關代碼',
+  `month` date NOT NULL COMMENT '決標月份',
+  `tender_count` int(11) NOT NULL DEFAULT '0' COMMENT '決標案件數',
+  `bid_count` int(11) NOT NULL DEFAULT '0' COMMENT '投標廠商數',
+  `win_count` int(11) NOT NULL DEFAULT '0' COMMENT '得標廠商數',
+  `award_amount` decimal(15,0) NOT NULL DEFAULT '0' COMMENT '決標金額',
+  PRIMARY KEY (`org_id`,`month`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE `declaration_award_link` (
+  `primary_key` varchar(45) NOT NULL COMMENT '招標公告主鍵',
+  `pk_atm_main` varchar(45) NOT NULL COMMENT '決標公告主鍵',
+  `tender_case_no` varchar(45) NOT NULL COMMENT '標案案號',
+  `org_id` varchar(45) DEFAULT NULL COMMENT '機關代碼',
+  `match_rule` varchar(20) DEFAULT NULL COMMENT '比對規則 (case_org_date / case_org)',
+  `days_to_award` int(11) DEFAULT NULL COMMENT '公告至決標天數',
+  PRIMARY KEY (`primary_key`,`pk_atm_main`,`tender_case_no`),
+  KEY `declaration_award_link_award_idx` (`pk_atm_main`,`tender_case_no`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
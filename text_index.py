@@ -0,0 +1,302 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" N-gram full-text index over procurement subjects, award items and tenderer names
+
+Chinese text has no word boundaries, so every field is normalized (NFKC, lower case, spaces and
+punctuation removed) and cut into overlapping bigrams and trigrams. Each n-gram maps to the sorted
+list of documents (bids) holding it, stored delta/varint-encoded in a SQLite file. A query is cut
+the same way (trigrams when it is long enough, bigrams otherwise), the posting lists are intersected
+from the shortest one and the candidates are checked against the stored text, so that n-grams
+found apart do not match.
+
+A posting list is a sequence of chunks, each holding the documents added and removed by a flush.
+A flush appends one chunk per n-gram and merges it with the chunks before it only while they are
+not much larger (as in a log-structured merge), so updating a common n-gram costs about the size
+of the change rather than of its whole list.
+
+The loader keeps the index up to date with --text_index: a reloaded page replaces the texts of
+its bid, and only the n-grams that changed are touched."""
+
+import os
+import re
+import sqlite3
+import logging
+import unicodedata
+import record_store
+from optparse import OptionParser
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+_ERRCODE_FILENAME = 3
+
+logger = logging.getLogger(__name__)
+
+# Table -> (indexed column, field name)
+indexed_columns = {
+    'procurement_info': (('subject_of_procurement', 'subject'),),
+    'tender_declaration_info': (('subject_of_procurement', 'subject'),),
+    'tender_award_item': (('item_name', 'item'),),
+    'tender_info': (('tenderer_name', 'tenderer'),)}
+
+_NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalize(text):
+    return _NON_WORD.sub('', unicodedata.normalize('NFKC', text).lower())
+
+
+def ngrams(text, sizes=(2, 3)):
+    """N-grams of a normalized text. Texts shorter than the smallest size are kept whole."""
+    grams = set()
+    for n in sizes:
+        grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+    if not grams and text:
+        grams.add(text)
+    return grams
+
+
+def doc_key(key):
+    """Document key of a bid: '<pk_atm_main>/<tender_case_no>' or the primary key of a declaration."""
+    if 'primary_key' in key:
+        return key['primary_key']
+    return '{}/{}'.format(key['pk_atm_main'], key['tender_case_no'])
+
+
+def encode_postings(doc_ids):
+    out = bytearray()
+    last = 0
+    for doc_id in doc_ids:
+        delta = doc_id - last
+        last = doc_id
+        while delta >= 0x80:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def merge_chunks(older, newer, first=False):
+    """Merge two consecutive (added, removed) chunks. Removals are dropped from the first chunk of a list."""
+    added = (older[0] - newer[1]) | newer[0]
+    removed = set() if first else (older[1] | newer[1]) - added
+    return added, removed
+
+
+def decode_postings(data):
+    doc_ids = []
+    last = 0
+    value = 0
+    shift = 0
+    for b in data:
+        value |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            last += value
+            doc_ids.append(last)
+            value = 0
+            shift = 0
+    return doc_ids
+
+
+class TextIndex(object):
+    """fields limits what the pages fed in replace, for loads of some tables only; the other fields are kept."""
+
+    def __init__(self, filename, flush_docs=1000, fields=None):
+        self.db = sqlite3.connect(filename)
+        self.db.execute('CREATE TABLE IF NOT EXISTS doc (doc_id INTEGER PRIMARY KEY, doc_key TEXT UNIQUE)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS doc_text (doc_id INTEGER, field TEXT, text TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS doc_text_idx ON doc_text (doc_id)')
+        # n leads the row, so reading the sizes of the chunks does not read their documents
+        self.db.execute('CREATE TABLE IF NOT EXISTS posting_chunk (gram TEXT, seq INTEGER, n INTEGER, docs BLOB,'
+                        ' removed BLOB, PRIMARY KEY (gram, seq)) WITHOUT ROWID')
+        if self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'posting'").fetchone():
+            # Index of a single list per n-gram
+            self.db.executemany('INSERT INTO posting_chunk (gram, seq, n, docs, removed) VALUES (?, 0, ?, ?, ?)',
+                                [(gram, len(decode_postings(docs)), docs, b'')
+                                 for gram, docs in self.db.execute('SELECT gram, docs FROM posting').fetchall()])
+            self.db.execute('DROP TABLE posting')
+        self.db.commit()
+        self.flush_docs = flush_docs
+        self.fields = fields
+        self.added = {}
+        self.removed = {}
+        self.docs_pending = 0
+        self.page = None
+
+    def _doc_id(self, key):
+        row = self.db.execute('SELECT doc_id FROM doc WHERE doc_key = ?', (key,)).fetchone()
+        if row is not None:
+            return row[0]
+        return self.db.execute('INSERT INTO doc (doc_key) VALUES (?)', (key,)).lastrowid
+
+    def replace(self, key, texts, fields=None):
+        """Replace the indexed texts of a document (of the given fields only) by the given (field, text) pairs."""
+        doc_id = self._doc_id(key)
+        texts = {(field, normalize(text)) for field, text in texts if text}
+        texts = {(field, text) for field, text in texts if text}
+        old = set(self.db.execute('SELECT field, text FROM doc_text WHERE doc_id = ?', (doc_id,)))
+        if fields is not None:
+            texts = {(f, t) for f, t in texts if f in fields} | {(f, t) for f, t in old if f not in fields}
+        if old == texts:
+            return
+
+        old_grams = set().union(*[ngrams(text) for _, text in old]) if old else set()
+        new_grams = set().union(*[ngrams(text) for _, text in texts]) if texts else set()
+        for gram in new_grams - old_grams:
+            self.added.setdefault(gram, set()).add(doc_id)
+            self.removed.get(gram, set()).discard(doc_id)
+        for gram in old_grams - new_grams:
+            self.removed.setdefault(gram, set()).add(doc_id)
+            self.added.get(gram, set()).discard(doc_id)
+
+        self.db.execute('DELETE FROM doc_text WHERE doc_id = ?', (doc_id,))
+        self.db.executemany('INSERT INTO doc_text (doc_id, field, text) VALUES (?, ?, ?)',
+                            [(doc_id, field, text) for field, text in sorted(texts)])
+        self.docs_pending += 1
+        if self.docs_pending >= self.flush_docs:
+            self.flush()
+
+    # Page interface, fed by the loader with the rows of every page
+    def begin_page(self, key):
+        self.page = (doc_key(key), [])
+
+    def add(self, table, row):
+        if self.page is not None:
+            for column, field in indexed_columns.get(table, ()):
+                if row.get(column):
+                    self.page[1].append((field, row[column]))
+
+    def abort_page(self):
+        self.page = None
+
+    def end_page(self):
+        if self.page is not None:
+            self.replace(self.page[0], self.page[1], self.fields)
+        self.page = None
+
+    def _chunks(self, gram):
+        return self.db.execute('SELECT seq, n FROM posting_chunk WHERE gram = ? ORDER BY seq', (gram,)).fetchall()
+
+    def _read_chunk(self, gram, seq):
+        docs, removed = self.db.execute('SELECT docs, removed FROM posting_chunk WHERE gram = ? AND seq = ?',
+                                        (gram, seq)).fetchone()
+        return set(decode_postings(docs)), set(decode_postings(removed))
+
+    def flush(self):
+        """Append the pending changes to the posting lists."""
+        for gram in set(self.added) | set(self.removed):
+            chunks = self._chunks(gram)
+            chunk = (set(self.added.get(gram, ())), set(self.removed.get(gram, ())))
+            if not chunks:
+                chunk = (chunk[0], set())
+            # Merge with the chunks not much larger than the new one only
+            while chunks and chunks[-1][1] <= 2 * (len(chunk[0]) + len(chunk[1])):
+                seq, n = chunks.pop()
+                chunk = merge_chunks(self._read_chunk(gram, seq), chunk, not chunks)
+                self.db.execute('DELETE FROM posting_chunk WHERE gram = ? AND seq = ?', (gram, seq))
+            if chunk[0] or chunk[1]:
+                self.db.execute('INSERT INTO posting_chunk (gram, seq, n, docs, removed) VALUES (?, ?, ?, ?, ?)',
+                                (gram, chunks[-1][0] + 1 if chunks else 0, len(chunk[0]) + len(chunk[1]),
+                                 encode_postings(sorted(chunk[0])), encode_postings(sorted(chunk[1]))))
+        self.db.commit()
+        self.added = {}
+        self.removed = {}
+        self.docs_pending = 0
+
+    def posting_size(self, gram):
+        """Upper bound of the number of documents holding the n-gram, without reading its list."""
+        row = self.db.execute('SELECT SUM(n) FROM posting_chunk WHERE gram = ?', (gram,)).fetchone()
+        return row[0] or 0
+
+    def postings(self, gram):
+        doc_ids = set()
+        for docs, removed in self.db.execute('SELECT docs, removed FROM posting_chunk WHERE gram = ? ORDER BY seq',
+                                             (gram,)):
+            doc_ids -= set(decode_postings(removed))
+            doc_ids |= set(decode_postings(docs))
+        return sorted(doc_ids)
+
+    def search(self, query, field=None, limit=None):
+        """Return the keys of the documents whose text (of the given field) contains the query."""
+        text = normalize(query)
+        if not text:
+            return []
+
+        if len(text) < 2:
+            # Single characters are not indexed; scan the stored texts instead
+            sql = 'SELECT DISTINCT doc_id FROM doc_text WHERE instr(text, ?) > 0' + (' AND field = ?' if field else '')
+            candidates = [r[0] for r in self.db.execute(sql, (text, field) if field else (text,))]
+        else:
+            grams = sorted(ngrams(text, (3,) if len(text) >= 3 else (2,)), key=self.posting_size)
+            candidates = set(self.postings(grams[0]))
+            for gram in grams[1:]:
+                # Once the candidates are few, checking their texts is cheaper than reading long lists
+                if len(candidates) * 8 < self.posting_size(gram):
+                    break
+                candidates.intersection_update(self.postings(gram))
+            candidates = sorted(candidates)
+
+        keys = []
+        for doc_id in candidates:
+            texts = self.db.execute('SELECT field, text FROM doc_text WHERE doc_id = ?', (doc_id,))
+            if any(text in t and (field is None or f == field) for f, t in texts):
+                keys.append(self.db.execute('SELECT doc_key FROM doc WHERE doc_id = ?', (doc_id,)).fetchone()[0])
+                if limit is not None and len(keys) >= limit:
+                    break
+        return keys
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def index_records(index, record_file):
+    """Index pages persisted by the extractors (or the loader's --save_records)."""
+    pages = 0
+    for kind, key, tables in record_store.read_records(record_file):
+        index.begin_page(key)
+        for table, rows in tables.items():
+            for row in rows:
+                index.add(table, row)
+        index.end_page()
+        pages += 1
+    return pages
+
+
+def parse_args():
+    p = OptionParser()
+    p.add_option('-x', '--index', action='store',
+                 dest='index', type='string', default='text_index.db')
+    p.add_option('-r', '--records', action='store',
+                 dest='records', type='string', default='')
+    p.add_option('-q', '--query', action='store',
+                 dest='query', type='string', default='')
+    p.add_option('-t', '--field', action='store',
+                 dest='field', type='string', default='')  # subject, item or tenderer
+    p.add_option('-n', '--limit', action='store',
+                 dest='limit', type='int', default=0)
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+    options, remainder = parse_args()
+
+    index = TextIndex(options.index.strip())
+
+    r = options.records.strip()
+    if r != '':
+        if not os.path.isfile(r):
+            logger.error('File not found: ' + r)
+            quit(_ERRCODE_FILENAME)
+        logger.info('{} page(s) indexed.'.format(index_records(index, r)))
+        index.flush()
+
+    if options.query.strip():
+        for key in index.search(options.query.strip(), options.field.strip() or None, options.limit or None):
+            print(key)
+
+    index.close()
@@ -0,0 +1,171 @@
+#!/usr/bin/python
+#  -*- coding: utf-8 -*-
+""" Directory watcher for incremental loading
+
+Uses Linux inotify (through ctypes, no extra dependency) and falls back to polling
+file modification times on other platforms."""
+
+import os
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+
+__author__ = "Yu-chun Huang"
+__version__ = "1.0.0b"
+
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_candidate(name):
+    return not name.startswith('.') and not name.endswith('.tmp')
+
+
+def scan(directory):
+    for root, dirs, files in os.walk(directory):
+        for f in files:
+            if is_candidate(f):
+                yield os.path.join(root, f)
+
+
+class InotifyWatcher(object):
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError('libc not found')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError('inotify is not supported')
+
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+        self._add_tree(directory)
+
+    def _add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd < 0:
+            logger.warning('Fail to watch directory: %s (errno %d)', path, ctypes.get_errno())
+        else:
+            self.watches[wd] = path
+
+    def _add_tree(self, directory):
+        for root, dirs, files in os.walk(directory):
+            self._add_watch(root)
+
+    def read(self, timeout):
+        """Return the files written or moved into the tree within timeout seconds."""
+        try:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+        except InterruptedError:
+            return []
+        if not ready:
+            return []
+
+        buf = os.read(self.fd, 65536)
+        paths = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(buf[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                logger.warning('Event queue overflow, rescanning watched directories')
+                for path in list(self.watches.values()):
+                    paths.extend(os.path.join(path, f) for f in os.listdir(path)
+                                 if is_candidate(f) and os.path.isfile(os.path.join(path, f)))
+                continue
+
+            parent = self.watches.get(wd)
+            if parent is None or not name:
+                continue
+            path = os.path.join(parent, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may land in a new subdirectory before its watch is in place
+                    self._add_tree(path)
+                    paths.extend(scan(path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and is_candidate(name):
+                paths.append(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    def __init__(self, directory, poll_interval=5.0):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.last_poll = time.time()
+        self.seen = self._stat_tree()
+
+    def _stat_tree(self):
+        seen = {}
+        for path in scan(self.directory):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            seen[path] = (st.st_mtime, st.st_size)
+        return seen
+
+    def read(self, timeout):
+        time.sleep(timeout)
+        if time.time() - self.last_poll < self.poll_interval:
+            return []
+        self.last_poll = time.time()
+        current = self._stat_tree()
+        paths = [path for path, st in current.items() if self.seen.get(path) != st]
+        self.seen = current
+        return paths
+
+    def close(self):
+        pass
+
+
+def open_watcher(directory):
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError) as e:
+        logger.info('inotify unavailable, polling %s instead (%s)', directory, e)
+        return PollingWatcher(directory)
+
+
+def watch_batches(watcher, stop_event, batch_size=100, batch_interval=2.0):
+    """Yield batches of changed files until stop_event is set.
+
+    A batch is emitted once batch_size files are pending or batch_interval seconds after its
+    first file arrived. Files changed several times within a batch are listed once."""
+    pending = {}
+    first_arrival = None
+    while not stop_event.is_set():
+        wait = batch_interval if first_arrival is None \
+            else max(0.0, first_arrival + batch_interval - time.time())
+        for path in watcher.read(min(wait, 1.0)):
+            pending[path] = None
+            if first_arrival is None:
+                first_arrival = time.time()
+
+        if pending and (len(pending) >= batch_size or time.time() - first_arrival >= batch_interval):
+            yield list(pending)
+            pending = {}
+            first_arrival = None
+
+    # Graceful shutdown: hand out what has been seen so far
+    if pending:
+        yield list(pending)
@@ -0,0 +1,54 @@
+-- Query workload the secondary indexes of migrate.py are chosen for.
+-- Every query starts with "-- name: <name>"; parameters are filled in by benchmark_workload.py.
+
+-- name: awards_by_awarding_date
+-- Awards decided within a period (award_info_awarding_date_idx)
+SELECT pk_atm_main, tender_case_no, awarding_date, total_award_price
+FROM award_info
+WHERE awarding_date BETWEEN %(date_start)s AND %(date_end)s;
+
+-- name: awards_announced_in_month
+-- Notices announced in one month (award_info_announce_date_idx)
+SELECT COUNT(*), SUM(total_award_price)
+FROM award_info
+WHERE awarding_announce_date >= %(month_start)s AND awarding_announce_date < %(month_end)s;
+
+-- name: awards_of_agency
+-- Latest awards of an agency (organization_info_org_idx)
+SELECT o.pk_atm_main, o.tender_case_no, a.awarding_date, a.total_award_price
+FROM organization_info o
+JOIN award_info a ON a.pk_atm_main = o.pk_atm_main AND a.tender_case_no = o.tender_case_no
+WHERE o.org_id = %(org_id)s
+ORDER BY a.awarding_date DESC
+LIMIT 100;
+
+-- name: bids_of_vendor
+-- Bids and wins of a vendor (tender_info_tenderer_idx)
+SELECT pk_atm_main, tender_case_no, is_awarded, award_price
+FROM tender_info
+WHERE tenderer_id = %(tenderer_id)s;
+
+-- name: wins_of_vendor
+-- Won bids only, answered from the index prefix (tender_info_tenderer_idx)
+SELECT COUNT(*), SUM(award_price)
+FROM tender_info
+WHERE tenderer_id = %(tenderer_id)s AND is_awarded = '1';
+
+-- name: openings_between
+-- Tenders opened within a period (procurement_info_opening_date_idx)
+SELECT pk_atm_main, tender_case_no, opening_date, subject_of_procurement
+FROM procurement_info
+WHERE opening_date >= %(date_start)s AND opening_date < %(date_end)s;
+
+-- name: declarations_of_agency
+-- Recent declarations of an agency (tender_declaration_org_date_idx)
+SELECT primary_key, tender_case_no, publication_date, budget_amount
+FROM tender_declaration_info
+WHERE org_id = %(org_id)s AND publication_date >= %(date_start)s
+ORDER BY publication_date DESC;
+
+-- name: declarations_published_in_month
+-- Declarations published in one month (tender_declaration_publication_idx)
+SELECT COUNT(*)
+FROM tender_declaration_info
+WHERE publication_date >= %(month_start)s AND publication_date < %(month_end)s;